@@ -0,0 +1,576 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: benchmarks.py
+Author: zlamberty
+Created: 2016-01-16
+
+Description:
+    timings for the hot paths of the win bump pipeline on synthetic data of
+    increasing size (see synthetic.py), so that we see how things scale and
+    not just a single data point
+
+    the page parsing benchmarks run over recorded fixture pages (a directory
+    in the replay_server.py layout) when given one, and over synthetic
+    espn-like pages otherwise
+
+    the season loading benchmarks write synthetic cfbstats seasons to a
+    scratch directory and point season_cache / play_table / downanddistance
+    at it, so they never touch (or depend on) ./data
+
+    the import benchmark imports each module in a fresh interpreter with
+    every import timed (like python 3's -X importtime, cumulative), and
+    reports which heavy dependencies got pulled in along the way
+
+    every run can be saved as json (--json), tagged with the commit it ran
+    on; --compare lines up the timings of two such files (or of a saved file
+    and the current run) and flags the ones that got slower.
+
+Usage:
+    python benchmarks.py [--seasons 14 25 50] [--teams 120 300] [--plays 1 4]
+        [--by-week] [--pages DIR] [--imports] [--json OUT] [--compare BASE [NEW]]
+
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import conference_membership_history as cmh
+import downanddistance as dnd
+import game_results_history as grh
+import logconfig
+import play_table
+import ranking_history as rh
+import replay_server
+import season_cache as sc
+import synthetic
+import win_bump_value as wbv
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+logger = logging.getLogger("benchmarks")
+IMPORT_MODULES = [
+    'win_bump_value', 'ranking_history', 'game_results_history',
+    'conference_membership_history', 'get_stats', 'downanddistance',
+    'season_cache', 'render',
+]
+HEAVY_MODULES = [
+    'yaml', 'requests', 'lxml', 'numpy', 'pandas', 'scipy', 'matplotlib', 'pylab',
+]
+# run in a fresh interpreter: time every (first) import of a module,
+# including the imports it does in turn
+IMPORT_PROBE = """
+import json, sys, time
+try:
+    import __builtin__ as builtins
+except ImportError:
+    import builtins
+_import = builtins.__import__
+times = {{}}
+def timed_import(name, *args, **kwargs):
+    new = name not in sys.modules
+    t0 = time.time()
+    try:
+        return _import(name, *args, **kwargs)
+    finally:
+        if new and name in sys.modules and name not in times:
+            times[name] = time.time() - t0
+builtins.__import__ = timed_import
+t0 = time.time()
+import {module}
+total = time.time() - t0
+print(json.dumps({{'total': total, 'times': times, 'modules': list(sys.modules)}}))
+"""
+
+
+# ----------------------------- #
+#   benchmark helpers           #
+# ----------------------------- #
+
+def best_of(func, args=(), kwargs=None, repeat=3):
+    """ best wall-clock time (seconds) of repeat calls to func """
+    kwargs = kwargs or {}
+    best = None
+    for i in range(repeat):
+        t0 = time.time()
+        func(*args, **kwargs)
+        dt = time.time() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+@contextlib.contextmanager
+def quietly():
+    """ swallow stdout (DownAndDistance prints its progress) """
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+@contextlib.contextmanager
+def synthetic_data(nseasons, nteams, ystart=2005):
+    """ scratch data directory with nseasons synthetic cfbstats seasons of
+        nteams teams, that season_cache, play_table and downanddistance read
+        from for the duration; yields (years, number of plays)
+
+    """
+    datadir = tempfile.mkdtemp(prefix='cfb-bench-')
+    saved = (sc.DATA_DIR, sc.F_CSV, sc.CACHE_DIR)
+    try:
+        years = range(ystart, ystart + nseasons)
+        nplays = sum(synthetic.cfbstats_season(datadir, y, nteams=nteams) for y in years)
+        sc.DATA_DIR = datadir
+        sc.F_CSV = os.path.join(datadir, '{year:}', '{name:}.csv')
+        sc.CACHE_DIR = os.path.join(datadir, '{year:}', '.npcache', '{name:}')
+        yield years, nplays
+    finally:
+        (sc.DATA_DIR, sc.F_CSV, sc.CACHE_DIR) = saved
+        shutil.rmtree(datadir, ignore_errors=True)
+
+
+def git_revision():
+    """ the commit the working tree is at (with -dirty for local changes) """
+    try:
+        out = subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=HERE,
+            stderr=open(os.devnull, 'w')
+        )
+        return out.decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ----------------------------- #
+#   benchmarks                  #
+# ----------------------------- #
+
+def bench_season_loading(seasons=(1, 4), teams=(120,), repeat=3):
+    """ loading synthetic cfbstats seasons vs. number of seasons and teams
+
+        build_play_table: the play tables from the per-event csvs
+        team_and_game_dics: DownAndDistance's csv team and game loaders
+        load_cold: DownAndDistance from nothing but the csvs (column caches,
+            play tables and situation cubes are all built)
+        load_warm: DownAndDistance again, from the caches
+
+    """
+    timings = []
+    for m in teams:
+        for n in seasons:
+            with synthetic_data(n, m) as (years, nplays):
+                dd = dnd.DownAndDistance.__new__(dnd.DownAndDistance)
+                row = {'nseasons': n, 'nteams': m, 'nplays': nplays}
+                with quietly():
+                    row['team_and_game_dics'] = best_of(
+                        lambda: (dd.update_team_dic(years), dd.update_game_dic(years)),
+                        repeat=repeat
+                    )
+                    row['load_cold'] = best_of(dnd.DownAndDistance, (years,), repeat=1)
+                    row['load_warm'] = best_of(dnd.DownAndDistance, (years,), repeat=repeat)
+                row['build_play_table'] = sum(
+                    best_of(play_table.build_play_table, (y,), repeat=repeat) for y in years
+                )
+            logger.info('season loading: {}'.format(row))
+            timings.append(row)
+    return timings
+
+
+def bench_frames(seasons=(14, 25, 50), teams=(120,), repeat=3):
+    """ rankings_frame / results_frame (the get_rankings / get_game_results
+        dataframes) from synthetic scraped records
+
+    """
+    timings = []
+    for m in teams:
+        for n in seasons:
+            rankings, results = synthetic.rankings_and_results(nseasons=n, nteams=m)
+            rankingRecords, conferenceRecords, resultRecords = synthetic.scraped_records(
+                rankings, results
+            )
+            row = {
+                'nseasons': n,
+                'nteams': m,
+                'nrows': len(rankingRecords),
+                'rankings_frame': best_of(
+                    wbv.rankings_frame, (rankingRecords, conferenceRecords), repeat=repeat
+                ),
+                'results_frame': best_of(wbv.results_frame, (resultRecords,), repeat=repeat),
+            }
+            logger.info('frames: {}'.format(row))
+            timings.append(row)
+    return timings
+
+
+def bench_rankings_delta(seasons=(14, 25, 50), teams=(120,), byWeek=False, repeat=3):
+    """ get_rankings_delta runtime vs. number of seasons and teams
+
+        14 seasons is the real 2002 - 2015 range. With byWeek=True the
+        week-at-a-time reference implementation is timed as well.
+
+    """
+    timings = []
+    for m in teams:
+        for n in seasons:
+            rankings, results = synthetic.rankings_and_results(nseasons=n, nteams=m)
+            row = {
+                'nseasons': n,
+                'nteams': m,
+                'nrows': len(rankings),
+                'get_rankings_delta': best_of(
+                    wbv.get_rankings_delta, (rankings, results), repeat=repeat
+                ),
+            }
+            if byWeek:
+                row['get_rankings_delta_by_week'] = best_of(
+                    wbv.get_rankings_delta_by_week, (rankings, results), repeat=1
+                )
+            logger.info('rankings delta: {}'.format(row))
+            timings.append(row)
+    return timings
+
+
+def bench_jump_stats(teams=(120,), repeat=3):
+    """ jump_counts vs. the row-by-row jump_stats for one week of deltas """
+    timings = []
+    for m in teams:
+        rankings, results = synthetic.rankings_and_results(nseasons=1, nweeks=2, nteams=m)
+        delta = wbv.get_rankings_delta(rankings, results)
+        wDelta = delta[delta.week == 1].reset_index(drop=True)
+        stats = lambda: wDelta.apply(wbv.jump_stats, axis=1, args=(wDelta,))
+        counts = wbv.jump_counts(wDelta)
+        assert (stats()[counts.columns].values == counts.values).all()
+
+        row = {
+            'nteams': m,
+            'nrows': len(wDelta),
+            'jump_counts': best_of(wbv.jump_counts, (wDelta,), repeat=repeat),
+            'jump_stats': best_of(stats, repeat=1),
+        }
+        logger.info('jump stats: {}'.format(row))
+        timings.append(row)
+    return timings
+
+
+def fixture_pages(pagedir, marker):
+    """ texts of the recorded pages in pagedir that contain marker """
+    return [
+        body.decode('utf-8') for body in replay_server.load_pages(pagedir).values()
+        if marker in body
+    ]
+
+
+def ranking_pages(pagedir=None, nweeks=30):
+    """ list of rankings page texts: recorded ones from pagedir, or nweeks
+        synthetic ones
+
+    """
+    if pagedir:
+        return fixture_pages(pagedir, b'rankings has-team-logos')
+    rankings, results = synthetic.rankings_and_results(nseasons=1, nweeks=nweeks)
+    return [synthetic.rankings_page(r) for (w, r) in rankings.groupby('week')]
+
+
+def scoreboard_pages(pagedir=None, nweeks=30):
+    """ list of scoreboard page texts: recorded ones from pagedir, or nweeks
+        synthetic ones
+
+    """
+    if pagedir:
+        return fixture_pages(pagedir, grh.SB_MARKER)
+    rankings, results = synthetic.rankings_and_results(nseasons=1, nweeks=nweeks)
+    return [synthetic.scoreboard_page(r) for (w, r) in results.groupby('week')]
+
+
+def standings_pages(pagedir=None, nseasons=14):
+    """ list of standings page texts: recorded ones from pagedir, or
+        nseasons synthetic ones
+
+    """
+    if pagedir:
+        return fixture_pages(pagedir, b'standings has-team-logos')
+    rankings, results = synthetic.rankings_and_results(nseasons=nseasons, nweeks=1)
+    conferences = rankings[['fullname', 'codename', 'year', 'conf']].drop_duplicates()
+    return [synthetic.standings_page(c) for (y, c) in conferences.groupby('year')]
+
+
+def bench_parse_rankings(pagedir=None, repeat=3):
+    """ parse_rankings vs. the original parse_rankings_by_row """
+    pages = ranking_pages(pagedir)
+    parse = lambda parser: [parser(text, 0, 0) for text in pages]
+    assert parse(rh.parse_rankings) == parse(rh.parse_rankings_by_row)
+
+    row = {'npages': len(pages)}
+    for parser in [rh.parse_rankings, rh.parse_rankings_by_row]:
+        row[parser.__name__] = best_of(parse, (parser,), repeat=repeat)
+    logger.info('ranking parsers: {}'.format(row))
+    return row
+
+
+def bench_parse_results(pagedir=None, repeat=3):
+    """ parse_results vs. the original parse_results_dom """
+    pages = scoreboard_pages(pagedir)
+    parse = lambda parser: [parser(text, 0, 0) for text in pages]
+
+    row = {'npages': len(pages)}
+    for parser in [grh.parse_results, grh.parse_results_dom]:
+        row[parser.__name__] = best_of(parse, (parser,), repeat=repeat)
+    logger.info('result parsers: {}'.format(row))
+    return row
+
+
+def bench_parse_conferences(pagedir=None, repeat=3):
+    """ parse_conferences over standings pages """
+    pages = standings_pages(pagedir)
+    parse = lambda: [cmh.parse_conferences(text) for text in pages]
+
+    row = {
+        'npages': len(pages),
+        'parse_conferences': best_of(parse, repeat=repeat),
+    }
+    logger.info('conference parser: {}'.format(row))
+    return row
+
+
+def import_profile(module):
+    """ (total seconds, {imported name: cumulative seconds}, [modules loaded])
+        for importing module in a fresh interpreter
+
+    """
+    out = subprocess.check_output(
+        [sys.executable, '-W', 'ignore', '-c', IMPORT_PROBE.format(module=module)],
+        cwd=HERE
+    )
+    res = json.loads(out.decode('utf-8').strip().splitlines()[-1])
+    return res['total'], res['times'], res['modules']
+
+
+def bench_imports(modules=IMPORT_MODULES, repeat=3, top=5):
+    """ best-of-repeat import time of each module, the heavy dependencies it
+        loads, and its slowest (cumulative) imports
+
+    """
+    timings = []
+    for module in modules:
+        runs = [import_profile(module) for i in range(repeat)]
+        total, times, loaded = min(runs, key=lambda r: r[0])
+        row = {
+            'module': module,
+            'import': total,
+            'heavy': [m for m in HEAVY_MODULES if m in loaded],
+            'slowest': sorted(
+                ((name, t) for (name, t) in times.items() if name != module),
+                key=lambda x: -x[1]
+            )[:top],
+        }
+        logger.info('imports: {}'.format(row))
+        timings.append(row)
+    return timings
+
+
+# ----------------------------- #
+#   results                     #
+# ----------------------------- #
+
+def split_row(row):
+    """ (params, timings) of a benchmark row: floats are timings (seconds),
+        other scalars describe the run, lists are details
+
+    """
+    params = dict(
+        (k, v) for (k, v) in row.items()
+        if not isinstance(v, (float, list, tuple, dict))
+    )
+    timings = dict((k, v) for (k, v) in row.items() if isinstance(v, float))
+    return params, timings
+
+
+def save_results(fname, results):
+    """ write {benchmark name: [rows]} to fname as json, with the commit and
+        environment they were measured on
+
+    """
+    doc = {
+        'revision': git_revision(),
+        'created': time.time(),
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'benchmarks': results,
+    }
+    with open(fname, 'wb') as f:
+        f.write(json.dumps(doc, indent=2, sort_keys=True).encode('utf-8'))
+    logger.info('benchmark results written to {}'.format(fname))
+
+
+def load_results(fname):
+    with open(fname, 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def compare_results(base, new, threshold=0.1):
+    """ list of (benchmark, params, timing, base seconds, new seconds, ratio)
+        for every timing the two result docs have in common, and whether any
+        of them is more than threshold (fractionally) slower
+
+    """
+    rows = []
+    for (name, newRows) in sorted(new['benchmarks'].items()):
+        baseRows = base['benchmarks'].get(name, [])
+        baseRows = baseRows if isinstance(baseRows, list) else [baseRows]
+        newRows = newRows if isinstance(newRows, list) else [newRows]
+        baseTimings = dict(
+            (json.dumps(params, sort_keys=True), timings)
+            for (params, timings) in map(split_row, baseRows)
+        )
+        for (params, timings) in map(split_row, newRows):
+            old = baseTimings.get(json.dumps(params, sort_keys=True), {})
+            for (k, t) in sorted(timings.items()):
+                if k in old and old[k] > 0:
+                    rows.append((name, params, k, old[k], t, t / old[k]))
+    slower = any(ratio > 1 + threshold for (n, p, k, t0, t1, ratio) in rows)
+    return rows, slower
+
+
+def print_comparison(base, new, threshold=0.1):
+    rows, slower = compare_results(base, new, threshold)
+    print('{} --> {}'.format(base.get('revision'), new.get('revision')))
+    print('{:>20} {:>36} {:>28} {:>10} {:>10} {:>7}'.format(
+        'benchmark', 'params', 'timing', 'base (s)', 'new (s)', 'ratio'
+    ))
+    for (name, params, k, t0, t1, ratio) in rows:
+        print('{:>20} {:>36} {:>28} {:>10.3f} {:>10.3f} {:>7.2f}{}'.format(
+            name,
+            ' '.join('{}={}'.format(p, v) for (p, v) in sorted(params.items())),
+            k, t0, t1, ratio,
+            ' *' if ratio > 1 + threshold else ''
+        ))
+    return slower
+
+
+def print_rows(title, rows):
+    """ one table per benchmark: the run description, then the timings """
+    rows = rows if isinstance(rows, list) else [rows]
+    params, timings = split_row(rows[0])
+    pcols, tcols = sorted(params), sorted(timings)
+    print('\n{}'.format(title))
+    print(' '.join(['{:>10}'.format(c) for c in pcols] + ['{:>24}'.format(c) for c in tcols]))
+    for row in rows:
+        print(' '.join(
+            ['{:>10}'.format(row.get(c)) for c in pcols]
+            + ['{:>24.3f}'.format(row[c]) if c in row else '{:>24}'.format('-') for c in tcols]
+        ))
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def run(seasons=(14, 25, 50), teams=(120,), plays=(1, 4), byWeek=False, pagedir=None,
+        imports=False):
+    """ dict of benchmark name --> rows (or row) of timings """
+    results = {}
+    if imports:
+        results['imports'] = bench_imports()
+    results['season_loading'] = bench_season_loading(seasons=plays, teams=teams)
+    results['frames'] = bench_frames(seasons=seasons, teams=teams)
+    results['rankings_delta'] = bench_rankings_delta(seasons=seasons, teams=teams, byWeek=byWeek)
+    results['jump_stats'] = bench_jump_stats(teams=teams)
+    results['parse_rankings'] = bench_parse_rankings(pagedir=pagedir)
+    results['parse_results'] = bench_parse_results(pagedir=pagedir)
+    results['parse_conferences'] = bench_parse_conferences(pagedir=pagedir)
+    return results
+
+
+def main(seasons=(14, 25, 50), teams=(120,), plays=(1, 4), byWeek=False, pagedir=None,
+         imports=False, out=None, compare=None, threshold=0.1):
+    """ run the benchmarks and print a summary (or just compare two saved
+        runs); returns 1 if a comparison found something slower, else 0
+
+    """
+    if compare and len(compare) == 2:
+        return int(print_comparison(load_results(compare[0]), load_results(compare[1]), threshold))
+
+    results = run(
+        seasons=seasons, teams=teams, plays=plays, byWeek=byWeek, pagedir=pagedir,
+        imports=imports
+    )
+
+    if imports:
+        print('{:>32} {:>10}  {}'.format('module', 'import (s)', 'heavy dependencies loaded'))
+        for row in results['imports']:
+            print('{:>32} {:>10.3f}  {}'.format(
+                row['module'], row['import'], ', '.join(row['heavy']) or '-'
+            ))
+    for (name, rows) in sorted(results.items()):
+        if name != 'imports':
+            print_rows(name, rows)
+
+    if out:
+        save_results(out, results)
+    if compare:
+        print('')
+        return int(print_comparison(
+            load_results(compare[0]),
+            {'revision': git_revision(), 'benchmarks': results},
+            threshold
+        ))
+    return 0
+
+
+# ----------------------------- #
+#   Command line                #
+# ----------------------------- #
+
+def parse_args():
+    """ Take a log file from the commmand line """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seasons", help="numbers of seasons to time", type=int, nargs='*', default=[14, 25, 50])
+    parser.add_argument("--teams", help="numbers of teams to time", type=int, nargs='*', default=[120])
+    parser.add_argument("--plays", help="numbers of synthetic play-by-play seasons to load", type=int, nargs='*', default=[1, 4])
+    parser.add_argument("--by-week", help="also time the week-at-a-time reference", action='store_true')
+    parser.add_argument("--pages", help="directory of recorded fixture pages")
+    parser.add_argument("--imports", help="also time importing the modules", action='store_true')
+    parser.add_argument("--json", help="write the results to this json file")
+    parser.add_argument("--compare", help="saved results to compare this run (or a second saved file) with", nargs='+', metavar='RESULTS')
+    parser.add_argument("--threshold", help="fraction slower that counts as a regression", type=float, default=0.1)
+
+    args = parser.parse_args()
+
+    logger.debug("arguments set to {}".format(vars(args)))
+
+    return args
+
+
+if __name__ == '__main__':
+
+    logconfig.configure()
+
+    args = parse_args()
+
+    raise SystemExit(main(
+        seasons=args.seasons,
+        teams=args.teams,
+        plays=args.plays,
+        byWeek=args.by_week,
+        pagedir=args.pages,
+        imports=args.imports,
+        out=args.json,
+        compare=args.compare,
+        threshold=args.threshold,
+    ))
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: buoyancy_bootstrap.py
+Author: zlamberty
+Created: 2016-04-16
+
+Description:
+    bootstrap confidence intervals for the win buoyancy of win_bump_value:
+    the mean rank_delta and jump counts of get_rankings_delta's rows, by
+    conference, rank type and venue (home / away / neutral / didn't play)
+
+    the resampling is stratified: every replicate redraws the rows of each
+    group from that group (same size), so groups are comparable replicate by
+    replicate -- the difference of two groups' replicates is the bootstrap
+    distribution of the difference of their means (see difference).
+
+    rows are sorted by group, so a replicate is one array of row indices
+    (the start of each row's group plus a uniform draw below its size) and
+    the group sums of all the statistics are one np.add.reduceat over the
+    gathered rows. Batches of replicates are spread over a process pool; the
+    input arrays are written once to .npy files that every worker memory
+    maps, so they are shared and read only. Each batch has its own seed, so
+    results don't depend on the number of processes.
+
+Usage:
+    delta = venue(wbv.get_rankings_delta(rankings, results), results)
+    boot = bootstrap(delta[delta.won], nreps=2000, processes=None)
+    print(boot.summary())
+    print(boot.difference(('Southeastern Conference', 'ap', 'home'),
+                          ('Pac-12 Conference', 'ap', 'home')))
+
+    python buoyancy_bootstrap.py [--reps 2000] [--processes N] [--won | --lost]
+
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import lazyimport
+import logconfig
+import metrics
+
+pd = lazyimport.lazy_import('pandas')
+wbv = lazyimport.lazy_import('win_bump_value')
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+GROUPS = ['conf', 'rank_type', 'venue']
+STATS = [
+    'rank_delta', 'teams_jumped', 'teams_jumped_by', 'winning_teams_jumped',
+    'winning_teams_jumped_by',
+]
+NREPS = 2000
+# replicates per pool task, and the most gathered values held at once
+BATCH = 100
+BUDGET = 10 ** 7
+ALPHA = 0.05
+SEED = 1337
+ARRAYS = ['values', 'starts', 'sizes']
+logger = logging.getLogger("buoyancy_bootstrap")
+
+_shared = {}
+
+
+# ----------------------------- #
+#   input                       #
+# ----------------------------- #
+
+def venue(delta, results):
+    """ delta with a 'venue' column: where the team played that week --
+        'home', 'away', 'neutral' or 'none' (didn't play)
+
+    """
+    games = pd.concat([
+        results[['year', 'week', side, 'home_team', 'is_neutral_site']].rename(
+            columns={side: 'codename'}
+        )
+        for side in ['team_0', 'team_1']
+    ], ignore_index=True).drop_duplicates(['year', 'week', 'codename'])
+    games.loc[:, 'venue'] = np.where(
+        games.is_neutral_site.astype(bool), 'neutral',
+        np.where(games.codename == games.home_team, 'home', 'away')
+    )
+    delta = delta.merge(
+        games[['year', 'week', 'codename', 'venue']], how='left',
+        on=['year', 'week', 'codename']
+    )
+    delta.loc[:, 'venue'] = delta.venue.fillna('none')
+    return delta
+
+
+def grouped(delta, groups=GROUPS, stats=STATS):
+    """ (dataframe of the group keys, float array of the stats with rows
+        sorted by group, start row of every group, size of every group);
+        ValueError if no row has all of them
+
+    """
+    df = delta.dropna(subset=list(groups) + list(stats))
+    if len(df) < len(delta):
+        logger.info('{} of {} rows lack a group key or statistic'.format(
+            len(delta) - len(df), len(delta)
+        ))
+    if df.empty:
+        raise ValueError('no rows with all of {} ({} rows in)'.format(
+            list(groups) + list(stats), len(delta)
+        ))
+    gid = df.groupby(list(groups)).ngroup().values
+    order = np.argsort(gid, kind='mergesort')
+    sizes = np.bincount(gid)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    keys = df[list(groups)].iloc[order].iloc[starts].reset_index(drop=True)
+    values = np.ascontiguousarray(df[list(stats)].values[order], dtype=np.float64)
+    return keys, values, starts, sizes
+
+
+# ----------------------------- #
+#   replicates                  #
+# ----------------------------- #
+
+def resample_means(values, starts, sizes, nreps, rng):
+    """ (nreps, groups, stats) array of the group means of nreps stratified
+        replicates of values (rows sorted by group)
+
+    """
+    n, k = values.shape
+    rowStart = np.repeat(starts, sizes)
+    rowSize = np.repeat(sizes, sizes)
+    out = np.empty((nreps, len(sizes), k))
+    step = max(1, BUDGET // max(n * k, 1))
+    for i in range(0, nreps, step):
+        b = min(step, nreps - i)
+        ix = rowStart + (rng.random_sample((b, n)) * rowSize).astype(np.intp)
+        out[i:i + b] = np.add.reduceat(values[ix], starts, axis=1)
+    return out / sizes[np.newaxis, :, np.newaxis]
+
+
+def _init_worker(fdir):
+    """ memory map the shared input in a pool worker """
+    for name in ARRAYS:
+        _shared[name] = np.load(os.path.join(fdir, '{}.npy'.format(name)), mmap_mode='r')
+
+
+def _replicates(task):
+    """ group means of one batch of replicates: task is (seed, nreps) """
+    (seed, nreps) = task
+    return resample_means(
+        _shared['values'], _shared['starts'], _shared['sizes'], nreps,
+        np.random.RandomState(seed)
+    )
+
+
+def tasks(nreps, seed=SEED, batch=BATCH):
+    """ (seed, replicates) of every batch """
+    return [
+        ([seed, i], min(batch, nreps - i * batch))
+        for i in range((nreps + batch - 1) // batch)
+    ]
+
+
+class Bootstrap(object):
+    """ observed group means and their bootstrap replicates """
+    def __init__(self, keys, sizes, observed, replicates, stats=STATS):
+        self.keys = keys
+        self.sizes = sizes
+        self.observed = observed
+        self.replicates = replicates
+        self.stats = list(stats)
+
+    def group_index(self, group):
+        """ row of a tuple of group keys """
+        match = np.ones(len(self.keys), dtype=bool)
+        for (col, val) in zip(self.keys.columns, group):
+            match &= (self.keys[col] == val).values
+        ix = np.flatnonzero(match)
+        if not len(ix):
+            raise KeyError('no group {}'.format(group))
+        return ix[0]
+
+    def summary(self, alpha=ALPHA):
+        """ dataframe of n and, for every stat, the mean, standard error and
+            percentile interval (lo, hi) of every group
+
+        """
+        q = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+        lo, hi = np.percentile(self.replicates, q, axis=0)
+        se = self.replicates.std(axis=0)
+        df = self.keys.copy()
+        df.loc[:, 'n'] = self.sizes
+        for (j, stat) in enumerate(self.stats):
+            df.loc[:, stat] = self.observed[:, j]
+            df.loc[:, '{}_se'.format(stat)] = se[:, j]
+            df.loc[:, '{}_lo'.format(stat)] = lo[:, j]
+            df.loc[:, '{}_hi'.format(stat)] = hi[:, j]
+        return df
+
+    def difference(self, first, second, stat='rank_delta', alpha=ALPHA):
+        """ (observed difference, lo, hi, fraction of replicates <= 0) of the
+            mean of stat between two groups (tuples of group keys)
+
+        """
+        i, j = self.group_index(first), self.group_index(second)
+        k = self.stats.index(stat)
+        d = self.replicates[:, i, k] - self.replicates[:, j, k]
+        lo, hi = np.percentile(d, [100 * alpha / 2, 100 * (1 - alpha / 2)])
+        return self.observed[i, k] - self.observed[j, k], lo, hi, (d <= 0).mean()
+
+
+def bootstrap(delta, groups=GROUPS, stats=STATS, nreps=NREPS, processes=1, seed=SEED):
+    """ Bootstrap of the group means of stats in delta (a venue() frame)
+
+        processes=1 runs in this process, None uses every core
+
+    """
+    with metrics.span('bootstrap', nreps=nreps) as s:
+        keys, values, starts, sizes = grouped(delta, groups, stats)
+        s.add('rows_in', len(values))
+        observed = np.add.reduceat(values, starts, axis=0) / sizes[:, np.newaxis]
+        todo = tasks(nreps, seed)
+
+        if processes == 1 or len(todo) == 1:
+            parts = [
+                resample_means(values, starts, sizes, n, np.random.RandomState(sd))
+                for (sd, n) in todo
+            ]
+        else:
+            fdir = tempfile.mkdtemp()
+            try:
+                for (name, arr) in zip(ARRAYS, [values, starts, sizes]):
+                    np.save(os.path.join(fdir, '{}.npy'.format(name)), arr)
+                pool = multiprocessing.Pool(processes, _init_worker, (fdir,))
+                try:
+                    parts = pool.map(_replicates, todo, chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+            finally:
+                shutil.rmtree(fdir)
+
+        s.add('replicates', nreps)
+    return Bootstrap(keys, sizes, observed, np.concatenate(parts), stats)
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def main(nreps=NREPS, processes=None, won=None):
+    """ bootstrap the buoyancy of the scraped history and print it """
+    rankings = wbv.get_rankings()
+    results = wbv.get_game_results()
+    delta = venue(wbv.get_rankings_delta(rankings, results), results)
+    if won is not None:
+        delta = delta[delta.won == won]
+    boot = bootstrap(delta, nreps=nreps, processes=processes)
+    columns = GROUPS + ['n', 'rank_delta', 'rank_delta_lo', 'rank_delta_hi']
+    print(boot.summary()[columns].to_string())
+
+
+# ----------------------------- #
+#   Command line                #
+# ----------------------------- #
+
+def parse_args():
+    """ Take a log file from the commmand line """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reps", help="bootstrap replicates", type=int, default=NREPS)
+    parser.add_argument("--processes", help="worker processes (default: every core)", type=int)
+    outcome = parser.add_mutually_exclusive_group()
+    outcome.add_argument(
+        "--won", help="only weeks a team won", dest='won', action='store_true', default=None
+    )
+    outcome.add_argument(
+        "--lost", help="only weeks a team didn't win", dest='won', action='store_false'
+    )
+
+    args = parser.parse_args()
+
+    logger.debug("arguments set to {}".format(vars(args)))
+
+    return args
+
+
+if __name__ == '__main__':
+
+    logconfig.configure()
+
+    args = parse_args()
+
+    main(nreps=args.reps, processes=args.processes, won=args.won)
@@ -9,23 +9,36 @@ Created: 2015-10-25
 Description:
     download conference membership history to ./data
 
+    the scraped memberships are looked up through a MembershipIndex: per
+    team, sorted [start year, end year) --> conference intervals (runs of
+    consecutive seasons in one conference), with the hand-maintained
+    overrides in conference_overrides.csv (teams espn has no or wrong
+    standings for) on top. Whole columns of (team, year) pairs are looked up
+    at once with binary searches.
+
 Usage:
     <usage>
 
 """
 
 import argparse
-import cPickle as pickle
+import csv
 import logging
-import logging.config
 import os
-import requests
 import time
-import yaml
 
-from collections import defaultdict
+from collections import OrderedDict
 from itertools import product
-from lxml import html, etree
+
+import fetch
+import lazyimport
+import metrics
+import response_store
+import scrape_cache
+
+html = lazyimport.lazy_import('lxml.html')
+etree = lazyimport.lazy_import('lxml.etree')
+np = lazyimport.lazy_import('numpy')
 
 
 # ----------------------------- #
@@ -38,11 +51,11 @@ URLS = [
 ]
 HERE = os.path.dirname(os.path.realpath(__file__))
 DATA_DIR = os.path.join(HERE, 'data')
-F_CONF = os.path.join(DATA_DIR, 'conferences.y0_{ystart:}.y1_{yend:}.pkl')
+F_OVERRIDES = os.path.join(HERE, 'conference_overrides.csv')
+CONFERENCE_COLUMNS = ['fullname', 'codename', 'year', 'conf']
+# years are packed with the team into one sort key (see IntervalTable)
+YEAR_SPAN = 10000
 logger = logging.getLogger("conference_membership_history")
-LOGCONF = os.path.join(HERE, 'logging.yaml')
-with open(LOGCONF, 'rb') as f:
-    logging.config.dictConfig(yaml.load(f))
 
 
 # ----------------------------- #
@@ -59,51 +72,284 @@ class ConferenceHistory(object):
 
 
 class EspnConferenceHistory(ConferenceHistory):
-    """ iterate through the espn conferences page, parsing each page """
-    def __init__(self, urls=URLS, ystart=2002, yend=2015, fconf=F_CONF):
+    """ iterate through the espn conferences page, parsing each page
+
+        the memberships of each year (from all of the standings urls) are
+        cached together (see scrape_cache.py), so only the years that aren't
+        cached yet are fetched. The raw pages are kept in a response store, so
+        the memberships can be re-parsed without fetching anything (see
+        load_conferences).
+
+    """
+    def __init__(self, urls=URLS, ystart=2002, yend=2015,
+                 cachedir=scrape_cache.CACHE_DIR, fetcher=None):
         self.urls = urls
         self.ystart = ystart
         self.yend = yend
-        self.fconf = fconf
-        self.conferences = defaultdict(dict)
-
-    def load_conferences(self, forceReload=False):
-        """ retrun conferences """
-        if os.access(self.fconf, os.R_OK) and not forceReload:
-            with open(self.fconf, 'rb') as f:
-                self.conferences = pickle.load(f)
-        else:
-            for url in self.urls:
-                for y in range(self.ystart, self.yend + 1):
-                    rooturl = url.format(year=y)
-                    resp = requests.get(rooturl)
-                    x = html.fromstring(resp.text)
-
-                    conftables = x.xpath('//table[@class="standings has-team-logos"]')
-
-                    for conftable in conftables:
-                        longcap = conftable.find('caption/span').text
-                        teamnames = conftable.xpath('tr/td/a/span/span')
-                        teamabbrs = conftable.xpath('tr/td/a/span/abbr')
-                        for (fullname, codename) in zip(teamnames, teamabbrs):
-                            self.conferences[fullname.text, codename.text][y] = longcap
-
-                        # some teams (ahem TAMU ahem) have no links -- weird.
-                        teamnames2 = conftable.xpath('tr/td/span/span')
-                        teamabbrs2 = conftable.xpath('tr/td/span/abbr')
-                        for (fullname, codename) in zip(teamnames2, teamabbrs2):
-                            self.conferences[fullname.text, codename.text][y] = longcap
-
-            # flatten
+        self.cache = scrape_cache.UnitCache('conferences', cachedir)
+        self.fetcher = fetcher or fetch.Fetcher(store=response_store.ResponseStore())
+        self.conferences = []
+
+    def load_conferences(self, forceReload=False, reparse=False, processes=None):
+        """ retrun conferences
+
+            reparse=True rebuilds every year from the stored raw pages (in
+            parallel on `processes` cores) instead of fetching anything
+
+            the load is timed as a metrics span, with a span per page parsed
+            under it (see metrics.py)
+
+        """
+        with metrics.span('load_conferences') as stage:
+            years = range(self.ystart, self.yend + 1)
+            stage.add('units', len(years))
+            if not (forceReload or reparse):
+                todo = [y for y in years if not self.cache.has(y)]
+                stage.add('units_cached', len(years) - len(todo))
+                years = todo
+
+            uys = [(url.format(year=y), y) for y in years for url in self.urls]
+            if reparse:
+                if self.fetcher.store is None:
+                    raise ValueError('reparsing requires a fetcher with a response store')
+                with metrics.span('reparse', pages=len(uys)):
+                    parsed = response_store.reparse(
+                        self.fetcher.store,
+                        [(rooturl, ()) for (rooturl, y) in uys],
+                        parse_conferences,
+                        processes=processes
+                    )
+            else:
+                # every year is cached as soon as its pages are parsed, so an
+                # error part way through keeps the years before it
+                stage.add('pages_requested', len(uys))
+                resps = metrics.timed(
+                    self.fetcher.imap(rooturl for (rooturl, y) in uys), stage, 'fetch_seconds'
+                )
+                parsed = (self.parse_response(next(resps), y) for (rooturl, y) in uys)
+
+            # the index of the last page of every year
+            last = dict((y, i) for (i, (rooturl, y)) in enumerate(uys))
+            memberships = OrderedDict()
+            unstored = set()
+            parsed = iter(parsed)
+            for (i, (rooturl, y)) in enumerate(uys):
+                teams = next(parsed)
+                if teams is None:
+                    logger.warning('no stored page for {}'.format(rooturl))
+                    unstored.add(y)
+                else:
+                    d = memberships.setdefault(y, OrderedDict())
+                    for (fullname, codename, longcap) in teams:
+                        d[fullname, codename] = longcap
+                # a year without any teams is only cached once it is over
+                # (and all of its pages were there)
+                if i == last[y] and (memberships.get(y) or (
+                        scrape_cache.is_past_season(y) and y not in unstored)):
+                    self.cache.put(y, None, [
+                        {'fullname': fullname, 'codename': codename, 'year': y, 'conf': conf}
+                        for ((fullname, codename), conf) in memberships.pop(y, {}).items()
+                    ])
+
             self.conferences = [
-                {'fullname': fullname, 'codename': codename, 'year': year, 'conf': conf}
-                for ((fullname, codename), d) in self.conferences.items()
-                for (year, conf) in d.items()
+                conference
+                for y in range(self.ystart, self.yend + 1)
+                if self.cache.has(y)
+                for conference in self.cache.get(y)
             ]
+            stage.add('rows_out', len(self.conferences))
+
+    def parse_response(self, resp, y):
+        """ (fullname, codename, conference) memberships of a standings page """
+        with metrics.span('page', level=logging.DEBUG, year=y) as s:
+            origin = 'from_store' if getattr(resp, 'from_store', False) else 'fetched'
+            s.add('pages_{}'.format(origin))
+            s.add('bytes_{}'.format(origin), len(resp.content))
+            t0 = time.time()
+            teams = parse_conferences(resp.text)
+            s.add('parse_seconds', time.time() - t0)
+            s.add('rows_parsed', len(teams))
+        return teams
+
+    def invalidate(self, year=None):
+        """ forget cached conferences (see scrape_cache.UnitCache.invalidate) """
+        self.cache.invalidate(year)
+
+    def membership_index(self, overrides=F_OVERRIDES):
+        """ MembershipIndex of the loaded conferences """
+        return MembershipIndex.from_records(self.conferences, overrides=overrides)
+
+
+# ----------------------------- #
+#   membership intervals        #
+# ----------------------------- #
+
+class IntervalTable(object):
+    """ per key, sorted and non-overlapping [start, end) --> value intervals
+
+        stored as flat arrays sorted by (key, start); a lookup packs each
+        (key, year) into one integer and binary searches the packed starts.
+
+    """
+    def __init__(self, keys, starts, ends, values):
+        keys = np.asarray(keys, dtype=object)
+        starts = np.asarray(starts, dtype=np.int64)
+        order = np.lexsort((starts, keys.astype(unicode)))
+        self.keys = keys[order]
+        self.starts = starts[order]
+        self.ends = np.asarray(ends, dtype=np.int64)[order]
+        self.values = np.asarray(values, dtype=object)[order]
+        self._keyIndex = np.unique(self.keys.astype(unicode))
+        self._packed = self._pack(self.keys, self.starts)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_years(cls, keys, years, values):
+        """ intervals from one (key, year, value) per season: consecutive
+            years with the same value are merged (a later duplicate of a
+            (key, year) wins)
+
+        """
+        keys = np.asarray(keys, dtype=object)
+        years = np.asarray(years, dtype=np.int64)
+        values = np.asarray(values, dtype=object)
+        if len(keys) == 0:
+            return cls([], [], [], [])
+
+        order = np.lexsort((np.arange(len(keys)), years, keys.astype(unicode)))
+        keys, years, values = keys[order], years[order], values[order]
+        last = np.ones(len(keys), dtype=bool)
+        last[:-1] = (keys[1:] != keys[:-1]) | (years[1:] != years[:-1])
+        keys, years, values = keys[last], years[last], values[last]
+
+        new = np.ones(len(keys), dtype=bool)
+        new[1:] = (
+            (keys[1:] != keys[:-1])
+            | (years[1:] != years[:-1] + 1)
+            | (values[1:] != values[:-1])
+        )
+        first = np.flatnonzero(new)
+        final = np.append(first[1:], len(keys)) - 1
+        return cls(keys[first], years[first], years[final] + 1, values[first])
+
+    def _pack(self, keys, years):
+        """ one sortable integer per (key, year); -1 for unknown keys """
+        keys = np.asarray(keys, dtype=object).astype(unicode)
+        i = np.searchsorted(self._keyIndex, keys)
+        i = np.minimum(i, max(len(self._keyIndex) - 1, 0))
+        known = (self._keyIndex[i] == keys) if len(self._keyIndex) else np.zeros(len(keys), bool)
+        years = np.clip(np.asarray(years, dtype=np.int64), 0, YEAR_SPAN - 1)
+        return np.where(known, i * YEAR_SPAN + years, -1)
+
+    def lookup(self, keys, years):
+        """ the value of the interval holding each (key, year), None where
+            there isn't one
+
+        """
+        q = self._pack(keys, years)
+        out = np.empty(len(q), dtype=object)
+        if not len(self):
+            return out
+        j = np.searchsorted(self._packed, q, side='right') - 1
+        jj = np.maximum(j, 0)
+        hit = (
+            (q >= 0) & (j >= 0)
+            & (self._packed[jj] // YEAR_SPAN == q // YEAR_SPAN)
+            & (np.asarray(years) < self.ends[jj])
+        )
+        out[hit] = self.values[jj[hit]]
+        return out
+
+    def intervals(self, key):
+        """ list of (start, end, value) of one key """
+        ix = np.flatnonzero(self.keys == key)
+        return [(int(self.starts[i]), int(self.ends[i]), self.values[i]) for i in ix]
+
+
+def read_overrides(fname=F_OVERRIDES, column='conf'):
+    """ IntervalTable of fullname --> conference overrides from a csv of
+        fullname, start, end, conf (a blank start / end is open); other
+        overrides by fullname can use another value column
+
+    """
+    rows = []
+    if fname and os.path.isfile(fname):
+        with open(fname, 'rb') as f:
+            for row in csv.DictReader(f):
+                rows.append((
+                    row['fullname'].decode('utf-8'),
+                    int(row['start']) if row['start'] else 0,
+                    int(row['end']) if row['end'] else YEAR_SPAN,
+                    row[column].decode('utf-8'),
+                ))
+    return IntervalTable(*zip(*rows) if rows else ([], [], [], []))
+
+
+class MembershipIndex(object):
+    """ the conference of a team in a season: the scraped memberships (by
+        codename) with the overrides (by fullname) on top
+
+    """
+    def __init__(self, memberships, overrides=None):
+        self.memberships = memberships
+        self.overrides = overrides if overrides is not None else IntervalTable([], [], [], [])
+
+    @classmethod
+    def from_records(cls, records, overrides=F_OVERRIDES):
+        """ index of scraped {'fullname', 'codename', 'year', 'conf'} dicts
+            and the overrides in the csv file overrides (None for none)
+
+        """
+        memberships = IntervalTable.from_years(
+            [r['codename'] for r in records],
+            [r['year'] for r in records],
+            [r['conf'] for r in records],
+        )
+        return cls(memberships, read_overrides(overrides))
+
+    def lookup(self, codenames, years, fullnames=None):
+        """ object array of the conference of every (codename, year), None
+            where it isn't known; overrides apply by fullname, if given
+
+        """
+        confs = self.memberships.lookup(codenames, years)
+        if fullnames is not None and len(self.overrides):
+            forced = self.overrides.lookup(fullnames, years)
+            hit = np.not_equal(forced, None)
+            confs[hit] = forced[hit]
+        return confs
+
+    def conference(self, codename, year, fullname=None):
+        return self.lookup([codename], [year], None if fullname is None else [fullname])[0]
+
+
+# ----------------------------- #
+#   page parsing                #
+# ----------------------------- #
+
+def parse_conferences(text):
+    """ list of (fullname, codename, conference) from the text of an espn
+        standings page
+
+    """
+    memberships = []
+    x = html.fromstring(text)
+
+    conftables = x.xpath('//table[@class="standings has-team-logos"]')
+
+    for conftable in conftables:
+        longcap = conftable.find('caption/span').text
+        teamnames = conftable.xpath('tr/td/a/span/span')
+        teamabbrs = conftable.xpath('tr/td/a/span/abbr')
+        for (fullname, codename) in zip(teamnames, teamabbrs):
+            memberships.append((fullname.text, codename.text, longcap))
 
-            self.save_conferences()
+        # some teams (ahem TAMU ahem) have no links -- weird.
+        teamnames2 = conftable.xpath('tr/td/span/span')
+        teamabbrs2 = conftable.xpath('tr/td/span/abbr')
+        for (fullname, codename) in zip(teamnames2, teamabbrs2):
+            memberships.append((fullname.text, codename.text, longcap))
 
-    # saving / re-loading pkl files
-    def save_conferences(self):
-        with open(self.fconf, 'wb') as f:
-            pickle.dump(self.conferences, f)
+    return memberships
@@ -25,16 +25,20 @@
 import collections
 import copy
 import csv
+import multiprocessing
 import os
-import pylab
-import scipy
+import time
 
-#-----------------------#
-#   Module constants    #
-#-----------------------#
-GAME_FILE_FORMAT = os.path.join('./data/{0:}', 'game.csv')
-TEAM_FILE_FORMAT = os.path.join('./data/{0:}', 'team.csv')
-PLAY_FILE_FORMAT = os.path.join('./data/{0:}', 'play.csv')
+import lazyimport
+import play_store
+import play_table
+import running_stats
+import season_cache as sc
+import situation_cube
+
+pd = lazyimport.lazy_import('pandas')
+scipy = lazyimport.lazy_import('scipy')
+sqlq = lazyimport.lazy_import('sql_queries')
 
 #-----------------------#
 #   CFB Stat class      #
@@ -47,14 +51,64 @@ class DownAndDistance(object):
 
     """
 
-    def __init__ (self, years):
+    def __init__ (self, years, processes=1, conn=None):
         """Class initialiser
 
+        Seasons are independent, so they are loaded one at a time
+        (processes=1) or concurrently in a pool of worker processes
+        (processes=None uses every core) and merged. The load time
+        of each season ends up in self.loadTimes.
+
+        Given an open connection to the sqlite store of sql_store.py
+        (see sql_queries.connect), the seasons are read from it
+        instead of the csv files, one at a time in this process.
+
         """
         years = [str(el) for el in years]
-        self.update_team_dic(years)
-        self.update_game_dic(years)
-        self.update_play_dic(years)
+        self.teamDic = collections.defaultdict(dict)
+        self.gameDic = collections.defaultdict(dict)
+        self.loadTimes = {}
+
+        if conn is not None:
+            seasons = [load_season_from_store(conn, year) for year in years]
+        elif processes == 1 or len(years) == 1:
+            seasons = map(load_season, years)
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                seasons = pool.map(load_season, years, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+        for season in seasons:
+            self.merge_season(season)
+        self.plays = play_store.PlayStore.concat(s[3] for s in seasons)
+        self.cube = situation_cube.SituationCube.merge(s[4] for s in seasons)
+
+        print 'Season load times:'
+        for year in years:
+            print '\t{}: {:.2f}s'.format(year, self.loadTimes[int(year)])
+
+    def merge_season(self, season):
+        """Fold the team and game dictionaries of one season (see
+        load_season) into ours. Play stores and situation cubes are
+        combined all at once instead.
+
+        """
+        year, teamDic, gameDic, plays, cube, dt = season
+        self.teamDic.update(teamDic)
+        self.gameDic.update(gameDic)
+        self.loadTimes[year] = dt
+
+    @property
+    def playDic(self):
+        """The plays in the old playDic[down, distance][(game code,
+        play number)] --> record layout (read only). New code should
+        use the arrays in self.plays directly.
+
+        """
+        return play_store.PlayDicView(self.plays)
 
     def update_team_dic(self, years):
         """Load the team dictionaries
@@ -64,7 +118,7 @@ class DownAndDistance(object):
         self.teamDic = collections.defaultdict(dict)
         for year in years:
             print '\tyear = {}'.format(year)
-            teamFile = TEAM_FILE_FORMAT.format(year)
+            teamFile = sc.F_CSV.format(year=year, name='team')
             if os.path.isfile(teamFile):
                 with open(teamFile, 'rb') as fIn:
                     csvIn = csv.DictReader(fIn, quoting=csv.QUOTE_ALL)
@@ -83,8 +137,10 @@ class DownAndDistance(object):
         self.gameDic = collections.defaultdict(dict)
         for year in years:
             print '\tyear = {}'.format(year)
-            gameFile = GAME_FILE_FORMAT.format(year)
-            if os.path.isfile(gameFile):
+            gameFile = sc.F_CSV.format(year=year, name='game')
+            if not self.teamDic.get(int(year)):
+                print 'No team info for year {}; skipping its games'.format(year)
+            elif os.path.isfile(gameFile):
                 with open(gameFile, 'rb') as fIn:
                     csvIn = csv.DictReader(fIn, quoting=csv.QUOTE_ALL)
                     for row in csvIn:
@@ -103,125 +159,286 @@ class DownAndDistance(object):
 
     def update_play_dic(self, years):
         """ Look for play information from the years in the "years"
-        list and parse them into a member dictionary
+        list and load them into a member PlayStore, along with the
+        situation cube of their results (see situation_cube.py)
 
         """
         print 'Loading play info...'
-        self.playDic = collections.defaultdict(dict)
+        stores = []
+        cubes = []
         for year in years:
             print '\tyear = {}'.format(year)
-            playFile = PLAY_FILE_FORMAT.format(year)
-            if os.path.isfile(playFile):
-                with open(playFile, 'rb') as fIn:
-                    csvIn = csv.DictReader(fIn, quoting=csv.QUOTE_ALL)
-                    rowLast = csvIn.next()
-                    for rowNow in csvIn:
-                        try:
-                            down = rowLast['Down']
-                            distance = rowLast['Distance']
-                            # Handle kickoffs
-                            down = int(down) if down else -1
-                            distance = int(distance) if distance else -1
-                            key = rowLast['Game Code'], rowLast['Play Number']
-                            keepKeys = ['Defense Team Code',
-                                        'Clock',
-                                        'Period Number',
-                                        'Spot',
-                                        'Offense Points',
-                                        'Defense Points',
-                                        'Drive Play',
-                                        'Play Type',
-                                        'Offense Team Code']
-                            playDic = {k: rowLast[k] for k in keepKeys}
-                            i = rowLast['Spot']
-                            f = rowNow['Spot']
-                            i = int(i) if i else 100
-                            f = int(f) if f else 100
-                            playDic['Result'] = f - i
-                            self.playDic[down, distance][key] = playDic
-                            rowLast = rowNow
-                        except Exception as e:
-                            print 'rowLast = {}'.format(rowLast)
-                            print 'rowNow = {}'.format(rowNow)
-                            raise e
-            else:
-                print 'Data file {} for year {} doesn\'t exist'.format(playFile, year)
+            store = read_season_plays(year)
+            sources, version = season_sources(year)
+            stores.append(store)
+            cubes.append(situation_cube.season_cube(year, store, sources, version))
+        self.plays = play_store.PlayStore.concat(stores)
+        self.cube = situation_cube.SituationCube.merge(cubes)
         print 'Done.'
 
     #   PLOTTING STUFF  #
-    def show_me(self, plot_str, const_str=None):
+    #   All of these show an interactive figure, or, given a file
+    #   name, render it to that file on the (non-interactive) Agg
+    #   backend instead -- see render.py for batches of them.
+    def show_me(self, plot_str, const_str=None, fname=None):
         """A wrapper for a bunch of plotting variables
 
         """
         if plot_str == 'first and 10 pass or run':
-            self.first_and_ten_pass_or_run()
+            self.first_and_ten_pass_or_run(fname=fname)
         else:
             pass
 
-    def first_and_ten_pass_or_run(self, returnIt=False):
+    def first_and_ten_pass_or_run(self, returnIt=False, fname=None):
         """Plot the play choice distribution for first and 10
         plays from any point in the field
 
         """
-        x = {'TOTAL': scipy.zeros(100)}
-        for (playKey, row) in self.playDic[1, 10].iteritems():
-            pt = row['Play Type']
-            if pt not in x:
-                x[pt] = scipy.zeros(100)
-            x[pt][100 - int(row['Spot'])] += 1
-            x['TOTAL'][100 - int(row['Spot'])] += 1
-
-        f = pylab.figure()
+        return self.pass_or_run(1, 10, returnIt=returnIt, fname=fname)
+
+    def pass_or_run(self, down, distance, returnIt=False, fname=None):
+        """Plot the play choice distribution for any down and
+        distance from any point in the field (straight from the
+        situation cube)
+
+        """
+        x = play_choice_by_spot(self.cube, down, distance)
+
+        f = new_figure(fname)
         s = f.add_subplot(111)
         for pt in x:
             if pt != 'TOTAL':
-                x[pt] = x[pt][:-10] / x['TOTAL'][:-10]
                 s.plot(x[pt], label=pt)
 
         s.legend()
-        f.show()
+        show_figure(f, fname)
 
         if returnIt:
             return x
 
-    def play_result_by_spot(self, returnIt=False):
+    def play_result_by_spot(self, returnIt=False, chunksize=100000, fname=None):
         """Collect the result of plots by play type and ball spot.
         Possibly return a dictionary after plotting
 
         """
         playTypes = ['RUSH', 'PASS']
-        x = {pt: collections.defaultdict(dict) for pt in playTypes}
-        
-        for (down, distance) in self.playDic:
-            for (playKey, row) in self.playDic[down, distance].iteritems():
-                pt = row['Play Type']
-                if pt in playTypes:
-                    sp = 100 - int(row['Spot'])
-                    if sp not in x[pt]:
-                        x[pt][sp] = []
-                    x[pt][sp].append(row['Result'])
+        x = {pt: {} for pt in playTypes}
 
-        for pt in x:
-            for sp in x[pt]:
-                x[pt][sp] = -scipy.average(x[pt][sp]), scipy.std(x[pt][sp]) / scipy.sqrt(len(x[pt][sp]))
-
-        zr = scipy.array(x['RUSH'][i][0] for i in range(100))
-        zp = scipy.array(x['PASS'][i][0] for i in range(100))
-        sr = scipy.array(x['RUSH'][i][1] for i in range(100))
-        sp = scipy.array(x['PASS'][i][1] for i in range(100))
-        
-        f = pylab.figure()
+        stats = result_stats_by_spot([self.plays], playTypes, chunksize)
+        for (j, pt) in enumerate(playTypes):
+            for i in scipy.flatnonzero(stats.count[j]):
+                x[pt][i] = -stats.mean[j, i], stats.sem[j, i]
+
+        nan = (scipy.nan, scipy.nan)
+        zr = scipy.array([x['RUSH'].get(i, nan)[0] for i in range(100)])
+        zp = scipy.array([x['PASS'].get(i, nan)[0] for i in range(100)])
+        sr = scipy.array([x['RUSH'].get(i, nan)[1] for i in range(100)])
+        sp = scipy.array([x['PASS'].get(i, nan)[1] for i in range(100)])
+
+        f = new_figure(fname)
         s = f.add_subplot(111)
         s.errorbar(range(100), zr, sr, label='RUSH', color='blue')
         s.errorbar(range(100), zp, sp, label='PASS', color='green')
 
         s.legend()
-        f.show()
+        show_figure(f, fname)
 
         if returnIt:
             return x
 
 
+#-----------------------#
+#   Plotting helpers    #
+#-----------------------#
+
+def new_figure(fname=None):
+    """An interactive pylab figure, or, if we are rendering to a
+    file, a bare Agg figure (pylab and the interactive backend are
+    never imported for those)
+
+    """
+    if fname is None:
+        import pylab
+        return pylab.figure()
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    f = Figure()
+    FigureCanvasAgg(f)
+    return f
+
+
+def show_figure(f, fname=None):
+    if fname is None:
+        f.show()
+    else:
+        f.savefig(fname)
+
+
+def play_choice_by_spot(cube, down, distance):
+    """The fraction of each play type (and the total number of
+    plays) by 100 - spot for one down and distance. The last 10
+    yards are left out of the fractions.
+
+    """
+    # the cube is indexed by spot; plots are by 100 - spot
+    counts = cube.counts(down, distance)[::-1][:100].astype(float)
+    x = {'TOTAL': counts.sum(axis=1)}
+    with scipy.errstate(invalid='ignore', divide='ignore'):
+        for (i, pt) in enumerate(cube.playTypes):
+            if counts[:, i].any():
+                x[pt] = counts[:-10, i] / x['TOTAL'][:-10]
+    return x
+
+
+#-----------------------#
+#   Season loading      #
+#-----------------------#
+
+def read_play_file(playFile):
+    """PlayStore of a play.csv file. The result of a play is the
+    change in spot to the next play in the file (a missing spot
+    counts as 100)
+
+    """
+    plays = pd.read_csv(playFile)
+    spot = plays['Spot'].fillna(100)
+    plays.loc[:, 'Result'] = spot.shift(-1) - spot
+    return play_store.PlayStore.from_frame(plays.iloc[:-1])
+
+
+def read_play_table(year):
+    """PlayStore of the play table built from the per-event files
+    (see play_table.py), for the seasons without a play.csv. Plays
+    without a known spot or result are left out.
+
+    """
+    plays = play_table.load([int(year)], mmap=False)
+    if plays.empty:
+        print 'No play data for year {}'.format(year)
+        return play_store.PlayStore.empty()
+    plays = plays[plays.Spot.notnull() & plays.Result.notnull()]
+    return play_store.PlayStore.from_frame(plays)
+
+
+def result_stats_by_spot(stores, playTypes, chunksize=100000):
+    """Running (Welford) statistics of play results by play type and
+    100 - spot, streamed through chunksize plays at a time from any
+    number of PlayStores (e.g. one per season). Memory only depends
+    on the number of buckets, and the accumulators of separate runs
+    can be merged (see running_stats.py).
+
+    """
+    stats = running_stats.RunningStats((len(playTypes), 101))
+    for store in stores:
+        codes = scipy.array([store.play_type_code(pt) for pt in playTypes])
+        for chunk in store.chunks(chunksize):
+            sp = 100 - chunk['spot'].astype(int)
+            # which of playTypes each play is (-1 for none of them)
+            j = scipy.full(len(sp), -1, dtype=int)
+            for (k, code) in enumerate(codes):
+                j[chunk['play_type'] == code] = k
+            keep = (j >= 0) & (sp >= 0) & (sp <= 100)
+            stats.add((j[keep], sp[keep]), chunk['result'][keep])
+    return stats
+
+
+def season_sources(year):
+    """(sources, version) of the plays of one season: play.csv if
+    there is one, otherwise the per-event files and the version of
+    the play table built from them
+
+    """
+    playFile = sc.F_CSV.format(year=year, name='play')
+    if os.path.isfile(playFile):
+        return [playFile], None
+    return play_table.source_fnames(year), play_table.VERSION
+
+
+def read_season_plays(year):
+    """PlayStore of one season, from play.csv if there is one and
+    from the per-event files otherwise
+
+    """
+    playFile = sc.F_CSV.format(year=year, name='play')
+    if os.path.isfile(playFile):
+        return read_play_file(playFile)
+    return read_play_table(year)
+
+
+def load_season_cube(year):
+    """The situation cube of one season, from its cache when that
+    is fresh (in which case the plays aren't read at all)
+
+    """
+    sources, version = season_sources(year)
+    cachedir = sc.CACHE_DIR.format(year=year, name=situation_cube.CACHE_NAME)
+    if sc.is_fresh(cachedir, sources, version):
+        return situation_cube.SituationCube.load(cachedir)
+    return situation_cube.season_cube(year, read_season_plays(year), sources, version)
+
+
+def load_season(year):
+    """Load the team and game dictionaries and the PlayStore of a
+    single season. Returns (year, teamDic, gameDic, plays, cube,
+    seconds); this is what the worker processes run, so the
+    dictionaries are plain dicts. Missing files leave the
+    corresponding parts empty.
+
+    """
+    t0 = time.time()
+    dd = DownAndDistance.__new__(DownAndDistance)
+    dd.update_team_dic([year])
+    dd.update_game_dic([year])
+    dd.update_play_dic([year])
+    return (int(year),
+            dict(dd.teamDic),
+            dict(dd.gameDic),
+            dd.plays,
+            dd.cube,
+            time.time() - t0)
+
+
+def load_season_from_store(conn, year):
+    """load_season from the sqlite store of sql_store.py instead of
+    the season's files: the team and game dictionaries come from its
+    team and game tables, the plays (with a known spot and result)
+    from its play table. Seasons (or tables) that aren't in the
+    store leave the corresponding parts empty.
+
+    """
+    t0 = time.time()
+    y = int(year)
+    tables = set(row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'"
+    ))
+
+    teamDic = {}
+    gameDic = {}
+    if 'team' in tables:
+        teams = sqlq.team_names(conn, y)
+        if teams:
+            teamDic[y] = teams
+    if not teamDic:
+        print 'No team info for year {} in the store'.format(year)
+    elif 'game' in tables:
+        gameDic[y] = sqlq.game_teams(conn, y)
+
+    plays = sqlq.plays(conn, years=[y]) if 'play' in tables else pd.DataFrame()
+    if plays.empty:
+        print 'No play data for year {} in the store'.format(year)
+        store = play_store.PlayStore.empty()
+    else:
+        plays = plays[plays.Spot.notnull() & plays.Result.notnull()]
+        store = play_store.PlayStore.from_frame(plays)
+
+    return (y,
+            teamDic,
+            gameDic,
+            store,
+            situation_cube.SituationCube.from_store(store),
+            time.time() - t0)
+
+
 #-----------------------#
 #   Main routine        #
 #-----------------------#
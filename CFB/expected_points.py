@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: expected_points.py
+Author: zlamberty
+Created: 2016-04-16
+
+Description:
+    expected points of a drive by start spot, period and score state, from
+    drive.csv
+
+    every drive is worth the points its offense scored on it: 7 for a
+    touchdown, 3 for a field goal, -2 for a safety and 0 otherwise (drive.csv
+    doesn't say when the defense scored on a turnover). The score state of a
+    drive is the offense's lead when it started, from the points of the
+    earlier drives of the game, in SCORE_EDGES buckets. As in
+    situation_cube.py, a DriveTable keeps the number of drives and the sum
+    and sum of squares of their points by (period, score bucket, spot), is
+    built with one bincount per array, and adds up cell by cell -- so each
+    season's table is cached on its own and tables for any set of seasons
+    are merged without touching drive.csv again.
+
+    ExpectedPoints smooths a table into lookup arrays: points and counts are
+    smoothed along spot with a gaussian kernel (BANDWIDTH yards), and every
+    cell is shrunk toward the all-periods, all-scores curve with the weight
+    of PRIOR drives. The arrays for a set of seasons are saved (in a
+    directory of their own under EP_DIR, see ep_dir) with the fingerprints
+    of their drive files, so switching between sets of seasons doesn't
+    rebuild either, and adding a season only builds that season's table.
+    Scoring any number of situations is then indexing.
+
+    axes:
+        period: 1 - 4, then overtime (5)
+        score: offense lead buckets, see SCORE_EDGES
+        spot: 0 - 100, yards to the opponent's goal line
+
+Usage:
+    ep = expected_points.load(range(2005, 2014))
+    points = ep.lookup(spots, periods=periods, leads=leads)
+
+    python expected_points.py [--years 2005 2006 ...] [--force]
+
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+import lazyimport
+import logconfig
+import season_cache as sc
+
+pd = lazyimport.lazy_import('pandas')
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+CACHE_NAME = 'drive_points'
+EP_DIR = os.path.join(sc.DATA_DIR, '.npcache', 'expected_points')
+DRIVE_POINTS = {'TOUCHDOWN': 7, 'FIELD GOAL': 3, 'SAFETY': -2}
+NPERIODS = 5
+NSPOTS = 101
+# lower edges of the offense lead buckets after the first (down by 15+):
+# down 8-14, down 1-7, tied, up 1-7, up 8-14, up 15+
+SCORE_EDGES = np.array([-14, -7, 0, 1, 8, 15])
+NSCORES = len(SCORE_EDGES) + 1
+BANDWIDTH = 3.0
+PRIOR = 20.0
+ARRAYS = ['count', 'sum', 'sumsq']
+logger = logging.getLogger("expected_points")
+
+
+# ----------------------------- #
+#   drives                      #
+# ----------------------------- #
+
+def period_index(period):
+    return np.clip(np.asarray(period, dtype=int), 1, NPERIODS) - 1
+
+
+def score_bucket(lead):
+    return np.searchsorted(SCORE_EDGES, lead, side='right')
+
+
+def source_fnames(year):
+    return [sc.F_CSV.format(year=year, name=name) for name in ['drive', 'game']]
+
+
+def read_drives(year):
+    """ dataframe of one season's drives with their points and the
+        offense's lead when they started
+
+    """
+    dr = pd.DataFrame(sc.load_arrays('drive', year, columns=[
+        'Game Code', 'Drive Number', 'Team Code', 'Start Period', 'Start Spot', 'End Reason'
+    ], mmap=False))
+    games = pd.DataFrame(sc.load_arrays(
+        'game', year, columns=['Game Code', 'Home Team Code'], mmap=False
+    ))
+    dr = dr.merge(games, on='Game Code', how='left')
+    dr = dr.sort_values(['Game Code', 'Drive Number'], kind='mergesort').reset_index(drop=True)
+
+    pts = dr['End Reason'].map(DRIVE_POINTS).fillna(0).values
+    isHome = (dr['Team Code'] == dr['Home Team Code']).values
+    # safeties count for the other team
+    homeScores = np.where(pts > 0, isHome, ~isHome)
+    homePts = np.where(homeScores, np.abs(pts), 0)
+    awayPts = np.where(homeScores, 0, np.abs(pts))
+    byGame = dr['Game Code']
+    homeBefore = pd.Series(homePts).groupby(byGame).cumsum().values - homePts
+    awayBefore = pd.Series(awayPts).groupby(byGame).cumsum().values - awayPts
+
+    dr.loc[:, 'Points'] = pts
+    dr.loc[:, 'Lead'] = np.where(isHome, homeBefore - awayBefore, awayBefore - homeBefore)
+    return dr
+
+
+# ----------------------------- #
+#   raw tables                  #
+# ----------------------------- #
+
+class DriveTable(object):
+    """ count, sum and sum of squares of drive points by period, score
+        bucket and start spot
+
+    """
+    def __init__(self, count, sum, sumsq):
+        self.count = count
+        self.sum = sum
+        self.sumsq = sumsq
+
+    @classmethod
+    def zeros(cls):
+        shape = (NPERIODS, NSCORES, NSPOTS)
+        return cls(np.zeros(shape, dtype=np.int64), np.zeros(shape), np.zeros(shape))
+
+    @classmethod
+    def from_drives(cls, drives):
+        """ the table of a read_drives frame (drives without a spot are left
+            out)
+
+        """
+        table = cls.zeros()
+        spot = drives['Start Spot'].values
+        ok = (spot >= 0) & (spot < NSPOTS)
+        flat = np.ravel_multi_index(
+            (
+                period_index(drives['Start Period'].values[ok]),
+                score_bucket(drives['Lead'].values[ok]),
+                spot[ok].astype(np.intp),
+            ),
+            table.count.shape
+        )
+        pts = drives['Points'].values[ok].astype(float)
+        size = table.count.size
+        table.count.flat[:] = np.bincount(flat, minlength=size)
+        table.sum.flat[:] = np.bincount(flat, weights=pts, minlength=size)
+        table.sumsq.flat[:] = np.bincount(flat, weights=pts ** 2, minlength=size)
+        return table
+
+    @classmethod
+    def merge(cls, tables):
+        total = cls.zeros()
+        for t in tables:
+            for name in ARRAYS:
+                getattr(total, name).__iadd__(getattr(t, name))
+        return total
+
+    def __add__(self, other):
+        return DriveTable.merge([self, other])
+
+    def save(self, cachedir, sources):
+        if os.path.isdir(cachedir):
+            shutil.rmtree(cachedir)
+        os.makedirs(cachedir)
+        for name in ARRAYS:
+            np.save(os.path.join(cachedir, '{}.npy'.format(name)), getattr(self, name))
+        manifest = {'sources': sc.fingerprint(sources), 'scoreEdges': SCORE_EDGES.tolist()}
+        with open(os.path.join(cachedir, sc.F_MANIFEST), 'wb') as f:
+            f.write(json.dumps(manifest, indent=2).encode('utf-8'))
+
+    @classmethod
+    def load(cls, cachedir):
+        return cls(*[np.load(os.path.join(cachedir, '{}.npy'.format(name))) for name in ARRAYS])
+
+
+def season_table(year, forceRebuild=False):
+    """ the drive table of one season, from its cache if that is fresh """
+    sources = source_fnames(year)
+    cachedir = sc.CACHE_DIR.format(year=year, name=CACHE_NAME)
+    if not forceRebuild and sc.is_fresh(cachedir, sources):
+        return DriveTable.load(cachedir)
+    logger.info('building drive points table for {}'.format(year))
+    table = DriveTable.from_drives(read_drives(year))
+    table.save(cachedir, sources)
+    return table
+
+
+# ----------------------------- #
+#   smoothed lookup             #
+# ----------------------------- #
+
+def spot_kernel(bandwidth=BANDWIDTH):
+    """ NSPOTS x NSPOTS gaussian smoothing weights (rows sum to 1) """
+    x = np.arange(NSPOTS)
+    w = np.exp(-0.5 * ((x[:, np.newaxis] - x[np.newaxis, :]) / bandwidth) ** 2)
+    return w / w.sum(axis=1, keepdims=True)
+
+
+class ExpectedPoints(object):
+    """ smoothed expected drive points: ep[period, score bucket, spot], and
+        the curves with period and / or score summed out
+
+    """
+    ARRAYS = ['ep', 'ep_period', 'ep_score', 'ep_spot', 'count']
+
+    def __init__(self, ep, ep_period, ep_score, ep_spot, count):
+        self.ep = ep
+        self.ep_period = ep_period
+        self.ep_score = ep_score
+        self.ep_spot = ep_spot
+        self.count = count
+
+    @classmethod
+    def from_table(cls, table, bandwidth=BANDWIDTH, prior=PRIOR):
+        k = spot_kernel(bandwidth)
+        n = np.tensordot(table.count.astype(float), k, axes=([2], [1]))
+        s = np.tensordot(table.sum, k, axes=([2], [1]))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            spot = s.sum(axis=(0, 1)) / n.sum(axis=(0, 1))
+        spot = np.where(np.isfinite(spot), spot, 0)
+
+        def shrunk(s, n):
+            return (s + prior * spot) / (n + prior)
+
+        return cls(
+            shrunk(s, n),
+            shrunk(s.sum(axis=1), n.sum(axis=1)),
+            shrunk(s.sum(axis=0), n.sum(axis=0)),
+            spot,
+            table.count,
+        )
+
+    def lookup(self, spots, periods=None, leads=None):
+        """ expected points of every (spot, period, offense lead); periods
+            and / or leads of None are averaged over
+
+        """
+        spots = np.clip(np.asarray(spots).astype(np.intp), 0, NSPOTS - 1)
+        if periods is None and leads is None:
+            return self.ep_spot[spots]
+        if leads is None:
+            return self.ep_period[period_index(periods), spots]
+        if periods is None:
+            return self.ep_score[score_bucket(leads), spots]
+        return self.ep[period_index(periods), score_bucket(leads), spots]
+
+    def save(self, epdir, years):
+        if os.path.isdir(epdir):
+            shutil.rmtree(epdir)
+        os.makedirs(epdir)
+        for name in self.ARRAYS:
+            np.save(os.path.join(epdir, '{}.npy'.format(name)), getattr(self, name))
+        manifest = ep_manifest(years)
+        with open(os.path.join(epdir, sc.F_MANIFEST), 'wb') as f:
+            f.write(json.dumps(manifest, indent=2).encode('utf-8'))
+
+    @classmethod
+    def load_arrays(cls, epdir):
+        return cls(*[
+            np.load(os.path.join(epdir, '{}.npy'.format(name))) for name in cls.ARRAYS
+        ])
+
+
+def ep_manifest(years):
+    """ what the arrays of years depend on: the fingerprints of every
+        season's files (by season, since their names repeat) and the
+        smoothing parameters
+
+    """
+    return {
+        'seasons': dict((str(y), sc.fingerprint(source_fnames(y))) for y in years),
+        'scoreEdges': SCORE_EDGES.tolist(),
+        'bandwidth': BANDWIDTH,
+        'prior': PRIOR,
+    }
+
+
+def ep_dir(years, epdir=EP_DIR):
+    """ the directory (under epdir) of the arrays of a set of seasons """
+    key = hashlib.sha1(json.dumps(sorted(int(y) for y in years))).hexdigest()[:16]
+    return os.path.join(epdir, key)
+
+
+def drive_years(years=None):
+    """ the seasons (of years) that have drive and game files """
+    years = sc.available_years() if years is None else years
+    return [y for y in years if all(os.path.isfile(f) for f in source_fnames(y))]
+
+
+def load(years=None, forceRebuild=False, epdir=EP_DIR):
+    """ ExpectedPoints of the drives of years (all with drive files if None)
+
+        the arrays are reused while they were built from exactly these drive
+        files; otherwise the season tables (cached per season) are merged
+        and smoothed again. Every set of seasons has its own arrays under
+        epdir.
+
+    """
+    years = drive_years(years)
+    epdir = ep_dir(years, epdir)
+    if not forceRebuild and sc.read_manifest(epdir) == ep_manifest(years):
+        return ExpectedPoints.load_arrays(epdir)
+    table = DriveTable.merge(season_table(y, forceRebuild=forceRebuild) for y in years)
+    ep = ExpectedPoints.from_table(table)
+    ep.save(epdir, years)
+    return ep
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def main(years=None, force=False):
+    """ build the expected points arrays and print the by-spot curve """
+    ep = load(years, forceRebuild=force)
+    for spot in range(100, 0, -10):
+        print('{:>4} yards to go: {:.2f}'.format(spot, ep.ep_spot[spot]))
+
+
+# ----------------------------- #
+#   Command line                #
+# ----------------------------- #
+
+def parse_args():
+    """ Take a log file from the commmand line """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", help="seasons to use", type=int, nargs='*')
+    parser.add_argument("-f", "--force", help="rebuild even if fresh", action='store_true')
+
+    args = parser.parse_args()
+
+    logger.debug("arguments set to {}".format(vars(args)))
+
+    return args
+
+
+if __name__ == '__main__':
+
+    logconfig.configure()
+
+    args = parse_args()
+
+    main(years=args.years, force=args.force)
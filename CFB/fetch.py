@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: fetch.py
+Author: zlamberty
+Created: 2016-01-23
+
+Description:
+    shared page fetching for the espn history scrapers
+
+    a Fetcher wraps a pooled requests.Session, a token bucket rate limiter (so
+    we stay polite no matter how many threads are fetching), and retries with
+    exponential backoff on connection errors, retryable http statuses, and
+    pages that fail a caller-supplied sanity check. Pages are fetched
+    concurrently on a thread pool but handed back in request order.
+
+    given a response_store.ResponseStore, every body is stored and urls we've
+    seen before are revalidated with If-None-Match / If-Modified-Since; a 304
+    is answered with the stored body.
+
+    big files (season archives) go through download instead, which streams
+    the body straight to disk, hashing it on the way.
+
+Usage:
+    f = Fetcher(concurrency=8, rate=4)
+    for resp in f.imap(urls):
+        parse(resp.text)
+
+"""
+
+import hashlib
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+import lazyimport
+
+requests = lazyimport.lazy_import('requests')
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+logging.getLogger('requests').setLevel(logging.INFO)
+logger = logging.getLogger("fetch")
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+class FetchError(Exception):
+    """ a url could not be fetched within the allowed number of attempts """
+    pass
+
+
+class TokenBucket(object):
+    """ thread-safe token bucket: on average `rate` acquisitions per second,
+        with up to `burst` allowed back to back
+
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ block until a token is available, then take it """
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Fetcher(object):
+    """ concurrent, rate-limited, retrying http GETs
+
+        concurrency: number of simultaneous requests (threads and pooled
+            connections)
+        rate, burst: token bucket parameters (requests / second). rate=None
+            disables rate limiting
+        retries: number of attempts after the first before giving up
+        backoff: base delay (seconds); attempt k waits backoff * 2**k, with
+            some jitter
+        timeout: per request timeout (seconds)
+        store: optional response_store.ResponseStore for raw bodies
+
+    """
+    def __init__(self, concurrency=4, rate=4.0, burst=4, retries=5, backoff=0.5,
+                 timeout=30, session=None, store=None):
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=concurrency, pool_maxsize=concurrency
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self.store = store
+
+    def get(self, url, validate=None, **kwargs):
+        """ GET url, retrying until it succeeds or we run out of attempts
+
+            validate is an optional function of the response; if it returns
+            something falsey the page is treated as a transient failure (e.g.
+            espn occasionally serves scoreboards without the scoreboard data)
+
+        """
+        callerHeaders = kwargs.pop('headers', None) or {}
+        for attempt in range(self.retries + 1):
+            self._wait(attempt)
+
+            headers = dict(callerHeaders)
+            if self.store is not None and attempt == 0:
+                headers.update(self.store.conditional_headers(url))
+
+            try:
+                logger.info('loading {}'.format(url))
+                resp = self.session.get(
+                    url, timeout=self.timeout, headers=headers, **kwargs
+                )
+            except requests.exceptions.RequestException as e:
+                logger.warning('attempt {} for {} failed: {}'.format(attempt, url, e))
+                continue
+
+            if resp.status_code == 304 and self.store is not None:
+                logger.debug('{} not modified; using stored body'.format(url))
+                resp = self.store.get(url)
+
+            if resp.status_code in RETRY_STATUSES:
+                logger.warning('attempt {} for {} returned {}'.format(
+                    attempt, url, resp.status_code
+                ))
+                continue
+            resp.raise_for_status()
+
+            if validate is not None and not validate(resp):
+                logger.warning('attempt {} for {} failed validation'.format(attempt, url))
+                continue
+
+            if self.store is not None and not getattr(resp, 'from_store', False):
+                self.store.put(url, resp.content, resp.headers, resp.encoding)
+
+            return resp
+
+        raise FetchError('unable to load {} in {} attempts'.format(url, self.retries + 1))
+
+    def _wait(self, attempt):
+        """ back off before a retry, then wait for our turn """
+        if attempt:
+            delay = self.backoff * 2 ** (attempt - 1)
+            time.sleep(delay * (1 + random.random()) / 2)
+        if self.bucket:
+            self.bucket.acquire()
+
+    def download(self, url, fname, chunksize=1 << 16, **kwargs):
+        """ stream url into fname, retrying like get, without ever holding
+            the whole body in memory
+
+            the file only appears (atomically) once the body is complete.
+            Returns (sha256 hex digest, number of bytes).
+
+        """
+        fdir = os.path.dirname(os.path.abspath(fname))
+        for attempt in range(self.retries + 1):
+            self._wait(attempt)
+            try:
+                logger.info('downloading {}'.format(url))
+                resp = self.session.get(url, timeout=self.timeout, stream=True, **kwargs)
+                try:
+                    if resp.status_code in RETRY_STATUSES:
+                        logger.warning('attempt {} for {} returned {}'.format(
+                            attempt, url, resp.status_code
+                        ))
+                        continue
+                    resp.raise_for_status()
+                    sha, nbytes = self._stream_to(resp, fdir, fname, chunksize)
+                finally:
+                    resp.close()
+            except requests.exceptions.HTTPError as e:
+                # not one of the retryable statuses; no point in asking again
+                raise FetchError('unable to download {}: {}'.format(url, e))
+            except (requests.exceptions.RequestException, IOError) as e:
+                logger.warning('attempt {} for {} failed: {}'.format(attempt, url, e))
+                continue
+            return sha, nbytes
+
+        raise FetchError('unable to download {} in {} attempts'.format(url, self.retries + 1))
+
+    def _stream_to(self, resp, fdir, fname, chunksize):
+        h = hashlib.sha256()
+        nbytes = 0
+        fd, ftmp = tempfile.mkstemp(dir=fdir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in resp.iter_content(chunksize):
+                    f.write(chunk)
+                    h.update(chunk)
+                    nbytes += len(chunk)
+            expected = resp.headers.get('Content-Length')
+            if expected is not None and int(expected) != nbytes:
+                raise IOError('expected {} bytes, got {}'.format(expected, nbytes))
+            os.rename(ftmp, fname)
+        except:
+            os.remove(ftmp)
+            raise
+        return h.hexdigest(), nbytes
+
+    def imap(self, urls, validate=None):
+        """ generator of responses for urls (in order), fetched concurrently """
+        pool = ThreadPool(self.concurrency)
+        try:
+            for resp in pool.imap(lambda url: self.get(url, validate=validate), urls):
+                yield resp
+        finally:
+            pool.terminate()
+
+    def get_many(self, urls, validate=None):
+        """ list of responses for urls (in order) """
+        return list(self.imap(urls, validate=validate))
@@ -9,24 +9,41 @@ Created: 2015-11-01
 Description:
     download historical results of games
 
+    results are columnar: a page parses into a dict of column --> list
+    (RESULT_COLUMNS), which is what is cached per (year, week) and what
+    EspnResultHistory.columns holds for the whole range; a dataframe is
+    built straight from it. The list of one dict per game (results) is only
+    built for the callers that still want it.
+
 Usage:
     <usage>
 
 """
 
 import argparse
-import cPickle as pickle
 import json
 import logging
-import logging.config
 import os
-import requests
 import time
-import yaml
 
 from collections import defaultdict
 from itertools import product
-from lxml import html, etree
+
+import fetch
+import lazyimport
+import metrics
+import response_store
+import scrape_cache
+
+html = lazyimport.lazy_import('lxml.html')
+etree = lazyimport.lazy_import('lxml.etree')
+pd = lazyimport.lazy_import('pandas')
+
+# any faster drop-in json decoder will do
+try:
+    import ujson as fastjson
+except ImportError:
+    fastjson = json
 
 
 # ----------------------------- #
@@ -36,13 +53,15 @@ from lxml import html, etree
 URL = "http://espn.go.com/college-football/scoreboard/_/group/80/year/{year:}/seasontype/2/week/{week:}"
 HERE = os.path.dirname(os.path.realpath(__file__))
 DATA_DIR = os.path.join(HERE, 'data')
-F_RES = os.path.join(
-    DATA_DIR, 'results.y0_{ystart:}.y1_{yend:}.w0_{wstart:}.w1_{wend:}.pkl'
-)
+SB_MARKER = 'window.espn.scoreboardData'
+SB_END = ';window.espn'
+RESULT_COLUMNS = [
+    'is_neutral_site', 'year', 'week',
+    'team_0', 'team_0_full', 'team_0_pts',
+    'team_1', 'team_1_full', 'team_1_pts',
+    'winning_team', 'losing_team', 'home_team',
+]
 logger = logging.getLogger("result_history")
-LOGCONF = os.path.join(HERE, 'logging.yaml')
-with open(LOGCONF, 'rb') as f:
-    logging.config.dictConfig(yaml.load(f))
 
 
 # ----------------------------- #
@@ -59,36 +78,83 @@ class ResultHistory(object):
 
 
 class EspnResultHistory(ResultHistory):
-    """ iterate through the espn results pages, parsing each page """
-    def __init__(self, url=URL, ystart=2002, yend=2015, wstart=1, wend=15, fres=F_RES):
+    """ iterate through the espn results pages, parsing each page
+
+        parsed pages are cached per (year, week) (see scrape_cache.py), so
+        only the weeks that aren't cached yet are fetched. Weeks of the
+        current season that aren't finished (no games, or games without a
+        winner yet) are not cached. The
+        raw pages are kept in a response store, so the results can be
+        re-parsed without fetching anything (see load_results).
+
+    """
+    def __init__(self, url=URL, ystart=2002, yend=2015, wstart=1, wend=15,
+                 cachedir=scrape_cache.CACHE_DIR, fetcher=None):
         self.url = url
         self.ystart = ystart
         self.yend = yend
         self.wstart = wstart
         self.wend = wend
-        self.fres = fres.format(
-            ystart=self.ystart,
-            yend=self.yend,
-            wstart=self.wstart,
-            wend=self.wend,
-        )
-        self.results = []
-
-    def load_results(self, forceReload=False):
-        """ retrun df of results """
-        if os.access(self.fres, os.R_OK) and not forceReload:
-            with open(self.fres, 'rb') as f:
-                self.results = pickle.load(f)
-        else:
+        self.cache = scrape_cache.UnitCache('results', cachedir)
+        self.fetcher = fetcher or fetch.Fetcher(store=response_store.ResponseStore())
+        self.columns = empty_columns()
+
+    @property
+    def results(self):
+        """ list of one result dict per game (see records) """
+        return records(self.columns)
+
+    def frame(self):
+        """ dataframe of the loaded results """
+        return pd.DataFrame(self.columns, columns=RESULT_COLUMNS)
+
+    def load_results(self, forceReload=False, reparse=False, processes=None):
+        """ load the results (columns) of the whole range
+
+            reparse=True rebuilds every week from the stored raw pages (in
+            parallel on `processes` cores) instead of fetching anything
+
+            the load is timed as a metrics span, with a span per (year, week)
+            parsed under it (see metrics.py)
+
+        """
+        with metrics.span('load_results') as stage:
+            yws = list(self.espn_result_urls())
+            stage.add('units', len(yws))
+            if reparse:
+                self.reparse_from_store(yws, processes)
+            else:
+                if not forceReload:
+                    todo = [(y, w, url) for (y, w, url) in yws if not self.cache.has(y, w)]
+                    stage.add('units_cached', len(yws) - len(todo))
+                    yws = todo
+
+                # espn rate limits, and occasionally serves scoreboard pages
+                # without the scoreboard data; the fetcher deals with both.
+                # Every page is parsed and cached as it arrives, so an error
+                # part way through keeps the weeks before it
+                stage.add('pages_requested', len(yws))
+                resps = metrics.timed(
+                    self.fetcher.imap(
+                        (url for (y, w, url) in yws), validate=has_scoreboard_data
+                    ),
+                    stage,
+                    'fetch_seconds'
+                )
+                for (y, w, url) in yws:
+                    self.update_from_response(next(resps), y, w)
+
+            self.columns = empty_columns()
             for (y, w, url) in self.espn_result_urls():
-                # it seems like espn is rate limiting; pause to play nice maybe?
-                time.sleep(0.5)
-                try:
-                    self.update_from_url(url, y, w)
-                except IndexError:
-                    # just wait a half second and try again?
-                    self.update_from_url(url, y, w)
-            self.save_results()
+                if self.cache.has(y, w):
+                    unit = as_columns(self.cache.get(y, w))
+                    for c in RESULT_COLUMNS:
+                        self.columns[c].extend(unit[c])
+            stage.add('rows_out', nrows(self.columns))
+
+    def invalidate(self, year=None, week=None):
+        """ forget cached results (see scrape_cache.UnitCache.invalidate) """
+        self.cache.invalidate(year, week)
 
     def espn_result_urls(self):
         """ generater of espn result urls """
@@ -98,53 +164,194 @@ class EspnResultHistory(ResultHistory):
             yield y, w, self.url.format(year=y, week=w)
 
     def update_from_url(self, url, y, w):
-        try:
-            logging.info('loading {}'.format(url))
-            resp = requests.get(url)
-            x = html.fromstring(resp.text)
-
-            # this is so bootleg...
-            scripts = x.xpath('head/script')
-            sbdata = [
-                s.text for s in scripts
-                if s.text
-                and s.text.startswith('window.espn.scoreboardData')
-            ][0]
-            sbdata = sbdata.replace('window.espn.scoreboardData \t= ', '')
-            sbdata = sbdata[:sbdata.find(';window.espn')]
-            sbdata = json.loads(sbdata)
-
-            for event in sbdata['events']:
-                gameres = {}
-                gamesum = event['competitions'][0]
-
-                gameres['is_neutral_site'] = gamesum['neutralSite']
-                gameres['year'] = y
-                gameres['week'] = w
-
-                teams = gamesum['competitors']
-                for (i, team) in enumerate(teams):
-                    tabbr = team['team']['abbreviation']
-                    pts = int(team['score'])
-                    gameres['team_{}'.format(i)] = tabbr
-                    gameres['team_{}_full'.format(i)] = team['team']['displayName']
-                    gameres['team_{}_pts'.format(i)] = pts
-
-                    if team['winner']:
-                        gameres['winning_team'] = tabbr
-                    else:
-                        gameres['losing_team'] = tabbr
-
-                    if team['homeAway'] == 'home':
-                        gameres['home_team'] = tabbr
-
-                self.results.append(gameres)
-        except Exception as e:
-            logging.info("unplanned exception for url {}".format(url))
-            logging.error("error message: {}".format(e))
-            raise
-
-    # saving / re-loading pkl files
-    def save_results(self):
-        with open(self.fres, 'wb') as f:
-            pickle.dump(self.results, f)
+        resp = self.fetcher.get(url, validate=has_scoreboard_data)
+        return self.update_from_response(resp, y, w)
+
+    def update_from_response(self, resp, y, w):
+        """ parse a scoreboard page and cache the results for (y, w) """
+        with metrics.span('week', level=logging.DEBUG, year=y, week=w) as s:
+            origin = 'from_store' if getattr(resp, 'from_store', False) else 'fetched'
+            s.add('pages_{}'.format(origin))
+            s.add('bytes_{}'.format(origin), len(resp.content))
+            t0 = time.time()
+            try:
+                results = parse_results(resp.content, y, w)
+            except Exception as e:
+                logging.info("unplanned exception for url {}".format(resp.url))
+                logging.error("error message: {}".format(e))
+                raise
+            s.add('parse_seconds', time.time() - t0)
+            s.add('rows_parsed', nrows(results))
+            self.save_results(y, w, results)
+        return results
+
+    def reparse_from_store(self, yws, processes=None):
+        """ parse the stored pages for (year, week, url) tuples yws again """
+        if self.fetcher.store is None:
+            raise ValueError('reparsing requires a fetcher with a response store')
+        with metrics.span('reparse', pages=len(yws)) as s:
+            parsed = response_store.reparse(
+                self.fetcher.store,
+                [(url, (y, w)) for (y, w, url) in yws],
+                parse_results,
+                processes=processes
+            )
+            for ((y, w, url), results) in zip(yws, parsed):
+                if results is None:
+                    logger.warning('no stored page for {}'.format(url))
+                    s.add('pages_missing')
+                else:
+                    s.add('rows_parsed', nrows(results))
+                    self.save_results(y, w, results)
+
+    # saving parsed weeks
+    def save_results(self, y, w, results):
+        """ cache a week's results (columns) once every game has a winner,
+            or whatever there is (no games, games without a winner) once the
+            season is over
+
+        """
+        winners = results['winning_team']
+        complete = winners and all(t is not None for t in winners)
+        if complete or scrape_cache.is_past_season(y):
+            self.cache.put(y, w, results)
+
+
+# ----------------------------- #
+#   page parsing                #
+# ----------------------------- #
+
+def has_scoreboard_data(resp):
+    """ espn sometimes serves the scoreboard page without the data blob """
+    return SB_MARKER in resp.content
+
+
+def extract_scoreboard_data(page):
+    """ the decoded scoreboardData json blob of a scoreboard page
+
+        the blob is located directly in the page (bytes or text) rather than by
+        building a DOM and looking through head/script
+
+    """
+    start = page.find(SB_MARKER)
+    if start == -1:
+        raise ValueError('no scoreboard data in page')
+    start = page.find('{', start)
+    end = page.find(SB_END, start)
+    return fastjson.loads(page[start:end] if end != -1 else page[start:])
+
+
+def empty_columns():
+    return dict((c, []) for c in RESULT_COLUMNS)
+
+
+def nrows(cols):
+    return len(cols['year'])
+
+
+def as_columns(results):
+    """ results as a dict of column --> list: columns are returned as they
+        are, a list of result dicts (what older caches hold) is converted
+
+    """
+    if isinstance(results, dict):
+        return results
+    cols = empty_columns()
+    for result in results:
+        for c in RESULT_COLUMNS:
+            cols[c].append(result.get(c))
+    return cols
+
+
+def records(cols):
+    """ list of one result dict per game of a dict of column --> list """
+    return [dict(zip(RESULT_COLUMNS, row)) for row in zip(*[cols[c] for c in RESULT_COLUMNS])]
+
+
+def parse_results(page, y, w):
+    """ game results of an espn scoreboard page as a dict of column -->
+        list
+
+        every column in RESULT_COLUMNS is present; winning_team is None for
+        games without a winner (e.g. not played yet). parse_results_dom is
+        the original version (a list of dicts, see records).
+
+    """
+    cols = empty_columns()
+    for event in extract_scoreboard_data(page)['events']:
+        gamesum = event['competitions'][0]
+
+        cols['is_neutral_site'].append(gamesum['neutralSite'])
+        cols['year'].append(y)
+        cols['week'].append(w)
+
+        winner = loser = home = None
+        for (i, team) in enumerate(gamesum['competitors']):
+            tabbr = team['team']['abbreviation']
+            cols['team_{}'.format(i)].append(tabbr)
+            cols['team_{}_full'.format(i)].append(team['team']['displayName'])
+            cols['team_{}_pts'.format(i)].append(int(team['score']))
+
+            if team['winner']:
+                winner = tabbr
+            else:
+                loser = tabbr
+
+            if team['homeAway'] == 'home':
+                home = tabbr
+
+        cols['winning_team'].append(winner)
+        cols['losing_team'].append(loser)
+        cols['home_team'].append(home)
+
+    return cols
+
+
+def parse_results_dom(text, y, w):
+    """ list of game result dicts from the text of an espn scoreboard page
+
+        the original parser, which builds the whole DOM to find the script
+        with the scoreboard data; kept as a reference for parse_results
+
+    """
+    results = []
+    x = html.fromstring(text)
+
+    # this is so bootleg...
+    scripts = x.xpath('head/script')
+    sbdata = [
+        s.text for s in scripts
+        if s.text
+        and s.text.startswith('window.espn.scoreboardData')
+    ][0]
+    sbdata = sbdata.replace('window.espn.scoreboardData \t= ', '')
+    sbdata = sbdata[:sbdata.find(';window.espn')]
+    sbdata = json.loads(sbdata)
+
+    for event in sbdata['events']:
+        gameres = {}
+        gamesum = event['competitions'][0]
+
+        gameres['is_neutral_site'] = gamesum['neutralSite']
+        gameres['year'] = y
+        gameres['week'] = w
+
+        teams = gamesum['competitors']
+        for (i, team) in enumerate(teams):
+            tabbr = team['team']['abbreviation']
+            pts = int(team['score'])
+            gameres['team_{}'.format(i)] = tabbr
+            gameres['team_{}_full'.format(i)] = team['team']['displayName']
+            gameres['team_{}_pts'.format(i)] = pts
+
+            if team['winner']:
+                gameres['winning_team'] = tabbr
+            else:
+                gameres['losing_team'] = tabbr
+
+            if team['homeAway'] == 'home':
+                gameres['home_team'] = tabbr
+
+        results.append(gameres)
+
+    return results
@@ -9,16 +9,43 @@ Created: 2015-11-01
 Description:
     make sure that all necessary stats are downloaded
 
+    cfbstats publishes one zip archive per season. Seasons are fetched in
+    parallel (a handful at a time, through the rate-limited fetch.Fetcher),
+    streamed to disk, and unpacked into ./data/<year>/ -- but only once the
+    unpacked files pass verification:
+
+        - the archive's sha256 matches the expected one, when we have one
+          (--checksums: a json file of year --> sha256)
+        - every file the code depends on (REQUIRED_FILES) is there
+        - every file documented in RELEASE.txt that is there has at least the
+          columns RELEASE.txt documents for it
+
+    after that, data/<year>/MANIFEST.json records the archive, and the size,
+    sha256 and columns of every file. A season whose files still match its
+    manifest is intact and is skipped (seasons we already have without a
+    manifest are verified against RELEASE.txt and adopted).
+
 Usage:
-    <usage>
+    python get_stats.py --ystart 2005 --yend 2013 [-j 4] [--checksums FILE] [--force]
 
 """
 
 import argparse
+import csv
+import hashlib
+import json
 import logging
-import logging.config
 import os
-import yaml
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+
+from multiprocessing.pool import ThreadPool
+
+import fetch
+import logconfig
 
 
 # ----------------------------- #
@@ -26,19 +53,273 @@ import yaml
 # ----------------------------- #
 
 HERE = os.path.dirname(os.path.realpath(__file__))
+DATA_DIR = os.path.join(HERE, 'data')
+ARCHIVE_URL = 'http://www.cfbstats.com/download/cfbstats-com-{year:}-1-5-0.zip'
+F_MANIFEST = 'MANIFEST.json'
+F_RELEASE = 'RELEASE.txt'
+REQUIRED_FILES = [
+    'conference.csv', 'team.csv', 'game.csv', 'drive.csv', 'rush.csv',
+    'pass.csv', 'reception.csv', 'punt.csv', 'punt-return.csv', 'kickoff.csv',
+    'kickoff-return.csv', 'team-game-statistics.csv', 'player.csv',
+]
 logger = logging.getLogger("get_stats.py")
-LOGCONF = os.path.join(HERE, 'logging.yaml')
-with open(LOGCONF, 'rb') as f:
-    logging.config.dictConfig(yaml.load(f))
+
+
+# ----------------------------- #
+#   Verification                #
+# ----------------------------- #
+
+def parse_release(text):
+    """ dict of csv file name --> list of the columns RELEASE.txt documents
+        for it
+
+        files are sections headed by their name alone on a line; columns are
+        the short, capitalized "- Name" / "- Name column: ..." bullets in
+        them (the longer bullets are notes)
+
+    """
+    docs = {}
+    current = None
+    for line in text.splitlines():
+        m = re.match(r'^([a-z0-9-]+\.csv)\s*$', line)
+        if m:
+            current = m.group(1)
+            docs[current] = []
+            continue
+        m = re.match(r'^- (.+?)(?: columns?)?(?::.*)?$', line)
+        if current and m:
+            words = m.group(1).split()
+            if len(words) <= 4 and all(w[0].isupper() or w[0].isdigit() for w in words):
+                docs[current].append(' '.join(words))
+    return docs
+
+
+def csv_columns(fname):
+    with open(fname, 'rb') as f:
+        return next(csv.reader(f), [])
+
+
+def file_sha256(fname, chunksize=1 << 16):
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunksize), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def season_files(ydir):
+    """ the data files of a season directory (no manifest, no caches) """
+    return sorted(
+        f for f in os.listdir(ydir)
+        if not f.startswith('.') and f != F_MANIFEST
+        and os.path.isfile(os.path.join(ydir, f))
+    )
+
+
+def check_release(ydir):
+    """ list of problems with the files in ydir (empty if there are none) """
+    problems = []
+    present = set(season_files(ydir))
+    for fname in REQUIRED_FILES:
+        if fname not in present:
+            problems.append('{} is missing'.format(fname))
+    if F_RELEASE not in present:
+        problems.append('{} is missing'.format(F_RELEASE))
+        return problems
+
+    with open(os.path.join(ydir, F_RELEASE), 'rb') as f:
+        docs = parse_release(f.read().decode('utf-8', 'replace'))
+    for (fname, documented) in sorted(docs.items()):
+        if fname not in present:
+            if fname not in REQUIRED_FILES:
+                logger.debug('{}: documented file {} not included'.format(ydir, fname))
+            continue
+        columns = csv_columns(os.path.join(ydir, fname))
+        missing = [c for c in documented if c not in columns]
+        if missing:
+            problems.append('{} lacks documented columns {}'.format(fname, missing))
+    return problems
+
+
+def build_manifest(ydir, archive=None):
+    """ manifest of the files in ydir: size, sha256 and (for csvs) columns """
+    files = {}
+    for fname in season_files(ydir):
+        full = os.path.join(ydir, fname)
+        files[fname] = {
+            'bytes': os.path.getsize(full),
+            'sha256': file_sha256(full),
+        }
+        if fname.endswith('.csv'):
+            files[fname]['columns'] = csv_columns(full)
+    return {'archive': archive, 'created': time.time(), 'files': files}
+
+
+def read_manifest(ydir):
+    try:
+        with open(os.path.join(ydir, F_MANIFEST), 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_manifest(ydir, manifest):
+    with open(os.path.join(ydir, F_MANIFEST), 'wb') as f:
+        f.write(json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+
+def manifest_problems(ydir, manifest):
+    """ files in ydir that no longer match manifest """
+    problems = []
+    for (fname, meta) in sorted(manifest['files'].items()):
+        full = os.path.join(ydir, fname)
+        if not os.path.isfile(full):
+            problems.append('{} is missing'.format(fname))
+        elif os.path.getsize(full) != meta['bytes'] or file_sha256(full) != meta['sha256']:
+            problems.append('{} has changed'.format(fname))
+    return problems
+
+
+def is_intact(ydir):
+    """ true if ydir holds a complete season that matches its manifest
+
+        a season without a manifest (downloaded before we kept them) is
+        intact if it passes check_release, and gets a manifest on the spot
+
+    """
+    if not os.path.isdir(ydir):
+        return False
+    manifest = read_manifest(ydir)
+    if manifest is None:
+        problems = check_release(ydir)
+        if not problems:
+            logger.info('adopting existing season in {}'.format(ydir))
+            write_manifest(ydir, build_manifest(ydir))
+    else:
+        problems = manifest_problems(ydir, manifest)
+    for p in problems:
+        logger.info('{}: {}'.format(ydir, p))
+    return not problems
 
 
 # ----------------------------- #
 #   Main routines               #
 # ----------------------------- #
 
-def cfbstats(ystart, yend):
-    """ download stats available from cfbstats.com for years (ystart, yend) """
-    pass
+def unpack(archive, destdir):
+    """ extract the files of a zip archive (flattened) into destdir, one
+        streamed member at a time
+
+    """
+    with zipfile.ZipFile(archive) as zf:
+        for info in zf.infolist():
+            fname = os.path.basename(info.filename)
+            if not fname or fname.startswith('.') or '__MACOSX' in info.filename:
+                continue
+            with zf.open(info) as src, open(os.path.join(destdir, fname), 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1 << 16)
+
+
+def fetch_season(fetcher, year, url=ARCHIVE_URL, datadir=DATA_DIR, checksum=None,
+                 force=False):
+    """ make sure data/<year> is there and intact, downloading and unpacking
+        its archive if it isn't; returns a dict describing what happened
+
+    """
+    t0 = time.time()
+    ydir = os.path.join(datadir, str(year))
+    status = {'year': year, 'status': None, 'bytes': 0, 'problems': []}
+
+    if not force and is_intact(ydir):
+        status['status'] = 'intact'
+        status['seconds'] = time.time() - t0
+        return status
+
+    url = url.format(year=year)
+    staging = tempfile.mkdtemp(dir=datadir, prefix='.{}.'.format(year))
+    try:
+        archive = os.path.join(staging, 'archive.zip')
+        try:
+            sha, nbytes = fetcher.download(url, archive)
+        except fetch.FetchError as e:
+            status.update(status='failed', problems=[str(e)])
+            return status
+        status['bytes'] = nbytes
+
+        problems = []
+        if checksum and sha != checksum:
+            problems.append('archive sha256 {} != expected {}'.format(sha, checksum))
+        else:
+            filesdir = os.path.join(staging, 'files')
+            os.makedirs(filesdir)
+            try:
+                unpack(archive, filesdir)
+            except zipfile.BadZipfile as e:
+                problems.append('bad archive: {}'.format(e))
+            else:
+                problems = check_release(filesdir)
+        if problems:
+            for p in problems:
+                logger.error('{}: {}'.format(year, p))
+            status.update(status='failed', problems=problems)
+            return status
+
+        # only now do we touch the season directory
+        if not os.path.isdir(ydir):
+            os.makedirs(ydir)
+        for fname in season_files(filesdir):
+            os.rename(os.path.join(filesdir, fname), os.path.join(ydir, fname))
+        write_manifest(ydir, build_manifest(
+            ydir, archive={'url': url, 'sha256': sha, 'bytes': nbytes}
+        ))
+        status['status'] = 'downloaded'
+        return status
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+        status['seconds'] = time.time() - t0
+
+
+def cfbstats(ystart, yend, url=ARCHIVE_URL, datadir=DATA_DIR, concurrency=4,
+             checksums=None, force=False, fetcher=None):
+    """ download stats available from cfbstats.com for years (ystart, yend)
+
+        (inclusive). Seasons are handled concurrently, at most concurrency at
+        a time; checksums is an optional dict of year --> expected archive
+        sha256. Returns the list of fetch_season statuses, in year order.
+
+    """
+    checksums = checksums or {}
+    fetcher = fetcher or fetch.Fetcher(concurrency=concurrency, rate=1.0, burst=concurrency)
+    if not os.path.isdir(datadir):
+        os.makedirs(datadir)
+
+    years = range(ystart, yend + 1)
+    pool = ThreadPool(concurrency)
+    try:
+        statuses = pool.map(
+            lambda y: fetch_season(
+                fetcher, y, url=url, datadir=datadir,
+                checksum=checksums.get(str(y), checksums.get(y)), force=force
+            ),
+            years
+        )
+    finally:
+        pool.close()
+        pool.join()
+
+    for s in statuses:
+        logger.info('{year}: {status} ({bytes} bytes, {seconds:.1f}s)'.format(**s))
+    return statuses
+
+
+def main(ystart, yend, url=ARCHIVE_URL, concurrency=4, checksums=None, force=False):
+    if checksums:
+        with open(checksums, 'rb') as f:
+            checksums = json.loads(f.read().decode('utf-8'))
+    statuses = cfbstats(
+        ystart, yend, url=url, concurrency=concurrency, checksums=checksums, force=force
+    )
+    return 1 if any(s['status'] == 'failed' for s in statuses) else 0
 
 
 # ----------------------------- #
@@ -48,7 +329,12 @@ def cfbstats(ystart, yend):
 def parse_args():
     """ Take a log file from the commmand line """
     parser = argparse.ArgumentParser()
-    parser.add_argument("-x", "--xample", help="An Example", action='store_true')
+    parser.add_argument("--ystart", help="first season", type=int, default=2005)
+    parser.add_argument("--yend", help="last season", type=int, default=2013)
+    parser.add_argument("--url", help="archive url template ({year:} is filled in)", default=ARCHIVE_URL)
+    parser.add_argument("-j", "--concurrency", help="seasons to fetch at once", type=int, default=4)
+    parser.add_argument("--checksums", help="json file of year --> expected archive sha256")
+    parser.add_argument("-f", "--force", help="download even intact seasons", action='store_true')
 
     args = parser.parse_args()
 
@@ -59,6 +345,15 @@ def parse_args():
 
 if __name__ == '__main__':
 
+    logconfig.configure()
+
     args = parse_args()
 
-    main()
+    raise SystemExit(main(
+        ystart=args.ystart,
+        yend=args.yend,
+        url=args.url,
+        concurrency=args.concurrency,
+        checksums=args.checksums,
+        force=args.force,
+    ))
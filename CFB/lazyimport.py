@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: lazyimport.py
+Author: zlamberty
+Created: 2016-03-19
+
+Description:
+    deferred imports of heavy dependencies
+
+    lazy_import('pandas') hands back a stand-in module that does the real
+    import on first attribute access, so pandas, lxml, requests, scipy and
+    friends are only loaded by the code paths that actually use them. Lazy
+    does the same for any expensive module-level object (e.g. precompiled
+    xpath expressions).
+
+Usage:
+    pd = lazy_import('pandas')
+    XP_ROWS = Lazy(lambda: etree.XPath('tbody/tr'))
+
+"""
+
+import importlib
+import sys
+import threading
+import types
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+class LazyModule(types.ModuleType):
+    """ a module that is only imported when one of its attributes is used """
+    def __init__(self, name):
+        types.ModuleType.__init__(self, name)
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        if self.__dict__['_module'] is None:
+            return '<lazy module {!r} (not loaded)>'.format(self.__name__)
+        return repr(self.__dict__['_module'])
+
+
+def lazy_import(name):
+    """ the module called name if it's already imported, a LazyModule
+        standing in for it otherwise
+
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+class Lazy(object):
+    """ a value that is built by factory() the first time it is used (called
+        or has an attribute looked up)
+
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._value = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._factory()
+        return self._value
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.get(), attr)
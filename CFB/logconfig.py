@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: logconfig.py
+Author: zlamberty
+Created: 2016-03-19
+
+Description:
+    one place to configure logging (from logging.yaml) for all of the CFB
+    modules
+
+    modules only create their loggers when imported; the command line entry
+    points call configure() before doing anything else. It only ever does its
+    work once per process, no matter how many modules ask, and yaml isn't
+    even imported until then. In an interactive session, call configure()
+    yourself to see the log output.
+
+Usage:
+    import logconfig
+    logconfig.configure()
+
+"""
+
+import logging
+import logging.config
+import os
+import threading
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+LOGCONF = os.path.join(HERE, 'logging.yaml')
+_LOCK = threading.Lock()
+_CONFIGURED = []
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def configure(fname=LOGCONF, force=False):
+    """ configure logging from fname, unless we already have (or force) """
+    with _LOCK:
+        if _CONFIGURED and not force:
+            return
+        import yaml
+        with open(fname, 'rb') as f:
+            logging.config.dictConfig(yaml.safe_load(f))
+        _CONFIGURED[:] = [fname]
+
+
+def is_configured():
+    return bool(_CONFIGURED)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: metrics.py
+Author: zlamberty
+Created: 2016-03-26
+
+Description:
+    timed spans and counters for the stages of the win bump pipeline
+
+    a span times a block of code and carries counters (rows in / out, pages
+    fetched or served from the response store, bytes, parse seconds, ...).
+    Spans nest per thread: a span's path is its name under the names of the
+    spans open around it (make_buoyancy_df/get_rankings/load_rankings), and
+    when it ends its counters are added to its parent's, so every stage
+    reports the totals of the (year, week) spans under it.
+
+    finished spans are logged to the "metrics" logger -- a one line summary
+    as the message, and the full record (run id, path, start, seconds, fields
+    and counters) attached to the log record. Route them with logging.yaml:
+    JsonLinesHandler writes the records to a json-lines file (one object per
+    line, data/metrics.jsonl by default), any other handler just logs the
+    summaries. Per (year, week) spans are logged at DEBUG, stages at INFO.
+
+    run from the command line, this summarizes a metrics file by span path
+    (latest run by default), optionally against a baseline file, to find the
+    stage that regressed.
+
+Usage:
+    with metrics.span('get_rankings') as s:
+        ...
+        s.add('rows_out', len(rankings))
+
+    python metrics.py [data/metrics.jsonl] [--base OLD.jsonl] [--run RUN]
+
+"""
+
+import argparse
+import collections
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+import logconfig
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+DATA_DIR = os.path.join(HERE, 'data')
+F_METRICS = os.path.join(DATA_DIR, 'metrics.jsonl')
+# identifies the records of one process' run in a shared metrics file
+RUN = '{}-{}'.format(time.strftime('%Y%m%dT%H%M%S'), os.getpid())
+logger = logging.getLogger("metrics")
+
+_local = threading.local()
+
+
+# ----------------------------- #
+#   spans                       #
+# ----------------------------- #
+
+class Span(object):
+    """ one timed block: name, path, descriptive fields and counters """
+    def __init__(self, name, parent=None, **fields):
+        self.name = name
+        self.parent = parent
+        self.path = name if parent is None else '{}/{}'.format(parent.path, name)
+        self.fields = fields
+        self.counts = collections.defaultdict(int)
+        self.start = time.time()
+        self.seconds = None
+
+    def add(self, key, n=1):
+        self.counts[key] += n
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def record(self):
+        return {
+            'run': RUN,
+            'span': self.path,
+            'start': self.start,
+            'seconds': self.seconds,
+            'fields': self.fields,
+            'counts': dict(self.counts),
+        }
+
+    def describe(self):
+        """ path, fields, time and counters on one line """
+        fields = ''.join(' {}={}'.format(k, v) for (k, v) in sorted(self.fields.items()))
+        counts = ', '.join(
+            '{}={:.3f}'.format(k, v) if isinstance(v, float) else '{}={}'.format(k, v)
+            for (k, v) in sorted(self.counts.items())
+        )
+        return '{}{}: {:.3f}s{}'.format(
+            self.path, fields, self.seconds, '; ' + counts if counts else ''
+        )
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current():
+    """ the innermost open span of this thread (None if there isn't one) """
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+@contextlib.contextmanager
+def span(name, level=logging.INFO, **fields):
+    """ time the block as a span called name (yields the Span)
+
+        an exception leaves its type in the span's 'error' field on its way
+        through
+
+    """
+    stack = _stack()
+    s = Span(name, stack[-1] if stack else None, **fields)
+    stack.append(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.fields['error'] = type(e).__name__
+        raise
+    finally:
+        stack.pop()
+        s.seconds = time.time() - s.start
+        if s.parent is not None:
+            for (k, v) in s.counts.items():
+                s.parent.counts[k] += v
+        if logger.isEnabledFor(level):
+            logger.log(level, s.describe(), extra={'metrics': s.record()})
+
+
+def add(key, n=1):
+    """ count on the innermost open span of this thread (if any) """
+    s = current()
+    if s is not None:
+        s.add(key, n)
+
+
+def timed(iterable, s, key='wait_seconds'):
+    """ generator of the items of iterable, adding the time spent waiting
+        for each one to the counter key of span s (e.g. the time a lazy
+        fetcher spends on the pages, without holding on to them)
+
+    """
+    it = iter(iterable)
+    while True:
+        t0 = time.time()
+        try:
+            item = next(it)
+        except StopIteration:
+            return
+        s.add(key, time.time() - t0)
+        yield item
+
+
+# ----------------------------- #
+#   export                      #
+# ----------------------------- #
+
+class JsonLinesHandler(logging.FileHandler):
+    """ writes the record of every span logged through it as one line of
+        json (other log records are ignored); the file is opened on the first
+        span
+
+    """
+    def __init__(self, filename=F_METRICS, mode='a'):
+        fdir = os.path.dirname(os.path.abspath(filename))
+        if not os.path.isdir(fdir):
+            os.makedirs(fdir)
+        logging.FileHandler.__init__(self, filename, mode, delay=True)
+
+    def emit(self, record):
+        rec = getattr(record, 'metrics', None)
+        if rec is None:
+            return
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(json.dumps(rec, sort_keys=True) + '\n')
+            self.flush()
+        except Exception:
+            self.handleError(record)
+
+
+def to_file(fname=F_METRICS):
+    """ also write span records to fname (without touching logging.yaml);
+        returns the handler
+
+    """
+    handler = JsonLinesHandler(fname)
+    logger.addHandler(handler)
+    if logger.getEffectiveLevel() > logging.DEBUG:
+        logger.setLevel(logging.DEBUG)
+    return handler
+
+
+# ----------------------------- #
+#   summaries                   #
+# ----------------------------- #
+
+def read_records(fname=F_METRICS):
+    with open(fname, 'rb') as f:
+        return [json.loads(line.decode('utf-8')) for line in f if line.strip()]
+
+
+def summarize(records, run=None):
+    """ OrderedDict of span path --> {'calls', 'seconds', 'counts'} for the
+        records of one run (the latest one if run is None), slowest first
+
+    """
+    if run is None and records:
+        run = max(records, key=lambda r: r['start'])['run']
+    summary = {}
+    for rec in records:
+        if rec['run'] != run:
+            continue
+        s = summary.setdefault(rec['span'], {
+            'calls': 0, 'seconds': 0.0, 'counts': collections.defaultdict(int)
+        })
+        s['calls'] += 1
+        s['seconds'] += rec['seconds']
+        for (k, v) in rec['counts'].items():
+            s['counts'][k] += v
+    return collections.OrderedDict(
+        sorted(summary.items(), key=lambda kv: -kv[1]['seconds'])
+    )
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def main(fname=F_METRICS, base=None, run=None):
+    summary = summarize(read_records(fname), run)
+    baseline = summarize(read_records(base)) if base else {}
+
+    print('{:>48} {:>6} {:>10} {:>10} {:>7}  {}'.format(
+        'span', 'calls', 'seconds', 'base (s)', 'ratio', 'counts'
+    ))
+    for (path, s) in summary.items():
+        b = baseline.get(path)
+        print('{:>48} {:>6} {:>10.3f} {:>10} {:>7}  {}'.format(
+            path,
+            s['calls'],
+            s['seconds'],
+            '{:.3f}'.format(b['seconds']) if b else '-',
+            '{:.2f}'.format(s['seconds'] / b['seconds']) if b and b['seconds'] > 0 else '-',
+            ', '.join(
+                '{}={:.3f}'.format(k, v) if isinstance(v, float) else '{}={}'.format(k, v)
+                for (k, v) in sorted(s['counts'].items())
+            )
+        ))
+
+
+# ----------------------------- #
+#   Command line                #
+# ----------------------------- #
+
+def parse_args():
+    """ Take a log file from the commmand line """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fname", help="metrics file", nargs='?', default=F_METRICS)
+    parser.add_argument("--base", help="baseline metrics file to compare with (its latest run)")
+    parser.add_argument("--run", help="run to summarize (default: the latest)")
+
+    args = parser.parse_args()
+
+    logger.debug("arguments set to {}".format(vars(args)))
+
+    return args
+
+
+if __name__ == '__main__':
+
+    logconfig.configure()
+
+    args = parse_args()
+
+    main(fname=args.fname, base=args.base, run=args.run)
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: play_store.py
+Author: zlamberty
+Created: 2016-02-20
+
+Description:
+    compact, columnar storage of plays for DownAndDistance
+
+    every field is a small integer numpy array (play type is stored as a code
+    into a short list of type names), and the rows are sorted by (down,
+    distance), with an index from (down, distance) to the row range of that
+    situation. A season of plays is a couple of MB instead of a dict per play,
+    and "all 3rd and 4 plays" is a slice.
+
+    PlayDicView wraps a store in the old playDic[down, distance][(game code,
+    play number)] --> record interface for the callers that still want it.
+
+Usage:
+    store = PlayStore.from_frame(plays)
+    thirdAndFour = store.situation(3, 4)
+    store = PlayStore.concat([store2012, store2013])
+
+"""
+
+import collections
+
+import numpy as np
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+# column --> (dtype, play table / play.csv field, value when missing)
+FIELDS = collections.OrderedDict([
+    ('game', (np.int64, 'Game Code', -1)),
+    ('play', (np.int16, 'Play Number', -1)),
+    ('down', (np.int8, 'Down', -1)),
+    ('distance', (np.int8, 'Distance', -1)),
+    ('spot', (np.int8, 'Spot', -1)),
+    ('period', (np.int8, 'Period Number', -1)),
+    ('clock', (np.int16, 'Clock', -1)),
+    ('drive_play', (np.int16, 'Drive Play', -1)),
+    ('offense', (np.int16, 'Offense Team Code', -1)),
+    ('defense', (np.int16, 'Defense Team Code', -1)),
+    ('offense_points', (np.int16, 'Offense Points', -1)),
+    ('defense_points', (np.int16, 'Defense Points', -1)),
+    ('result', (np.int8, 'Result', 0)),
+])
+COLUMNS = list(FIELDS) + ['play_type']
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def clock_seconds(clock):
+    """ seconds left on the clock for an array of "mm:ss" strings (or numbers
+        of seconds); -1 where missing
+
+    """
+    s = np.asarray(clock)
+    if s.dtype.kind in 'iuf':
+        return np.where(np.isnan(s.astype(float)), -1, s).astype(np.int16)
+    parts = np.char.partition(s.astype(str), ':')
+    mins, sec = parts[:, 0], parts[:, 2]
+    hasColon = parts[:, 1] == ':'
+    out = np.full(len(s), -1, dtype=np.int16)
+    ok = hasColon & (np.char.str_len(mins) > 0) & (np.char.str_len(sec) > 0)
+    out[ok] = mins[ok].astype(int) * 60 + sec[ok].astype(int)
+    return out
+
+
+class PlayStore(object):
+    """ struct of arrays of plays, sorted and indexed by (down, distance)
+
+        columns is a dict of name --> array for every name in COLUMNS;
+        playTypes is the list of play type names the play_type codes refer to
+
+    """
+    def __init__(self, columns, playTypes):
+        self.playTypes = list(playTypes)
+        order = np.lexsort((columns['distance'], columns['down']))
+        self.columns = collections.OrderedDict(
+            (c, np.ascontiguousarray(columns[c][order])) for c in COLUMNS
+        )
+        self._build_index()
+
+    def _build_index(self):
+        down = self.columns['down'].astype(np.int32)
+        dist = self.columns['distance'].astype(np.int32)
+        if not len(down):
+            self.index = collections.OrderedDict()
+            return
+        brk = np.flatnonzero((np.diff(down) != 0) | (np.diff(dist) != 0)) + 1
+        starts = np.concatenate([[0], brk])
+        stops = np.concatenate([brk, [len(down)]])
+        self.index = collections.OrderedDict(
+            ((int(down[i]), int(dist[i])), (int(i), int(j)))
+            for (i, j) in zip(starts, stops)
+        )
+
+    @classmethod
+    def from_frame(cls, plays):
+        """ store of the plays in a dataframe with play table / play.csv
+            column names (see FIELDS); missing numbers get the missing value
+
+        """
+        columns = {}
+        for (col, (dtype, field, missing)) in FIELDS.items():
+            if field not in plays:
+                columns[col] = np.full(len(plays), missing, dtype=dtype)
+            elif col == 'clock':
+                columns[col] = clock_seconds(plays[field].values)
+            else:
+                x = plays[field].values.astype(float)
+                columns[col] = np.where(np.isnan(x), missing, x).astype(dtype)
+        playTypes, codes = np.unique(
+            plays['Play Type'].fillna('').values.astype(str), return_inverse=True
+        )
+        columns['play_type'] = codes.astype(np.int8)
+        return cls(columns, playTypes)
+
+    @classmethod
+    def empty(cls):
+        columns = dict(
+            (col, np.zeros(0, dtype=dtype)) for (col, (dtype, f, m)) in FIELDS.items()
+        )
+        columns['play_type'] = np.zeros(0, dtype=np.int8)
+        return cls(columns, [])
+
+    @classmethod
+    def concat(cls, stores):
+        """ one store with the plays of several (e.g. one per season) """
+        stores = list(stores)
+        playTypes = sorted(set(pt for s in stores for pt in s.playTypes))
+        columns = {}
+        for col in FIELDS:
+            columns[col] = np.concatenate([s.columns[col] for s in stores]) \
+                if stores else np.zeros(0, dtype=FIELDS[col][0])
+        columns['play_type'] = np.concatenate([np.zeros(0, dtype=np.int8)] + [
+            np.searchsorted(playTypes, s.playTypes).astype(np.int8)[s.columns['play_type']]
+            if s.playTypes else s.columns['play_type']
+            for s in stores
+        ])
+        return cls(columns, playTypes)
+
+    def __len__(self):
+        return len(self.columns['down'])
+
+    def __getitem__(self, col):
+        return self.columns[col]
+
+    @property
+    def nbytes(self):
+        return sum(arr.nbytes for arr in self.columns.values())
+
+    def play_type_code(self, playType):
+        """ code of a play type name (-1 if there are no such plays) """
+        try:
+            return self.playTypes.index(playType)
+        except ValueError:
+            return -1
+
+    def rows(self, down, distance):
+        """ slice of the rows of one (down, distance) situation """
+        i, j = self.index.get((down, distance), (0, 0))
+        return slice(i, j)
+
+    def situation(self, down, distance):
+        """ dict of column --> array (views) for one (down, distance) """
+        sl = self.rows(down, distance)
+        return collections.OrderedDict(
+            (c, arr[sl]) for (c, arr) in self.columns.items()
+        )
+
+    def chunks(self, chunksize=100000):
+        """ generator of dicts of column --> array (views) for consecutive
+            blocks of at most chunksize rows
+
+        """
+        for i in xrange(0, len(self), chunksize):
+            yield collections.OrderedDict(
+                (c, arr[i:i + chunksize]) for (c, arr) in self.columns.items()
+            )
+
+    def record(self, i):
+        """ playDic style record of row i (numbers are ints, -1 where
+            missing)
+
+        """
+        c = self.columns
+        return {
+            'Defense Team Code': int(c['defense'][i]),
+            'Clock': int(c['clock'][i]),
+            'Period Number': int(c['period'][i]),
+            'Spot': int(c['spot'][i]),
+            'Offense Points': int(c['offense_points'][i]),
+            'Defense Points': int(c['defense_points'][i]),
+            'Drive Play': int(c['drive_play'][i]),
+            'Play Type': self.playTypes[c['play_type'][i]],
+            'Offense Team Code': int(c['offense'][i]),
+            'Result': int(c['result'][i]),
+        }
+
+    def key(self, i):
+        return int(self.columns['game'][i]), int(self.columns['play'][i])
+
+
+# ----------------------------- #
+#   playDic compatibility       #
+# ----------------------------- #
+
+class SituationView(collections.Mapping):
+    """ (game code, play number) --> record for the plays of one situation
+
+        the (game code, play number) --> row dict of the slice is built on
+        the first lookup by key; iterating doesn't need it
+
+    """
+    def __init__(self, store, down, distance):
+        self.store = store
+        self.sl = store.rows(down, distance)
+        self._rows = None
+
+    def _range(self):
+        return xrange(self.sl.start, self.sl.stop)
+
+    def _row(self, key):
+        if self._rows is None:
+            c = self.store.columns
+            self._rows = dict(zip(
+                zip(c['game'][self.sl].tolist(), c['play'][self.sl].tolist()),
+                self._range()
+            ))
+        return self._rows[key]
+
+    def __len__(self):
+        return self.sl.stop - self.sl.start
+
+    def __iter__(self):
+        return (self.store.key(i) for i in self._range())
+
+    def __contains__(self, key):
+        try:
+            self._row(key)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __getitem__(self, key):
+        return self.store.record(self._row(key))
+
+    def iteritems(self):
+        return ((self.store.key(i), self.store.record(i)) for i in self._range())
+
+    def itervalues(self):
+        return (self.store.record(i) for i in self._range())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def values(self):
+        return list(self.itervalues())
+
+
+class PlayDicView(collections.Mapping):
+    """ the old playDic[down, distance][(game code, play number)] interface,
+        read-only, on top of a PlayStore
+
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store.index)
+
+    def __iter__(self):
+        return iter(self.store.index)
+
+    def __getitem__(self, downDistance):
+        # like the defaultdict it replaces, unknown situations are empty
+        return SituationView(self.store, *downDistance)
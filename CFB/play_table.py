@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: play_table.py
+Author: zlamberty
+Created: 2016-02-13
+
+Description:
+    one typed play-by-play table per season, built from the per-event
+    cfbstats files (cfbstats doesn't ship the play.csv downanddistance.py was
+    written against)
+
+    rush.csv, pass.csv, punt.csv and kickoff.csv (plus the return files) are
+    all keyed by (Game Code, Play Number); they are combined into one row per
+    play and sorted by play number within each game. Plays that aren't in any
+    event file (field goals, extra points, penalties) leave gaps in the
+    numbering.
+
+    Consecutive scrimmage plays of one offense make up a possession, and the
+    n-th possession of a team in a game is matched with its n-th drive in
+    drive.csv for the starting spot, drive number and period. From there
+    everything is a vectorized groupby / cumsum / shift:
+
+        spot: drive start spot less the yards gained on the earlier plays of
+            the possession
+        down and distance: a new series starts with the possession and after
+            every play flagged as a 1st down; distance is 10 (or the spot, if
+            that's closer) less the yards gained so far in the series
+        next spot / result: the spot of the next play of the possession (the
+            drive end spot for the last one), and next spot - spot, the same
+            sign convention as the old play.csv loop; for a kickoff, the spot
+            the return ended at (kick spot less kick yards plus return
+            yards, on the field)
+        offense / defense points: the score when the play's drive started,
+            from the results of the earlier drives of the game (7 for a
+            touchdown, 3 for a field goal, 2 for the defense on a safety);
+            kickoffs get the score of the drive after them
+
+    This is a reconstruction: penalties and plays missing from the event files
+    throw off the spot and down of the plays after them, and possessions that
+    can't be matched to a drive have no spot at all (-1 / NaN). Kickoffs have
+    down and distance -1, and the kicking team as offense, like play.csv did.
+
+    Tables are cached with season_cache's column storage, keyed on the
+    fingerprint of the csv files they were built from and on VERSION.
+
+Usage:
+    import play_table
+    plays = play_table.load([2012, 2013])
+
+"""
+
+import logging
+import os
+
+import numpy as np
+
+import lazyimport
+import season_cache as sc
+
+pd = lazyimport.lazy_import('pandas')
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+CACHE_NAME = 'play'
+SOURCES = [
+    'rush', 'pass', 'reception', 'punt', 'punt-return', 'kickoff',
+    'kickoff-return', 'drive', 'game'
+]
+KEY = ['Game Code', 'Play Number']
+SCRIMMAGE = ['RUSH', 'PASS', 'PUNT']
+COLUMNS = [
+    'Game Code', 'Play Number', 'Period Number', 'Offense Team Code',
+    'Defense Team Code', 'Offense Points', 'Defense Points', 'Drive Number',
+    'Drive Play', 'Play Type', 'Down', 'Distance', 'Spot', 'Yards',
+    'Return Yards', '1st Down', 'Touchdown', 'Next Spot', 'Result',
+]
+# points for the offense of a drive, by end reason (a safety goes to the
+# defense)
+DRIVE_POINTS = {'TOUCHDOWN': 7, 'FIELD GOAL': 3}
+SAFETY_POINTS = 2
+# bump whenever build_play_table changes what it writes, so cached tables
+# are rebuilt
+VERSION = 3
+logger = logging.getLogger("play_table")
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def source_fnames(year):
+    return [sc.F_CSV.format(year=year, name=name) for name in SOURCES]
+
+
+def _frame(name, year, columns):
+    arrs = sc.load_arrays(name, year, columns=columns, mmap=False)
+    return pd.DataFrame(arrs, columns=list(arrs))
+
+
+def _kickoff_spot(year):
+    """ yard line (from the receiving goal line) kickoffs were made from """
+    return 70 if 2007 <= int(year) <= 2011 else 65
+
+
+def events(year):
+    """ one row per (Game Code, Play Number) across the event files
+
+        rush rows for the same play (laterals, fumble advances) are summed; a
+        play in more than one file takes the type of the first of kickoff,
+        punt, pass, rush. Receptions only repeat the pass, so they add
+        nothing.
+
+    """
+    agg = {'Team Code': 'first', 'Yards': 'sum', '1st Down': 'max', 'Touchdown': 'max'}
+    cols = KEY + ['Team Code', 'Yards', '1st Down', 'Touchdown']
+
+    frames = []
+    for (priority, (name, playType)) in enumerate([
+            ('kickoff', 'KICKOFF'), ('punt', 'PUNT'), ('pass', 'PASS'), ('rush', 'RUSH')]):
+        if playType in ('RUSH', 'PASS'):
+            df = _frame(name, year, cols).groupby(KEY, sort=False).agg(agg)
+        else:
+            df = _frame(name, year, KEY + ['Team Code', 'Yards'])
+            df = df.groupby(KEY, sort=False).first()
+            df.loc[:, '1st Down'] = 0
+            df.loc[:, 'Touchdown'] = 0
+        df.loc[:, 'Play Type'] = playType
+        df.loc[:, 'priority'] = priority
+        frames.append(df.reset_index())
+
+    ev = pd.concat(frames, ignore_index=True, sort=False)
+    ev = ev.sort_values(KEY + ['priority'], kind='mergesort')
+    ev = ev.drop_duplicates(KEY, keep='first').drop('priority', axis=1)
+    ev = ev.rename(columns={'Team Code': 'Offense Team Code'})
+
+    # return yards ride along on the kick they returned
+    rets = []
+    for name in ['kickoff-return', 'punt-return']:
+        r = _frame(name, year, KEY + ['Yards'])
+        rets.append(r.groupby(KEY, sort=False).Yards.sum())
+    rets = pd.concat(rets).groupby(level=[0, 1]).sum().rename('Return Yards')
+    ev = ev.join(rets, on=KEY)
+
+    return ev.reset_index(drop=True)
+
+
+def drives(year, games):
+    """ drives with at least one play, with the per-team ordinal we match
+        possessions on and the offense and defense points when they started
+        (from the results of every earlier drive of the game)
+
+    """
+    dr = _frame('drive', year, [
+        'Game Code', 'Drive Number', 'Team Code', 'Start Period', 'Start Spot',
+        'End Spot', 'End Reason', 'Plays'
+    ])
+    dr = dr.sort_values(['Game Code', 'Drive Number'], kind='mergesort').reset_index(drop=True)
+
+    home = dr[['Game Code']].merge(games, on='Game Code', how='left')['Home Team Code']
+    isHome = (dr['Team Code'] == home).values
+    offPts = dr['End Reason'].map(DRIVE_POINTS).fillna(0).values
+    defPts = np.where(dr['End Reason'] == 'SAFETY', SAFETY_POINTS, 0)
+    homePts = pd.Series(np.where(isHome, offPts, defPts))
+    awayPts = pd.Series(np.where(isHome, defPts, offPts))
+    homeBefore = homePts.groupby(dr['Game Code']).cumsum() - homePts
+    awayBefore = awayPts.groupby(dr['Game Code']).cumsum() - awayPts
+    dr.loc[:, 'Offense Points'] = np.where(isHome, homeBefore, awayBefore)
+    dr.loc[:, 'Defense Points'] = np.where(isHome, awayBefore, homeBefore)
+
+    dr = dr[dr.Plays > 0].copy()
+    dr.loc[:, 'ordinal'] = dr.groupby(['Game Code', 'Team Code']).cumcount()
+    return dr.drop(['Plays', 'End Reason'], axis=1)
+
+
+def build_play_table(year):
+    """ dataframe of every play of one season, in game / play order """
+    ev = events(year)
+    ev = ev.sort_values(KEY, kind='mergesort').reset_index(drop=True)
+
+    # defense is whichever team of the game isn't on offense
+    games = _frame('game', year, ['Game Code', 'Home Team Code', 'Visit Team Code'])
+    ev = ev.merge(games, on='Game Code', how='left')
+    ev.loc[:, 'Defense Team Code'] = np.where(
+        ev['Offense Team Code'] == ev['Home Team Code'],
+        ev['Visit Team Code'],
+        ev['Home Team Code']
+    )
+
+    # possessions: consecutive scrimmage plays of one offense, broken by
+    # kickoffs and punts
+    isKick = (ev['Play Type'] == 'KICKOFF').values
+    kicks = pd.Series(isKick.astype(int)).groupby(ev['Game Code']).cumsum().values
+    scrim = ev[~isKick].copy()
+    scrim.loc[:, 'kicks'] = kicks[~isKick]
+    prev = scrim.shift(1)
+    scrim.loc[:, 'new'] = (
+        (scrim['Game Code'] != prev['Game Code'])
+        | (scrim['Offense Team Code'] != prev['Offense Team Code'])
+        | (scrim['kicks'] != prev['kicks'])
+        | (prev['Play Type'] == 'PUNT')
+    )
+    scrim.loc[:, 'possession'] = scrim.new.cumsum()
+    starts = scrim[scrim.new]
+    scrim.loc[:, 'ordinal'] = starts.groupby(
+        ['Game Code', 'Offense Team Code']
+    ).cumcount().reindex(scrim.index).ffill().astype(int)
+
+    dr = drives(year, games[['Game Code', 'Home Team Code']])
+    scrim = scrim.merge(
+        dr.rename(columns={'Team Code': 'Offense Team Code'}),
+        on=['Game Code', 'Offense Team Code', 'ordinal'],
+        how='left'
+    )
+
+    # spot
+    gained = scrim.Yards.where(scrim['Play Type'] != 'PUNT', 0)
+    byPoss = gained.groupby(scrim.possession)
+    scrim.loc[:, 'Spot'] = scrim['Start Spot'] - (byPoss.cumsum() - gained)
+    scrim.loc[:, 'Drive Play'] = byPoss.cumcount() + 1
+
+    # down and distance
+    prevFirst = scrim['1st Down'].groupby(scrim.possession).shift(1).fillna(0)
+    series = (scrim.new | (prevFirst > 0)).cumsum()
+    seriesStart = scrim.Spot.groupby(series).transform('first')
+    toGo = np.minimum(10, seriesStart) - (seriesStart - scrim.Spot)
+    scrim.loc[:, 'Down'] = np.minimum(scrim.groupby(series).cumcount() + 1, 4)
+    scrim.loc[:, 'Distance'] = toGo.clip(lower=1)
+
+    # next spot and result
+    nextSpot = scrim.Spot.groupby(scrim.possession).shift(-1)
+    scrim.loc[:, 'Next Spot'] = nextSpot.fillna(scrim['End Spot'])
+    scrim.loc[:, 'Result'] = scrim['Next Spot'] - scrim.Spot
+    scrim.loc[:, 'Period Number'] = scrim['Start Period']
+
+    kick = ev[isKick].copy()
+    kick.loc[:, 'Spot'] = _kickoff_spot(year)
+    kick.loc[:, 'Next Spot'] = np.clip(
+        kick.Spot - kick.Yards + kick['Return Yards'].fillna(0), 0, 100
+    )
+    kick.loc[:, 'Result'] = kick['Next Spot'] - kick.Spot
+    for col in ['Down', 'Distance', 'Drive Number', 'Drive Play', 'Period Number']:
+        kick.loc[:, col] = -1
+
+    plays = pd.concat([scrim, kick], ignore_index=True, sort=False)
+    plays = plays.sort_values(KEY, kind='mergesort').reset_index(drop=True)
+
+    # the score at a kickoff is the score the next drive of the game started
+    # with (the last one of the previous drive, for a kickoff at the end)
+    isHome = (plays['Offense Team Code'] == plays['Home Team Code']).values
+    score = dict(
+        (side, pd.Series(np.where(
+            isHome == (side == 'home'), plays['Offense Points'], plays['Defense Points']
+        )).groupby(plays['Game Code']).transform(lambda s: s.bfill().ffill()))
+        for side in ['home', 'away']
+    )
+    isKick = (plays['Play Type'] == 'KICKOFF').values
+    for (col, mine) in [('Offense Points', isHome), ('Defense Points', ~isHome)]:
+        plays.loc[isKick, col] = np.where(mine, score['home'], score['away'])[isKick]
+    plays = plays[COLUMNS]
+
+    intCols = [
+        'Period Number', 'Drive Number', 'Drive Play', 'Down', 'Distance',
+        'Offense Points', 'Defense Points',
+    ]
+    plays.loc[:, intCols] = plays[intCols].fillna(-1)
+    plays = plays.astype({c: np.int16 for c in intCols})
+    plays = plays.astype({
+        'Yards': np.float32, 'Return Yards': np.float32, 'Spot': np.float32,
+        'Next Spot': np.float32, 'Result': np.float32,
+        '1st Down': np.int8, 'Touchdown': np.int8,
+    })
+
+    unmatched = plays.Spot.isnull().sum()
+    if unmatched:
+        logger.debug('{}: {} of {} plays without a spot'.format(year, unmatched, len(plays)))
+
+    return plays
+
+
+def build(year, forceRebuild=False):
+    """ build (if stale) the cached play table of one season """
+    sources = source_fnames(year)
+    cachedir = sc.CACHE_DIR.format(year=year, name=CACHE_NAME)
+    if not forceRebuild and sc.is_fresh(cachedir, sources, VERSION):
+        return cachedir
+    logger.info('building play table for {}'.format(year))
+    sc.save_columns(build_play_table(year), cachedir, sources, VERSION)
+    return cachedir
+
+
+def load(years=None, columns=None, mmap=True):
+    """ dataframe of the play tables of several seasons (with a 'year' column)
+
+        seasons without the event files are skipped with a warning
+
+    """
+    years = sc.available_years() if years is None else years
+    frames = []
+    for y in years:
+        if not all(os.path.isfile(f) for f in source_fnames(y)):
+            logger.warning('no play-level files for year {}'.format(y))
+            continue
+        arrs = sc.load_columns(build(y), columns=columns, mmap=mmap)
+        df = pd.DataFrame(arrs, columns=list(arrs))
+        df.loc[:, 'year'] = int(y)
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=(columns or COLUMNS) + ['year'])
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: player_seasons.py
+Author: zlamberty
+Created: 2016-04-02
+
+Description:
+    per-player season totals from the cfbstats event files, and careers
+    from those
+
+    rush.csv, pass.csv, reception.csv and the two return files are each read
+    once, in chunks of CHUNKSIZE rows and only the columns we need; every
+    chunk is summed by player code (a vectorized groupby) and the partial
+    sums are added up at the end, so memory only depends on the number of
+    players. Games played are the distinct game codes a player shows up in,
+    across all of the files. The totals are joined to player.csv (name,
+    team, position, class; players missing from it keep their stats) and
+    cached per season with season_cache's column storage, keyed on the
+    fingerprint of the files they came from.
+
+    career queries add up the cached seasons; they never touch the event
+    files once the seasons are cached.
+
+Usage:
+    import player_seasons
+    seasons = player_seasons.load([2012, 2013])
+    careers = player_seasons.careers(years=range(2005, 2014))
+
+    python player_seasons.py [--years 2005 2006 ...] [--force]
+
+"""
+
+import argparse
+import collections
+import logging
+import os
+
+import numpy as np
+
+import lazyimport
+import logconfig
+import season_cache as sc
+
+pd = lazyimport.lazy_import('pandas')
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+CACHE_NAME = 'player_season'
+CHUNKSIZE = 100000
+PLAYER = 'Player Code'
+# event file --> (player code column, [(stat, column summed), ...])
+STATS = collections.OrderedDict([
+    ('rush', ('Player Code', [
+        ('rush_att', 'Attempt'), ('rush_yds', 'Yards'), ('rush_td', 'Touchdown'),
+    ])),
+    ('pass', ('Passer Player Code', [
+        ('pass_att', 'Attempt'), ('pass_cmp', 'Completion'), ('pass_yds', 'Yards'),
+        ('pass_td', 'Touchdown'), ('pass_int', 'Interception'),
+    ])),
+    ('reception', ('Player Code', [
+        ('rec', 'Reception'), ('rec_yds', 'Yards'), ('rec_td', 'Touchdown'),
+    ])),
+    ('kickoff-return', ('Player Code', [
+        ('kr', 'Attempt'), ('kr_yds', 'Yards'), ('kr_td', 'Touchdown'),
+    ])),
+    ('punt-return', ('Player Code', [
+        ('pr', 'Attempt'), ('pr_yds', 'Yards'), ('pr_td', 'Touchdown'),
+    ])),
+])
+STAT_COLUMNS = ['games'] + [stat for (col, stats) in STATS.values() for (stat, c) in stats]
+PLAYER_COLUMNS = ['Team Code', 'Last Name', 'First Name', 'Position', 'Class']
+logger = logging.getLogger("player_seasons")
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def source_fnames(year):
+    return [sc.F_CSV.format(year=year, name=name) for name in list(STATS) + ['player']]
+
+
+def aggregate_file(fname, playerCol, stats, chunksize=CHUNKSIZE):
+    """ (dataframe of the stats summed by player code, dataframe of the
+        distinct (player code, game code) pairs) from one pass over fname
+
+    """
+    columns = [c for (stat, c) in stats]
+    sums = []
+    games = []
+    for chunk in pd.read_csv(
+            fname, usecols=['Game Code', playerCol] + sorted(set(columns)),
+            chunksize=chunksize):
+        chunk = chunk[chunk[playerCol].notnull()]
+        player = chunk[playerCol].astype(np.int64).rename(PLAYER)
+        part = pd.DataFrame(
+            dict((stat, chunk[c].fillna(0).values) for (stat, c) in stats),
+            index=player.values
+        )
+        sums.append(part.groupby(level=0, sort=False).sum())
+        games.append(pd.DataFrame({
+            PLAYER: player.values, 'Game Code': chunk['Game Code'].values
+        }).drop_duplicates())
+
+    if not sums:
+        return (
+            pd.DataFrame(columns=[stat for (stat, c) in stats]),
+            pd.DataFrame(columns=[PLAYER, 'Game Code'])
+        )
+    total = pd.concat(sums).groupby(level=0, sort=False).sum()
+    total.index.name = PLAYER
+    return total, pd.concat(games, ignore_index=True)
+
+
+def aggregate_season(year, chunksize=CHUNKSIZE):
+    """ dataframe of the season totals of every player with at least one
+        event, joined to player.csv
+
+    """
+    totals = []
+    games = []
+    for (name, (playerCol, stats)) in STATS.items():
+        fname = sc.F_CSV.format(year=year, name=name)
+        total, pairs = aggregate_file(fname, playerCol, stats, chunksize=chunksize)
+        logger.debug('{}: {} players in {}'.format(year, len(total), name))
+        totals.append(total)
+        games.append(pairs)
+
+    season = pd.concat(totals, axis=1, sort=False).fillna(0)
+    nGames = pd.concat(games, ignore_index=True).drop_duplicates().groupby(PLAYER).size()
+    season.loc[:, 'games'] = nGames.reindex(season.index).fillna(0)
+    season = season[STAT_COLUMNS].astype(np.int32)
+
+    players = pd.read_csv(
+        sc.F_CSV.format(year=year, name='player'), usecols=[PLAYER] + PLAYER_COLUMNS
+    ).drop_duplicates(PLAYER).set_index(PLAYER)
+    season = season.join(players, how='left')
+    season.index.name = PLAYER
+    return season.reset_index().sort_values(PLAYER).reset_index(drop=True)
+
+
+def build(year, forceRebuild=False):
+    """ build (if stale) the cached player totals of one season """
+    sources = source_fnames(year)
+    cachedir = sc.CACHE_DIR.format(year=year, name=CACHE_NAME)
+    if not forceRebuild and sc.is_fresh(cachedir, sources):
+        return cachedir
+    logger.info('aggregating player seasons for {}'.format(year))
+    sc.save_columns(aggregate_season(year), cachedir, sources)
+    return cachedir
+
+
+def load(years=None, columns=None, mmap=True):
+    """ dataframe of the player totals of several seasons (with a 'year'
+        column); seasons without the event files are skipped with a warning
+
+    """
+    years = sc.available_years() if years is None else years
+    frames = []
+    for y in years:
+        if not all(os.path.isfile(f) for f in source_fnames(y)):
+            logger.warning('no player-level files for year {}'.format(y))
+            continue
+        arrs = sc.load_columns(build(y), columns=columns, mmap=mmap)
+        df = pd.DataFrame(arrs, columns=list(arrs))
+        df.loc[:, 'year'] = int(y)
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(
+            columns=(columns or [PLAYER] + STAT_COLUMNS + PLAYER_COLUMNS) + ['year']
+        )
+    return pd.concat(frames, ignore_index=True)
+
+
+def careers(years=None, players=None):
+    """ career totals (over years) of every player, or of the player codes
+        in players, from the cached seasons
+
+        besides the summed stats: the number of seasons, the first and last
+        of them, and the name, team, position and class of the last one
+
+    """
+    seasons = load(years, mmap=False)
+    if players is not None:
+        seasons = seasons[seasons[PLAYER].isin(players)]
+    seasons = seasons.sort_values([PLAYER, 'year'], kind='mergesort')
+
+    byPlayer = seasons.groupby(PLAYER)
+    career = byPlayer[STAT_COLUMNS].sum()
+    career.loc[:, 'seasons'] = byPlayer.size()
+    career.loc[:, 'first_year'] = byPlayer.year.min()
+    career.loc[:, 'last_year'] = byPlayer.year.max()
+    career = career.join(byPlayer[PLAYER_COLUMNS].last())
+    return career.reset_index()
+
+
+def player_seasons(player, years=None):
+    """ the season-by-season totals of one player """
+    seasons = load(years, mmap=False)
+    return seasons[seasons[PLAYER] == player].sort_values('year').reset_index(drop=True)
+
+
+def main(years=None, force=False):
+    """ pre-build the player season caches """
+    years = sc.available_years() if years is None else years
+    for y in years:
+        build(y, forceRebuild=force)
+
+
+# ----------------------------- #
+#   Command line                #
+# ----------------------------- #
+
+def parse_args():
+    """ Take a log file from the commmand line """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", help="seasons to aggregate", type=int, nargs='*')
+    parser.add_argument("-f", "--force", help="rebuild even if fresh", action='store_true')
+
+    args = parser.parse_args()
+
+    logger.debug("arguments set to {}".format(vars(args)))
+
+    return args
+
+
+if __name__ == '__main__':
+
+    logconfig.configure()
+
+    args = parse_args()
+
+    main(years=args.years, force=args.force)
@@ -15,16 +15,20 @@ Usage:
 """
 
 import argparse
-import cPickle as pickle
 import logging
-import logging.config
 import os
-import requests
 import time
-import yaml
 
 from itertools import product
-from lxml import html, etree
+
+import fetch
+import lazyimport
+import metrics
+import response_store
+import scrape_cache
+
+html = lazyimport.lazy_import('lxml.html')
+etree = lazyimport.lazy_import('lxml.etree')
 
 
 # ----------------------------- #
@@ -34,12 +38,17 @@ from lxml import html, etree
 URL = "http://espn.go.com/college-football/rankings/_/seasontype/2/year/{year:}/week/{week:}"
 HERE = os.path.dirname(os.path.realpath(__file__))
 DATA_DIR = os.path.join(HERE, 'data')
-F_RANK = os.path.join(DATA_DIR, 'rankings.y0_{ystart:}.y1_{yend:}.w0_{wstart:}.w1_{wend:}.pkl')
+RANKING_COLUMNS = ['rank_type', 'rank', 'codename', 'fullname', 'year', 'week']
+
+# compiled once (on first use); see parse_rankings
+XP_TABLES = lazyimport.Lazy(lambda: etree.XPath('//table[@class="rankings has-team-logos"]'))
+XP_CAPTION = lazyimport.Lazy(lambda: etree.XPath('caption/text()', smart_strings=False))
+XP_ROWS = lazyimport.Lazy(lambda: etree.XPath('tbody/tr'))
+XP_RANK = lazyimport.Lazy(lambda: etree.XPath('td/span[@class="number"]/text()', smart_strings=False))
+XP_TEAM = lazyimport.Lazy(lambda: etree.XPath('td/a/abbr | td/span/abbr'))
+
 logging.getLogger('requests').setLevel(logging.INFO)
 logger = logging.getLogger("ranking_history")
-LOGCONF = os.path.join(HERE, 'logging.yaml')
-with open(LOGCONF, 'rb') as f:
-    logging.config.dictConfig(yaml.load(f))
 
 
 # ----------------------------- #
@@ -56,32 +65,68 @@ class RankingHistory(object):
 
 
 class EspnRankingHistory(RankingHistory):
-    """ iterate through the espn rankings page, parsing each page """
-    def __init__(self, url=URL, ystart=2002, yend=2015, wstart=1, wend=15, frank=F_RANK):
+    """ iterate through the espn rankings page, parsing each page
+
+        parsed pages are cached per (year, week) (see scrape_cache.py), so
+        only the weeks that aren't cached yet are fetched. Weeks without
+        rankings (e.g. ones that haven't happened yet) are not cached. The raw
+        pages are kept in a response store, so the rankings can be re-parsed
+        without fetching anything (see load_rankings).
+
+    """
+    def __init__(self, url=URL, ystart=2002, yend=2015, wstart=1, wend=15,
+                 cachedir=scrape_cache.CACHE_DIR, fetcher=None):
         self.url = url
         self.ystart = ystart
         self.yend = yend
         self.wstart = wstart
         self.wend = wend
-        self.frank = frank.format(
-            ystart=self.ystart,
-            yend=self.yend,
-            wstart=self.wstart,
-            wend=self.wend,
-        )
+        self.cache = scrape_cache.UnitCache('rankings', cachedir)
+        self.fetcher = fetcher or fetch.Fetcher(store=response_store.ResponseStore())
         self.rankings = []
 
-    def load_rankings(self, forceReload=False):
-        """ retrun df of rankings """
-        if os.access(self.frank, os.R_OK) and not forceReload:
-            with open(self.frank, 'rb') as f:
-                self.rankings = pickle.load(f)
-        else:
-            for (y, w, url) in self.espn_ranking_urls():
-                # it seems like espn is rate limiting; pause to play nice maybe?
-                time.sleep(0.5)
-                self.update_from_url(url, y, w)
-            self.save_rankings()
+    def load_rankings(self, forceReload=False, reparse=False, processes=None):
+        """ retrun df of rankings
+
+            reparse=True rebuilds every week from the stored raw pages (in
+            parallel on `processes` cores) instead of fetching anything
+
+            the load is timed as a metrics span, with a span per (year, week)
+            parsed under it (see metrics.py)
+
+        """
+        with metrics.span('load_rankings') as stage:
+            yws = list(self.espn_ranking_urls())
+            stage.add('units', len(yws))
+            if reparse:
+                self.reparse_from_store(yws, processes)
+            else:
+                if not forceReload:
+                    todo = [(y, w, url) for (y, w, url) in yws if not self.cache.has(y, w)]
+                    stage.add('units_cached', len(yws) - len(todo))
+                    yws = todo
+
+                # espn rate limits; the fetcher keeps us under the limit. Every
+                # page is parsed and cached as it arrives, so an error part way
+                # through keeps the weeks before it
+                stage.add('pages_requested', len(yws))
+                resps = metrics.timed(
+                    self.fetcher.imap(url for (y, w, url) in yws), stage, 'fetch_seconds'
+                )
+                for (y, w, url) in yws:
+                    self.update_from_response(next(resps), y, w)
+
+            self.rankings = [
+                ranking
+                for (y, w, url) in self.espn_ranking_urls()
+                if self.cache.has(y, w)
+                for ranking in self.cache.get(y, w)
+            ]
+            stage.add('rows_out', len(self.rankings))
+
+    def invalidate(self, year=None, week=None):
+        """ forget cached rankings (see scrape_cache.UnitCache.invalidate) """
+        self.cache.invalidate(year, week)
 
     def espn_ranking_urls(self):
         """ generater of espn ranking urls """
@@ -91,54 +136,154 @@ class EspnRankingHistory(RankingHistory):
             yield y, w, self.url.format(year=y, week=w)
 
     def update_from_url(self, url, y, w):
-        try:
-            logging.info('loading {}'.format(url))
-            resp = requests.get(url)
-            x = html.fromstring(resp.text)
-
-            tabs = x.xpath('//table[@class="rankings has-team-logos"]')
-            for tab in tabs:
-                ranktype = tab.xpath('caption')[0].text.lower().replace(' ', '_')
-
-                rows = tab.xpath('tbody/tr')
-
-                # start-of-year AP polls are often represented as just 1 team
-                # (previous year champion, etc). Can't tell if it's a bug or
-                # intentional, but it is definitely not desirable. Example:
-                # http://espn.go.com/college-football/rankings/_/seasontype/2/year/2003/week/1
-                if len(rows) < 20:
-                    continue
-
-                for row in rows:
-                    # ties are represented as an empty rank
-                    try:
-                        rank = int(row.xpath('td/span[@class="number"]')[0].text)
-                    except IndexError:
-                        rank = lastrank
-
-                    # some teams do not have links but rather spans
-                    try:
-                        team = row.xpath('td/a/abbr')[0]
-                    except:
-                        team = row.xpath('td/span/abbr')[0]
-
-                    fullname = team.attrib['title']
-                    codename = team.text
-                    self.rankings.append({
-                        'rank_type': ranktype,
-                        'rank': rank,
-                        'codename': codename,
-                        'fullname': fullname,
-                        'year': y,
-                        'week': w,
-                    })
-                    lastrank = rank
-        except Exception as e:
-            logging.info("unplanned exception for url {}".format(url))
-            logging.error("error message: {}".format(e))
-            raise
-
-    # saving / re-loading pkl files
-    def save_rankings(self):
-        with open(self.frank, 'wb') as f:
-            pickle.dump(self.rankings, f)
+        return self.update_from_response(self.fetcher.get(url), y, w)
+
+    def update_from_response(self, resp, y, w):
+        """ parse a rankings page and cache the rankings for (y, w) """
+        with metrics.span('week', level=logging.DEBUG, year=y, week=w) as s:
+            origin = 'from_store' if getattr(resp, 'from_store', False) else 'fetched'
+            s.add('pages_{}'.format(origin))
+            s.add('bytes_{}'.format(origin), len(resp.content))
+            t0 = time.time()
+            try:
+                rankings = parse_rankings(resp.text, y, w)
+            except Exception as e:
+                logging.info("unplanned exception for url {}".format(resp.url))
+                logging.error("error message: {}".format(e))
+                raise
+            s.add('parse_seconds', time.time() - t0)
+            s.add('rows_parsed', len(rankings))
+            self.save_rankings(y, w, rankings)
+        return rankings
+
+    def reparse_from_store(self, yws, processes=None):
+        """ parse the stored pages for (year, week, url) tuples yws again """
+        if self.fetcher.store is None:
+            raise ValueError('reparsing requires a fetcher with a response store')
+        with metrics.span('reparse', pages=len(yws)) as s:
+            parsed = response_store.reparse(
+                self.fetcher.store,
+                [(url, (y, w)) for (y, w, url) in yws],
+                parse_rankings,
+                processes=processes
+            )
+            for ((y, w, url), rankings) in zip(yws, parsed):
+                if rankings is None:
+                    logger.warning('no stored page for {}'.format(url))
+                    s.add('pages_missing')
+                else:
+                    s.add('rows_parsed', len(rankings))
+                    self.save_rankings(y, w, rankings)
+
+    # saving parsed weeks
+    def save_rankings(self, y, w, rankings):
+        """ cache a week's rankings; a week without any is only cached once
+            the season is over (it might still be published)
+
+        """
+        if rankings or scrape_cache.is_past_season(y):
+            self.cache.put(y, w, rankings)
+
+
+# ----------------------------- #
+#   page parsing                #
+# ----------------------------- #
+
+def parse_rankings(text, y, w):
+    """ list of ranking dicts from the text of an espn rankings page
+
+        uses the precompiled XP_* queries, one table at a time, and no
+        exceptions for the expected quirks (blank ranks for ties, teams
+        without links). parse_rankings_by_row is the original version.
+
+    """
+    rankings = []
+    x = html.fromstring(text)
+    xpRank = XP_RANK.get()
+    xpTeam = XP_TEAM.get()
+
+    for tab in XP_TABLES(x):
+        caption = XP_CAPTION(tab)
+        ranktype = caption[0].lower().replace(' ', '_')
+
+        rows = XP_ROWS(tab)
+
+        # start-of-year AP polls are often represented as just 1 team
+        # (previous year champion, etc). Can't tell if it's a bug or
+        # intentional, but it is definitely not desirable. Example:
+        # http://espn.go.com/college-football/rankings/_/seasontype/2/year/2003/week/1
+        if len(rows) < 20:
+            continue
+
+        lastrank = None
+        for row in rows:
+            # ties are represented as an empty rank
+            rank = xpRank(row)
+            rank = int(rank[0]) if rank else lastrank
+
+            # some teams do not have links but rather spans
+            team = xpTeam(row)[0]
+
+            rankings.append({
+                'rank_type': ranktype,
+                'rank': rank,
+                'codename': team.text,
+                'fullname': team.get('title'),
+                'year': y,
+                'week': w,
+            })
+            lastrank = rank
+
+    return rankings
+
+
+def parse_rankings_by_row(text, y, w):
+    """ list of ranking dicts from the text of an espn rankings page
+
+        the original row-by-row parser (fresh xpath queries for every row,
+        exceptions for ties and link-less teams); kept as a reference for
+        parse_rankings
+
+    """
+    rankings = []
+    x = html.fromstring(text)
+
+    tabs = x.xpath('//table[@class="rankings has-team-logos"]')
+    for tab in tabs:
+        ranktype = tab.xpath('caption')[0].text.lower().replace(' ', '_')
+
+        rows = tab.xpath('tbody/tr')
+
+        # start-of-year AP polls are often represented as just 1 team
+        # (previous year champion, etc). Can't tell if it's a bug or
+        # intentional, but it is definitely not desirable. Example:
+        # http://espn.go.com/college-football/rankings/_/seasontype/2/year/2003/week/1
+        if len(rows) < 20:
+            continue
+
+        for row in rows:
+            # ties are represented as an empty rank
+            try:
+                rank = int(row.xpath('td/span[@class="number"]')[0].text)
+            except IndexError:
+                rank = lastrank
+
+            # some teams do not have links but rather spans
+            try:
+                team = row.xpath('td/a/abbr')[0]
+            except:
+                team = row.xpath('td/span/abbr')[0]
+
+            fullname = team.attrib['title']
+            codename = team.text
+            rankings.append({
+                'rank_type': ranktype,
+                'rank': rank,
+                'codename': codename,
+                'fullname': fullname,
+                'year': y,
+                'week': w,
+            })
+            lastrank = rank
+
+    return rankings
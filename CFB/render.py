@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: render.py
+Author: zlamberty
+Created: 2016-03-12
+
+Description:
+    headless, batch rendering of the DownAndDistance situational plots
+
+    every (season, down, distance) of a grid gets one figure -- the play
+    choice by spot and the mean result (with its standard error) of rushes and
+    passes by spot -- written as png / svg next to an .npz of the arrays that
+    went into it. Figures are drawn on the non-interactive Agg backend in a
+    pool of worker processes, each straight from the cached situation cube of
+    its season(s) (see situation_cube.py), and the time each one took is
+    reported.
+
+    a "season" in the grid is a year, or a tuple of years to be combined
+    into one figure.
+
+Usage:
+    python render.py --downs 1 2 3 --distances 1 5 10 --years 2012 2013 \
+        --outdir reports [--formats png svg] [-j 8] [--combined]
+
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+
+import downanddistance as dnd
+import logconfig
+import situation_cube
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+PLAY_TYPES = ['RUSH', 'PASS']
+F_FIGURE = '{label:}_down{down:}_dist{distance:}'
+logger = logging.getLogger("render")
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def season_label(season):
+    """ 2013 --> '2013', (2005, ..., 2013) --> '2005-2013' """
+    if isinstance(season, (tuple, list)):
+        season = sorted(season)
+        return '{}-{}'.format(season[0], season[-1]) if len(season) > 1 else str(season[0])
+    return str(season)
+
+
+def season_cube(season):
+    years = season if isinstance(season, (tuple, list)) else [season]
+    return situation_cube.SituationCube.merge(dnd.load_season_cube(y) for y in years)
+
+
+def situation_arrays(cube, down, distance):
+    """ dict of the arrays behind one figure, all by 100 - spot """
+    arrs = {'yards_to_go': np.arange(100)}
+    choice = dnd.play_choice_by_spot(cube, down, distance)
+    arrs['plays'] = choice.pop('TOTAL')
+    for (pt, frac) in choice.items():
+        arrs['fraction_{}'.format(pt.lower())] = frac
+    for pt in PLAY_TYPES:
+        n, mean, std = [a[::-1][:100] for a in cube.stats(down, distance, pt)]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            arrs['mean_gain_{}'.format(pt.lower())] = -mean
+            arrs['sem_gain_{}'.format(pt.lower())] = std / np.sqrt(n)
+    return arrs
+
+
+def draw(arrs, title, base):
+    f = dnd.new_figure(fname=base)
+    f.set_size_inches(12, 4.5)
+    f.suptitle(title)
+
+    s = f.add_subplot(121)
+    for key in sorted(arrs):
+        if key.startswith('fraction_'):
+            s.plot(arrs[key], label=key[len('fraction_'):].upper())
+    s.set_xlabel('yards to go for a touchdown')
+    s.set_ylabel('fraction of plays')
+    s.legend()
+
+    s = f.add_subplot(122)
+    x = arrs['yards_to_go']
+    for pt in PLAY_TYPES:
+        s.errorbar(
+            x, arrs['mean_gain_{}'.format(pt.lower())],
+            arrs['sem_gain_{}'.format(pt.lower())], label=pt
+        )
+    s.set_xlabel('yards to go for a touchdown')
+    s.set_ylabel('mean yards gained')
+    s.legend()
+    return f
+
+
+def render_situation(job):
+    """ render one (season, down, distance) figure; returns a dict of what
+        was written and how long it took
+
+    """
+    season, down, distance, outdir, formats = job
+    t0 = time.time()
+    label = season_label(season)
+    base = os.path.join(outdir, F_FIGURE.format(label=label, down=down, distance=distance))
+
+    arrs = situation_arrays(season_cube(season), down, distance)
+    np.savez(base + '.npz', **arrs)
+    f = draw(arrs, '{}: down {}, {} to go'.format(label, down, distance), base)
+    files = [base + '.npz']
+    for fmt in formats:
+        f.savefig('{}.{}'.format(base, fmt), format=fmt)
+        files.append('{}.{}'.format(base, fmt))
+
+    return {
+        'season': label,
+        'down': down,
+        'distance': distance,
+        'plays': int(arrs['plays'].sum()),
+        'files': files,
+        'seconds': time.time() - t0,
+    }
+
+
+def render_grid(downs, distances, seasons, outdir, formats=('png', 'svg'), processes=None):
+    """ render every (season, down, distance) of the grid into outdir
+
+        returns the list of render_situation records (also written to
+        outdir/timings.json), in grid order
+
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    jobs = [
+        (season, down, distance, outdir, tuple(formats))
+        for (season, down, distance) in itertools.product(seasons, downs, distances)
+    ]
+
+    # build any missing season cubes up front, so that workers don't race to
+    # write the same cache
+    for y in set(itertools.chain.from_iterable(
+            s if isinstance(s, (tuple, list)) else [s] for s in seasons)):
+        dnd.load_season_cube(y)
+
+    t0 = time.time()
+    if processes == 1:
+        records = [render_situation(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            records = pool.map(render_situation, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    total = time.time() - t0
+
+    for rec in records:
+        logger.info('{season}, down {down}, {distance} to go: {plays} plays, {seconds:.3f}s'.format(**rec))
+    logger.info('rendered {} figures in {:.2f}s'.format(len(records), total))
+
+    with open(os.path.join(outdir, 'timings.json'), 'wb') as f:
+        f.write(json.dumps({'total': total, 'figures': records}, indent=2).encode('utf-8'))
+
+    return records
+
+
+def main(downs, distances, years, outdir, formats=('png', 'svg'), processes=None,
+         combined=False):
+    seasons = [tuple(years)] if combined else years
+    render_grid(downs, distances, seasons, outdir, formats=formats, processes=processes)
+
+
+# ----------------------------- #
+#   Command line                #
+# ----------------------------- #
+
+def parse_args():
+    """ Take a log file from the commmand line """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--downs", help="downs to plot", type=int, nargs='*', default=[1, 2, 3, 4])
+    parser.add_argument("--distances", help="distances to plot", type=int, nargs='*', default=[1, 2, 5, 10])
+    parser.add_argument("--years", help="seasons to plot", type=int, nargs='*', required=True)
+    parser.add_argument("--outdir", help="output directory", default='reports')
+    parser.add_argument("--formats", help="image formats", nargs='*', default=['png', 'svg'])
+    parser.add_argument("-j", "--processes", help="worker processes (default: all cores)", type=int)
+    parser.add_argument("--combined", help="one figure for all years together instead of one per year", action='store_true')
+
+    args = parser.parse_args()
+
+    logger.debug("arguments set to {}".format(vars(args)))
+
+    return args
+
+
+if __name__ == '__main__':
+
+    logconfig.configure()
+
+    args = parse_args()
+
+    main(
+        downs=args.downs,
+        distances=args.distances,
+        years=args.years,
+        outdir=args.outdir,
+        formats=args.formats,
+        processes=args.processes,
+        combined=args.combined,
+    )
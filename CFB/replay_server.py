@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: replay_server.py
+Author: zlamberty
+Created: 2016-01-23
+
+Description:
+    a local stand-in for espn: a threaded http server that serves recorded
+    pages, so the scrapers and the fetch layer can be exercised without
+    touching the network
+
+    pages are a dict of url path --> body (or a directory of recorded pages,
+    one file per path, see path_to_fname). Paths that aren't recorded get a
+    404. The first `failures` requests for a path get a 503, which is handy
+    for watching the retry / backoff logic do its thing. Every page is served
+    with an ETag (the sha1 of its body), and If-None-Match is honored with a
+    304, like espn's cdn does.
+
+Usage:
+    with ReplayServer(pages) as server:
+        r = EspnRankingHistory(url=server.url + RANKING_PATH, ...)
+        r.load_rankings(forceReload=True)
+
+"""
+
+import BaseHTTPServer
+import SocketServer
+import collections
+import hashlib
+import os
+import threading
+import time
+import urllib
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def path_to_fname(path):
+    """ filename of the recorded page for a url path """
+    return urllib.quote(path, safe='')
+
+
+def load_pages(pagedir):
+    """ dict of url path --> body for all recorded pages in pagedir """
+    pages = {}
+    for fname in os.listdir(pagedir):
+        with open(os.path.join(pagedir, fname), 'rb') as f:
+            pages[urllib.unquote(fname)] = f.read()
+    return pages
+
+
+class _ThreadingServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ReplayServer(object):
+    """ serve recorded pages on localhost (on a free port) """
+    def __init__(self, pages, failures=0, delay=0, port=0):
+        self.pages = load_pages(pages) if isinstance(pages, basestring) else dict(pages)
+        self.failures = failures
+        self.delay = delay
+        self.port = port
+        self.hits = collections.Counter()
+        self.lock = threading.Lock()
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server.lock:
+                    server.hits[self.path] += 1
+                    nhits = server.hits[self.path]
+                if server.delay:
+                    time.sleep(server.delay)
+
+                if self.path not in server.pages:
+                    self.send_error(404)
+                elif nhits <= server.failures:
+                    self.send_error(503)
+                else:
+                    body = server.pages[self.path]
+                    etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+                    if self.headers.get('If-None-Match') == etag:
+                        self.send_response(304)
+                        self.send_header('ETag', etag)
+                        self.end_headers()
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/html; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = _ThreadingServer(('127.0.0.1', self.port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
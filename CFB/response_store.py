@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: response_store.py
+Author: zlamberty
+Created: 2016-02-06
+
+Description:
+    content-addressed on-disk store of raw http responses
+
+    bodies are stored (zlib compressed) once per sha1 of their content under
+    objects/, and every url has a small json index entry pointing at its
+    current body along with the ETag / Last-Modified headers it was served
+    with. The fetcher uses those to revalidate (a 304 means "use the stored
+    body"), and the scrapers can re-parse everything from the store without
+    touching the network -- see reparse.
+
+Usage:
+    store = ResponseStore()
+    f = fetch.Fetcher(store=store)
+    ...
+    records = reparse(store, [(url, (y, w)), ...], parse_rankings, processes=8)
+
+"""
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import zlib
+
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+DATA_DIR = os.path.join(HERE, 'data')
+STORE_DIR = os.path.join(DATA_DIR, 'response_store')
+logger = logging.getLogger("response_store")
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def _atomic_write(fname, data):
+    fdir = os.path.dirname(fname)
+    if not os.path.isdir(fdir):
+        try:
+            os.makedirs(fdir)
+        except OSError:
+            # another thread / process beat us to it
+            if not os.path.isdir(fdir):
+                raise
+    fd, ftmp = tempfile.mkstemp(dir=fdir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.rename(ftmp, fname)
+
+
+class StoredResponse(object):
+    """ the bits of a requests.Response the scrapers use, for a stored body """
+    def __init__(self, url, content, encoding=None, status_code=200):
+        self.url = url
+        self.content = content
+        self.encoding = encoding
+        self.status_code = status_code
+        self.from_store = True
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', 'replace')
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def raise_for_status(self):
+        pass
+
+
+class ResponseStore(object):
+    """ raw response bodies keyed by url, stored by content hash """
+    def __init__(self, storedir=STORE_DIR):
+        self.storedir = storedir
+
+    def _index_fname(self, url):
+        h = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.storedir, 'index', h[:2], '{}.json'.format(h))
+
+    def _object_fname(self, sha):
+        return os.path.join(self.storedir, 'objects', sha[:2], sha)
+
+    def meta(self, url):
+        """ index entry for url (None if we've never stored it) """
+        try:
+            with open(self._index_fname(url), 'rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError):
+            return None
+
+    def has(self, url):
+        return self.meta(url) is not None
+
+    def body(self, sha):
+        with open(self._object_fname(sha), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def get(self, url):
+        """ StoredResponse for url, or None """
+        meta = self.meta(url)
+        if meta is None:
+            return None
+        return StoredResponse(url, self.body(meta['sha1']), meta.get('encoding'))
+
+    def put(self, url, content, headers=None, encoding=None):
+        """ store the body of a response for url; returns its sha1 """
+        headers = headers or {}
+        sha = hashlib.sha1(content).hexdigest()
+        if not os.access(self._object_fname(sha), os.R_OK):
+            _atomic_write(self._object_fname(sha), zlib.compress(content))
+        meta = {
+            'url': url,
+            'sha1': sha,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'encoding': encoding,
+            'fetched': time.time(),
+        }
+        _atomic_write(self._index_fname(url), json.dumps(meta).encode('utf-8'))
+        return sha
+
+    def conditional_headers(self, url):
+        """ If-None-Match / If-Modified-Since headers to revalidate url """
+        meta = self.meta(url) or {}
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+
+# ----------------------------- #
+#   re-parsing                  #
+# ----------------------------- #
+
+def _reparse_one(job):
+    storedir, url, parser, args = job
+    resp = ResponseStore(storedir).get(url)
+    if resp is None:
+        return None
+    return parser(resp.text, *args)
+
+
+def reparse(store, jobs, parser, processes=None):
+    """ parse stored bodies again, in parallel across processes
+
+        jobs is a list of (url, args); the result is a list (in the same order)
+        of parser(text, *args), or None for urls that aren't in the store.
+        parser has to be a module-level function so it can be pickled.
+
+    """
+    tasks = [(store.storedir, url, parser, tuple(args)) for (url, args) in jobs]
+    if processes == 1:
+        return [_reparse_one(t) for t in tasks]
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(
+            _reparse_one, tasks, chunksize=max(1, len(tasks) // (4 * processes))
+        )
+    finally:
+        pool.close()
+        pool.join()
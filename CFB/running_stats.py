@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: running_stats.py
+Author: zlamberty
+Created: 2016-03-05
+
+Description:
+    bucketed running count / mean / M2 (Welford) accumulators
+
+    values are fed in chunks along with the bucket each one belongs to; every
+    chunk is reduced to per-bucket (count, mean, M2) with bincount and folded
+    into the running totals with the pairwise update of Chan et al., which is
+    Welford's algorithm a chunk at a time. Memory only depends on the number
+    of buckets, and accumulators built separately (per season, per worker)
+    merge the same way, to the same answer as one pass over everything.
+
+Usage:
+    rs = RunningStats((2, 101))
+    for chunk in chunks:
+        rs.add((chunk.type, chunk.spot), chunk.result)
+    rs.merge(otherRs)
+    rs.mean, rs.std, rs.sem
+
+"""
+
+import numpy as np
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+class RunningStats(object):
+    """ count, mean and M2 (sum of squared deviations from the mean) for
+        every bucket of an array of the given shape
+
+    """
+    def __init__(self, shape):
+        self.shape = tuple(np.atleast_1d(shape))
+        self.count = np.zeros(self.shape, dtype=np.int64)
+        self.mean = np.zeros(self.shape)
+        self.m2 = np.zeros(self.shape)
+
+    def add(self, index, values):
+        """ fold a chunk of values in; index is a tuple of integer arrays (one
+            per dimension, like np.ravel_multi_index takes) or, for 1-d
+            accumulators, a single array
+
+        """
+        values = np.asarray(values, dtype=float)
+        if len(self.shape) == 1 and not isinstance(index, tuple):
+            index = (index,)
+        flat = np.ravel_multi_index(index, self.shape)
+        size = self.count.size
+
+        n = np.bincount(flat, minlength=size)
+        s = np.bincount(flat, weights=values, minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(n > 0, s / n, 0.)
+        m2 = np.bincount(flat, weights=(values - mean[flat]) ** 2, minlength=size)
+
+        self._combine(
+            n.reshape(self.shape), mean.reshape(self.shape), m2.reshape(self.shape)
+        )
+        return self
+
+    def _combine(self, n, mean, m2):
+        total = self.count + n
+        delta = mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frac = np.where(total > 0, n / total.astype(float), 0.)
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * frac
+        self.mean = self.mean + delta * frac
+        self.count = total
+
+    def merge(self, other):
+        """ fold another accumulator (of the same shape) into this one """
+        if other.shape != self.shape:
+            raise ValueError('cannot merge shapes {} and {}'.format(self.shape, other.shape))
+        self._combine(other.count, other.mean, other.m2)
+        return self
+
+    @classmethod
+    def merged(cls, accumulators):
+        accumulators = list(accumulators)
+        total = cls(accumulators[0].shape)
+        for acc in accumulators:
+            total.merge(acc)
+        return total
+
+    @property
+    def var(self):
+        """ population variance (nan for empty buckets) """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 0, self.m2 / self.count, np.nan)
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    @property
+    def sem(self):
+        """ standard error of the mean, std / sqrt(count) """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.std / np.sqrt(self.count)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: scrape_cache.py
+Author: zlamberty
+Created: 2016-01-30
+
+Description:
+    per-unit cache of scraped espn history
+
+    every parsed page (or group of pages) is pickled on its own, one file per
+    (source, year, week) -- week is None for sources that are only by year,
+    like conference membership. The scrapers assemble whatever range they are
+    asked for from the cached units and only fetch the ones that are missing,
+    so a crash only loses the unit in progress and extending a range by a
+    season only fetches that season.
+
+    a unit of a season that is over (see is_past_season) is cached even
+    when it has no records (a week nobody played, a poll that wasn't
+    published), so it isn't requested again; units of the current season
+    are only cached once they are complete.
+
+Usage:
+    c = UnitCache('rankings')
+    if not c.has(2015, 14):
+        c.put(2015, 14, records)
+    records = c.get(2015, 14)
+    c.invalidate(year=2015)
+
+"""
+
+import cPickle as pickle
+import datetime
+import glob
+import logging
+import os
+import shutil
+import tempfile
+
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+DATA_DIR = os.path.join(HERE, 'data')
+CACHE_DIR = os.path.join(DATA_DIR, 'scrape_cache')
+# a season is over on february 1 of the next year: the bowl games are done
+# by mid january
+SEASON_OVER = (2, 1)
+logger = logging.getLogger("scrape_cache")
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def is_past_season(year, today=None):
+    """ True once the season of year is over, so its pages won't change """
+    today = today or datetime.date.today()
+    return today >= datetime.date(year + 1, *SEASON_OVER)
+
+
+class UnitCache(object):
+    """ pickled records for each (year, week) unit of one scraped source """
+    def __init__(self, source, cachedir=CACHE_DIR):
+        self.source = source
+        self.cachedir = os.path.join(cachedir, source)
+
+    def fname(self, year, week=None):
+        return os.path.join(
+            self.cachedir,
+            str(year),
+            '{}.pkl'.format('all' if week is None else week)
+        )
+
+    def has(self, year, week=None):
+        return os.access(self.fname(year, week), os.R_OK)
+
+    def get(self, year, week=None):
+        with open(self.fname(year, week), 'rb') as f:
+            return pickle.load(f)
+
+    def put(self, year, week, records):
+        """ atomically write the records of one unit """
+        fname = self.fname(year, week)
+        fdir = os.path.dirname(fname)
+        if not os.path.isdir(fdir):
+            os.makedirs(fdir)
+        fd, ftmp = tempfile.mkstemp(dir=fdir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(records, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(ftmp, fname)
+
+    def units(self):
+        """ sorted list of the cached (year, week) units """
+        units = []
+        for fname in glob.glob(os.path.join(self.cachedir, '*', '*.pkl')):
+            year = int(os.path.basename(os.path.dirname(fname)))
+            week = os.path.basename(fname)[:-4]
+            units.append((year, None if week == 'all' else int(week)))
+        return sorted(units)
+
+    def missing(self, units):
+        """ the (year, week) units not in the cache """
+        return [(y, w) for (y, w) in units if not self.has(y, w)]
+
+    def invalidate(self, year=None, week=None):
+        """ drop cached units: everything (no args), a whole year, or a
+            single (year, week)
+
+        """
+        if year is None:
+            logger.info('invalidating all cached {}'.format(self.source))
+            if os.path.isdir(self.cachedir):
+                shutil.rmtree(self.cachedir)
+        elif week is None and os.path.isdir(os.path.dirname(self.fname(year))):
+            logger.info('invalidating cached {} for {}'.format(self.source, year))
+            shutil.rmtree(os.path.dirname(self.fname(year)))
+        elif self.has(year, week):
+            logger.info('invalidating cached {} for {}, {}'.format(self.source, year, week))
+            os.remove(self.fname(year, week))
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: season_cache.py
+Author: zlamberty
+Created: 2016-01-09
+
+Description:
+    typed, columnar cache of the cfbstats csv files in ./data/<year>/
+
+    every csv file is converted (once) into a directory of per-column .npy
+    arrays plus a small json manifest recording the size and mtime of the
+    source csv. If the source csv changes, the manifest no longer matches and
+    the cache is rebuilt the next time it is requested. Columns are loaded
+    memory-mapped, so asking for 3 columns of rush.csv only touches those 3
+    columns on disk.
+
+Usage:
+    python season_cache.py [--years 2005 2006 ...] [--names rush pass ...] [--force]
+
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import re
+import shutil
+
+import numpy as np
+
+import lazyimport
+import logconfig
+
+pd = lazyimport.lazy_import('pandas')
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+DATA_DIR = os.path.join(HERE, 'data')
+F_CSV = os.path.join(DATA_DIR, '{year:}', '{name:}.csv')
+CACHE_DIR = os.path.join(DATA_DIR, '{year:}', '.npcache', '{name:}')
+F_MANIFEST = 'manifest.json'
+logger = logging.getLogger("season_cache")
+
+
+# ----------------------------- #
+#   generic column storage      #
+# ----------------------------- #
+
+def fingerprint(fnames):
+    """ size and mtime of every source file; used to invalidate caches """
+    fp = {}
+    for fname in fnames:
+        st = os.stat(fname)
+        fp[os.path.basename(fname)] = {'size': st.st_size, 'mtime': st.st_mtime}
+    return fp
+
+
+def column_fname(column):
+    """ a filesystem-safe name for a column ("Game Code" --> "game_code.npy") """
+    return '{}.npy'.format(re.sub(r'[^0-9a-z]+', '_', column.lower()).strip('_'))
+
+
+def read_manifest(cachedir):
+    try:
+        with open(os.path.join(cachedir, F_MANIFEST), 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def is_fresh(cachedir, sources, version=None):
+    """ true if cachedir holds a complete cache built from the current sources
+        (by the given version of the code that builds it)
+
+    """
+    manifest = read_manifest(cachedir)
+    if manifest is None:
+        return False
+    try:
+        return (
+            manifest['sources'] == fingerprint(sources)
+            and manifest.get('version') == version
+        )
+    except OSError:
+        return False
+
+
+def save_columns(df, cachedir, sources, version=None):
+    """ write every column of df to cachedir as its own .npy file
+
+        string columns are stored as fixed-width strings (missing --> ''),
+        numeric columns keep the dtype pandas inferred for them. The manifest
+        is written last, so a half-written cache is never considered fresh.
+        version is recorded for is_fresh.
+
+    """
+    if os.path.isdir(cachedir):
+        shutil.rmtree(cachedir)
+    os.makedirs(cachedir)
+
+    columns = []
+    for col in df.columns:
+        s = df[col]
+        if s.dtype == object:
+            arr = s.fillna('').values.astype(str)
+        else:
+            arr = s.values
+        fname = column_fname(col)
+        np.save(os.path.join(cachedir, fname), arr)
+        columns.append({'name': col, 'file': fname, 'dtype': arr.dtype.str})
+
+    manifest = {
+        'sources': fingerprint(sources),
+        'columns': columns,
+        'nrows': len(df),
+    }
+    if version is not None:
+        manifest['version'] = version
+    with open(os.path.join(cachedir, F_MANIFEST), 'wb') as f:
+        f.write(json.dumps(manifest, indent=2).encode('utf-8'))
+
+
+def load_columns(cachedir, columns=None, mmap=True):
+    """ dict of column name --> array for the requested columns (all if None) """
+    manifest = read_manifest(cachedir)
+    if manifest is None:
+        raise IOError('no column cache in {}'.format(cachedir))
+    files = dict((c['name'], c['file']) for c in manifest['columns'])
+    if columns is None:
+        columns = [c['name'] for c in manifest['columns']]
+    missing = [c for c in columns if c not in files]
+    if missing:
+        raise KeyError('columns {} not in cache {}'.format(missing, cachedir))
+    return collections.OrderedDict(
+        (c, np.load(os.path.join(cachedir, files[c]), mmap_mode='r' if mmap else None))
+        for c in columns
+    )
+
+
+# ----------------------------- #
+#   cfbstats seasons            #
+# ----------------------------- #
+
+def available_years(datadir=DATA_DIR):
+    """ every season that has a data directory """
+    return sorted(
+        int(d) for d in os.listdir(datadir)
+        if d.isdigit() and os.path.isdir(os.path.join(datadir, d))
+    )
+
+
+def build(year, name, forceRebuild=False):
+    """ convert data/<year>/<name>.csv into a column cache (if stale) """
+    fcsv = F_CSV.format(year=year, name=name)
+    cachedir = CACHE_DIR.format(year=year, name=name)
+    if not forceRebuild and is_fresh(cachedir, [fcsv]):
+        return cachedir
+    logger.info('building column cache for {}'.format(fcsv))
+    df = pd.read_csv(fcsv)
+    save_columns(df, cachedir, [fcsv])
+    return cachedir
+
+
+def load_arrays(name, year, columns=None, mmap=True):
+    """ dict of (memory mapped) arrays for some columns of one season's file """
+    return load_columns(build(year, name), columns=columns, mmap=mmap)
+
+
+def load(name, years=None, columns=None, mmap=True):
+    """ dataframe of the requested columns of <name>.csv for several seasons
+
+        a 'year' column is added to identify the season of each row. Seasons
+        without the requested file are skipped with a warning.
+
+    """
+    years = available_years() if years is None else years
+    frames = []
+    for y in years:
+        if not os.path.isfile(F_CSV.format(year=y, name=name)):
+            logger.warning('no {}.csv for year {}'.format(name, y))
+            continue
+        arrs = load_arrays(name, y, columns=columns, mmap=mmap)
+        df = pd.DataFrame(arrs, columns=list(arrs))
+        df.loc[:, 'year'] = int(y)
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=(columns or []) + ['year'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def build_all(years=None, names=None, forceRebuild=False):
+    years = available_years() if years is None else years
+    for y in years:
+        if names is None:
+            ynames = sorted(
+                f[:-4] for f in os.listdir(os.path.join(DATA_DIR, str(y)))
+                if f.endswith('.csv')
+            )
+        else:
+            ynames = names
+        for name in ynames:
+            build(y, name, forceRebuild=forceRebuild)
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def main(years=None, names=None, force=False):
+    """ pre-build the column caches """
+    build_all(years=years, names=names, forceRebuild=force)
+
+
+# ----------------------------- #
+#   Command line                #
+# ----------------------------- #
+
+def parse_args():
+    """ Take a log file from the commmand line """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", help="seasons to cache", type=int, nargs='*')
+    parser.add_argument("--names", help="csv files (no extension) to cache", nargs='*')
+    parser.add_argument("-f", "--force", help="rebuild even if fresh", action='store_true')
+
+    args = parser.parse_args()
+
+    logger.debug("arguments set to {}".format(vars(args)))
+
+    return args
+
+
+if __name__ == '__main__':
+
+    logconfig.configure()
+
+    args = parse_args()
+
+    main(years=args.years, names=args.names, force=args.force)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: situation_cube.py
+Author: zlamberty
+Created: 2016-02-27
+
+Description:
+    precomputed down x distance bucket x spot x play type histograms of plays
+
+    for every cell we keep the number of plays and the sum and sum of squares
+    of their results, so counts, means and standard errors for any situation
+    come straight out of the arrays without looking at a single play. Cubes
+    are built with one bincount per array, add up cell by cell (so seasons can
+    be combined without touching the plays again), and are cached per season
+    next to the column caches.
+
+    axes:
+        down: 0 (kickoffs / unknown), 1 - 4
+        distance: one bucket per yard from 1 to 10, then 11-15, 16-20, 21-30
+            and 31+ (bucket 0 is kickoffs / unknown); see DISTANCE_EDGES
+        spot: 0 - 100
+        play type: the cube's playTypes list
+
+Usage:
+    cube = SituationCube.from_store(plays)
+    n, mean, std = cube.stats(3, 4, 'PASS')
+    cube = SituationCube.merge([cube2012, cube2013])
+
+"""
+
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+import season_cache as sc
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+CACHE_NAME = 'cube'
+NDOWNS = 5
+NSPOTS = 101
+# lower edges of the distance buckets after the unknown bucket 0
+DISTANCE_EDGES = np.array([1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 16, 21, 31])
+NDISTANCES = len(DISTANCE_EDGES) + 1
+ARRAYS = ['count', 'sum', 'sumsq']
+logger = logging.getLogger("situation_cube")
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def down_index(down):
+    down = np.asarray(down)
+    return np.where((down >= 1) & (down <= 4), down, 0)
+
+
+def distance_bucket(distance):
+    """ distance bucket of each distance (0 for kickoffs / unknown) """
+    return np.searchsorted(DISTANCE_EDGES, distance, side='right')
+
+
+class SituationCube(object):
+    """ count, sum and sum of squares of play results by down, distance
+        bucket, spot and play type
+
+    """
+    def __init__(self, count, sum, sumsq, playTypes):
+        self.count = count
+        self.sum = sum
+        self.sumsq = sumsq
+        self.playTypes = list(playTypes)
+
+    @classmethod
+    def zeros(cls, playTypes):
+        shape = (NDOWNS, NDISTANCES, NSPOTS, len(playTypes))
+        return cls(
+            np.zeros(shape, dtype=np.int64),
+            np.zeros(shape),
+            np.zeros(shape),
+            playTypes
+        )
+
+    @classmethod
+    def from_store(cls, store):
+        """ the cube of the plays in a play_store.PlayStore (plays without a
+            spot are left out)
+
+        """
+        cube = cls.zeros(store.playTypes)
+        spot = store['spot'].astype(np.intp)
+        ok = (spot >= 0) & (spot < NSPOTS)
+        flat = np.ravel_multi_index(
+            (
+                down_index(store['down'][ok]),
+                distance_bucket(store['distance'][ok]),
+                spot[ok],
+                store['play_type'][ok],
+            ),
+            cube.count.shape
+        )
+        res = store['result'][ok].astype(float)
+        size = cube.count.size
+        cube.count.flat[:] = np.bincount(flat, minlength=size)
+        cube.sum.flat[:] = np.bincount(flat, weights=res, minlength=size)
+        cube.sumsq.flat[:] = np.bincount(flat, weights=res ** 2, minlength=size)
+        return cube
+
+    @classmethod
+    def merge(cls, cubes):
+        """ the sum of several cubes (play types are lined up by name) """
+        cubes = list(cubes)
+        playTypes = sorted(set(pt for c in cubes for pt in c.playTypes))
+        total = cls.zeros(playTypes)
+        for c in cubes:
+            idx = np.searchsorted(playTypes, c.playTypes)
+            for name in ARRAYS:
+                np.add.at(
+                    np.moveaxis(getattr(total, name), -1, 0),
+                    idx,
+                    np.moveaxis(getattr(c, name), -1, 0)
+                )
+        return total
+
+    def __add__(self, other):
+        return SituationCube.merge([self, other])
+
+    # persistence ------------------------------------------------------------
+    def save(self, cachedir, sources, version=None):
+        """ write the arrays to cachedir, with a manifest of the sources they
+            were built from and the version of the code that read them (see
+            season_cache.is_fresh)
+
+        """
+        if os.path.isdir(cachedir):
+            shutil.rmtree(cachedir)
+        os.makedirs(cachedir)
+        for name in ARRAYS:
+            np.save(os.path.join(cachedir, '{}.npy'.format(name)), getattr(self, name))
+        manifest = {
+            'sources': sc.fingerprint(sources),
+            'version': version,
+            'playTypes': self.playTypes,
+            'distanceEdges': DISTANCE_EDGES.tolist(),
+        }
+        with open(os.path.join(cachedir, sc.F_MANIFEST), 'wb') as f:
+            f.write(json.dumps(manifest, indent=2).encode('utf-8'))
+
+    @classmethod
+    def load(cls, cachedir):
+        manifest = sc.read_manifest(cachedir)
+        if manifest is None:
+            raise IOError('no situation cube in {}'.format(cachedir))
+        arrs = [np.load(os.path.join(cachedir, '{}.npy'.format(name))) for name in ARRAYS]
+        return cls(*arrs, playTypes=[str(pt) for pt in manifest['playTypes']])
+
+    # queries ----------------------------------------------------------------
+    def _select(self, arr, down=None, distance=None, playType=None):
+        """ arr summed down to spot (x play type, if playType is None) for one
+            down and distance (None: all of them)
+
+        """
+        if down is not None:
+            arr = arr[down_index(down)][np.newaxis]
+        if distance is not None:
+            arr = arr[:, distance_bucket(distance)][:, np.newaxis]
+        arr = arr.sum(axis=(0, 1))
+        if playType is not None:
+            i = self.playTypes.index(playType) if playType in self.playTypes else None
+            arr = arr[:, i] if i is not None else np.zeros(NSPOTS, dtype=arr.dtype)
+        return arr
+
+    def counts(self, down=None, distance=None, playType=None):
+        """ number of plays by spot (x play type) """
+        return self._select(self.count, down, distance, playType)
+
+    def stats(self, down=None, distance=None, playType=None):
+        """ (count, mean, std) of the play result by spot (x play type); mean
+            and std are nan where there are no plays
+
+        """
+        n = self._select(self.count, down, distance, playType).astype(float)
+        s1 = self._select(self.sum, down, distance, playType)
+        s2 = self._select(self.sumsq, down, distance, playType)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = s1 / n
+            std = np.sqrt(np.maximum(s2 / n - mean ** 2, 0))
+        return n, mean, std
+
+
+# ----------------------------- #
+#   per-season caching          #
+# ----------------------------- #
+
+def season_cube(year, store, sources, version=None):
+    """ the cube of one season's plays, from the cache if it was built from
+        the current sources (read by the given version of the code that reads
+        them), built from store (and cached) otherwise
+
+    """
+    cachedir = sc.CACHE_DIR.format(year=year, name=CACHE_NAME)
+    if not all(os.path.isfile(f) for f in sources):
+        return SituationCube.from_store(store)
+    if sc.is_fresh(cachedir, sources, version):
+        return SituationCube.load(cachedir)
+    logger.info('building situation cube for {}'.format(year))
+    cube = SituationCube.from_store(store)
+    cube.save(cachedir, sources, version)
+    return cube
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: sql_queries.py
+Author: zlamberty
+Created: 2016-04-16
+
+Description:
+    accessors for the sqlite store of sql_store.py: the point lookups
+    downanddistance.py and win_bump_value.py otherwise answer by loading
+    whole seasons or scraped histories
+
+    every accessor takes an open connection (see connect) and returns a
+    dataframe; the filters that are given become WHERE clauses with bound
+    parameters, so selective questions only touch the indexed rows.
+
+Usage:
+    conn = sql_queries.connect()
+    plays = sql_queries.plays(conn, down=3, distance=7, years=[2013])
+    rankings = sql_queries.rankings(conn, years=[2013], rankType='ap')
+
+"""
+
+import logging
+import os
+
+import lazyimport
+import sql_store
+
+np = lazyimport.lazy_import('numpy')
+pd = lazyimport.lazy_import('pandas')
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+logger = logging.getLogger("sql_queries")
+
+
+# ----------------------------- #
+#   helpers                     #
+# ----------------------------- #
+
+def connect(fname=sql_store.F_DB):
+    if not os.path.isfile(fname):
+        raise IOError('no database {} (run sql_store.py first)'.format(fname))
+    return sql_store.connect(fname)
+
+
+def where(**filters):
+    """ (WHERE clause, parameters) of column=value or column IN (values)
+        filters; None values are left out
+
+    """
+    clauses = []
+    params = []
+    for (col, val) in sorted(filters.items()):
+        if val is None:
+            continue
+        if isinstance(val, (list, tuple, set, np.ndarray)):
+            val = list(val)
+            clauses.append('{} IN ({})'.format(sql_store.quote(col), ', '.join('?' * len(val))))
+            params += val
+        else:
+            clauses.append('{} = ?'.format(sql_store.quote(col)))
+            params.append(val)
+    return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+
+def select(conn, table, columns=None, orderBy=None, **filters):
+    """ dataframe of some (all) columns of the rows of table matching
+        filters (see where), optionally ordered
+
+    """
+    clause, params = where(**filters)
+    sql = 'SELECT {} FROM {}{}'.format(
+        ', '.join(sql_store.quote(c) for c in columns) if columns else '*',
+        sql_store.quote(table),
+        clause
+    )
+    if orderBy:
+        sql += ' ORDER BY ' + ', '.join(sql_store.quote(c) for c in orderBy)
+    return pd.read_sql_query(sql, conn, params=params)
+
+
+# ----------------------------- #
+#   down and distance           #
+# ----------------------------- #
+
+def plays(conn, down=None, distance=None, years=None, game=None, offense=None,
+          playType=None, columns=None):
+    """ the plays (see play_table.py) of one situation, season(s), game
+        and / or offense
+
+    """
+    return select(conn, 'play', columns=columns, orderBy=['Game Code', 'Play Number'], **{
+        'Down': down,
+        'Distance': distance,
+        'year': years,
+        'Game Code': game,
+        'Offense Team Code': offense,
+        'Play Type': playType,
+    })
+
+
+def play(conn, game, playNumber):
+    """ one play, by (Game Code, Play Number) """
+    return select(conn, 'play', **{'Game Code': game, 'Play Number': playNumber})
+
+
+def play_counts_by_spot(conn, down, distance, years=None):
+    """ dataframe of the number of plays by spot (rows) and play type
+        (columns) for one down and distance
+
+    """
+    clause, params = where(**{'Down': down, 'Distance': distance, 'year': years})
+    df = pd.read_sql_query(
+        'SELECT Spot, "Play Type", COUNT(*) AS n FROM play{} '
+        'GROUP BY Spot, "Play Type"'.format(clause),
+        conn, params=params
+    )
+    return df.pivot(index='Spot', columns='Play Type', values='n').fillna(0)
+
+
+def team_names(conn, year):
+    """ dict of Team Code --> Name of one season (DownAndDistance.teamDic) """
+    df = select(conn, 'team', columns=['Team Code', 'Name'], year=year)
+    return dict(zip(df['Team Code'], df.Name))
+
+
+def game_teams(conn, year, game=None):
+    """ dict of Game Code --> {'Home': name, 'Away': name} of one season (or
+        one game of it), like DownAndDistance.gameDic
+
+    """
+    sql = (
+        'SELECT g."Game Code", h.Name AS Home, a.Name AS Away FROM game g '
+        'JOIN team h ON h."Team Code" = g."Home Team Code" AND h.year = g.year '
+        'JOIN team a ON a."Team Code" = g."Visit Team Code" AND a.year = g.year '
+        'WHERE g.year = ?'
+    )
+    params = [year]
+    if game is not None:
+        sql += ' AND g."Game Code" = ?'
+        params.append(game)
+    df = pd.read_sql_query(sql, conn, params=params)
+    return dict(
+        (gc, {'Home': h, 'Away': a}) for (gc, h, a) in zip(df['Game Code'], df.Home, df.Away)
+    )
+
+
+# ----------------------------- #
+#   win bump value              #
+# ----------------------------- #
+
+def rankings(conn, years=None, weeks=None, rankType=None, codename=None):
+    """ scraped rankings of some seasons / weeks / polls / teams """
+    return select(
+        conn, 'rankings', orderBy=['year', 'week', 'rank_type', 'rank'],
+        year=years, week=weeks, rank_type=rankType, codename=codename
+    )
+
+
+def results(conn, years=None, weeks=None, team=None):
+    """ scraped game results of some seasons / weeks, and / or of the
+        games of one team (codename)
+
+    """
+    clause, params = where(year=years, week=weeks)
+    if team is not None:
+        clause += ' AND ' if clause else ' WHERE '
+        clause += '(team_0 = ? OR team_1 = ?)'
+        params += [team, team]
+    return pd.read_sql_query(
+        'SELECT * FROM results{} ORDER BY year, week'.format(clause), conn, params=params
+    )
+
+
+def conferences(conn, years=None, conf=None):
+    """ scraped conference memberships of some seasons / a conference """
+    return select(conn, 'conferences', orderBy=['year', 'conf'], year=years, conf=conf)
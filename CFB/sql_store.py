@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: sql_store.py
+Author: zlamberty
+Created: 2016-04-16
+
+Description:
+    bulk-load every season's csv files, the play tables built from them and
+    the scraped rankings, results and conferences into one sqlite database
+    (data/cfb.sqlite), indexed for point lookups (see sql_queries.py)
+
+    every data/<year>/<name>.csv goes to the table <name> (dashes become
+    underscores) with the csv's column names and a year column; the play
+    table of play_table.py goes to play. Files are read in chunks of
+    BATCHSIZE rows and inserted with executemany, one transaction per
+    (table, season) that first deletes that season's rows, so a season is
+    either loaded completely or not at all. Seasons are only loaded again
+    when the fingerprints of their source files (kept in the sources table)
+    changed. Columns a season adds to a table are added to it.
+
+    the scraped histories replace the rankings, results and conferences
+    tables as a whole. Indexes are created after loading, on every table with
+    the columns of one of INDEXES.
+
+Usage:
+    python sql_store.py [--years 2005 2006 ...] [--no-scraped] [--force]
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+
+import lazyimport
+import logconfig
+import metrics
+import season_cache as sc
+
+pd = lazyimport.lazy_import('pandas')
+play_table = lazyimport.lazy_import('play_table')
+cmh = lazyimport.lazy_import('conference_membership_history')
+rh = lazyimport.lazy_import('ranking_history')
+grh = lazyimport.lazy_import('game_results_history')
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+F_DB = os.path.join(sc.DATA_DIR, 'cfb.sqlite')
+BATCHSIZE = 50000
+CSV_NAMES = [
+    'conference', 'drive', 'game', 'game-statistics', 'kickoff', 'kickoff-return',
+    'pass', 'player', 'punt', 'punt-return', 'reception', 'rush', 'stadium',
+    'team', 'team-game-statistics',
+]
+SCRAPED = ['rankings', 'results', 'conferences']
+INDEXES = [
+    ['Game Code'],
+    ['Game Code', 'Play Number'],
+    ['Player Code'],
+    ['Team Code'],
+    ['year', 'week', 'rank_type'],
+    ['year', 'Down', 'Distance'],
+]
+logger = logging.getLogger("sql_store")
+
+
+# ----------------------------- #
+#   schema                      #
+# ----------------------------- #
+
+def table_name(name):
+    return re.sub(r'[^0-9a-z]+', '_', name.lower())
+
+
+def quote(identifier):
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+def sql_type(dtype):
+    if dtype.kind in 'biu':
+        return 'INTEGER'
+    if dtype.kind == 'f':
+        return 'REAL'
+    return 'TEXT'
+
+
+def connect(fname=F_DB):
+    conn = sqlite3.connect(fname)
+    conn.text_factory = str
+    return conn
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute('PRAGMA table_info({})'.format(quote(table)))]
+
+
+def ensure_table(conn, table, df):
+    """ create table with the columns of df, or add the ones it lacks """
+    have = table_columns(conn, table)
+    if not have:
+        conn.execute('CREATE TABLE {} ({})'.format(quote(table), ', '.join(
+            '{} {}'.format(quote(c), sql_type(df[c].dtype)) for c in df.columns
+        )))
+        return
+    for c in df.columns:
+        if c not in have:
+            conn.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                quote(table), quote(c), sql_type(df[c].dtype)
+            ))
+
+
+def rows(df):
+    """ list of tuples of python values of df (NaN --> None) """
+    cols = []
+    for c in df.columns:
+        vals = df[c].values.tolist()
+        null = df[c].isnull().values
+        if null.any():
+            vals = [None if n else v for (v, n) in zip(vals, null)]
+        cols.append(vals)
+    return list(zip(*cols))
+
+
+def insert(conn, table, df):
+    """ executemany the rows of df into table (creating / widening it) """
+    ensure_table(conn, table, df)
+    conn.executemany('INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(table), ', '.join(quote(c) for c in df.columns), ', '.join('?' * len(df.columns))
+    ), rows(df))
+    return len(df)
+
+
+# ----------------------------- #
+#   loading                     #
+# ----------------------------- #
+
+def ensure_sources(conn):
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS sources '
+        '(tbl TEXT, year INTEGER, fingerprint TEXT, PRIMARY KEY (tbl, year))'
+    )
+
+
+def is_loaded(conn, table, year, fingerprint):
+    row = conn.execute(
+        'SELECT fingerprint FROM sources WHERE tbl = ? AND year = ?', (table, year)
+    ).fetchone()
+    return row is not None and json.loads(row[0]) == fingerprint
+
+
+def load_season_table(conn, table, year, frames, fingerprint):
+    """ replace the rows of one season of table by the (chunks of)
+        dataframes in frames, in one transaction
+
+    """
+    with metrics.span('load_table', table=table, year=year) as s:
+        with conn:
+            if table_columns(conn, table):
+                conn.execute('DELETE FROM {} WHERE year = ?'.format(quote(table)), (year,))
+            for df in frames:
+                df.insert(0, 'year', int(year))
+                s.add('rows', insert(conn, table, df))
+            conn.execute(
+                'INSERT OR REPLACE INTO sources (tbl, year, fingerprint) VALUES (?, ?, ?)',
+                (table, year, json.dumps(fingerprint, sort_keys=True))
+            )
+
+
+def load_csvs(conn, years, forceReload=False):
+    """ load every csv of years (that isn't loaded already) """
+    for y in years:
+        for name in CSV_NAMES:
+            fname = sc.F_CSV.format(year=y, name=name)
+            if not os.path.isfile(fname):
+                continue
+            table = table_name(name)
+            fp = sc.fingerprint([fname])
+            if not forceReload and is_loaded(conn, table, y, fp):
+                continue
+            logger.info('loading {}'.format(fname))
+            load_season_table(conn, table, y, pd.read_csv(fname, chunksize=BATCHSIZE), fp)
+
+
+def load_plays(conn, years, forceReload=False):
+    """ load the play tables of years (see play_table.py) """
+    for y in years:
+        sources = play_table.source_fnames(y)
+        if not all(os.path.isfile(f) for f in sources):
+            continue
+        fp = {'sources': sc.fingerprint(sources), 'version': play_table.VERSION}
+        if not forceReload and is_loaded(conn, 'play', y, fp):
+            continue
+        logger.info('loading the play table of {}'.format(y))
+        plays = play_table.load([y], mmap=False).drop('year', axis=1)
+        load_season_table(conn, 'play', y, [
+            plays.iloc[i:i + BATCHSIZE].copy() for i in range(0, len(plays), BATCHSIZE)
+        ], fp)
+
+
+def load_records(conn, table, records, columns):
+    """ replace table by scraped records (a list of dicts or a dict of
+        column --> list); the table is there (with columns) even if there
+        aren't any
+
+    """
+    with metrics.span('load_table', table=table) as s:
+        with conn:
+            conn.execute('DROP TABLE IF EXISTS {}'.format(quote(table)))
+            df = pd.DataFrame(records, columns=columns)
+            ensure_table(conn, table, df)
+            for i in range(0, len(df), BATCHSIZE):
+                s.add('rows', insert(conn, table, df.iloc[i:i + BATCHSIZE]))
+
+
+def load_scraped(conn, forceReload=False):
+    """ load the (cached) scraped rankings, results and conferences """
+    r = rh.EspnRankingHistory()
+    r.load_rankings(forceReload=forceReload)
+    g = grh.EspnResultHistory()
+    g.load_results(forceReload=forceReload)
+    c = cmh.EspnConferenceHistory()
+    c.load_conferences(forceReload=forceReload)
+    for (table, records, columns) in zip(
+            SCRAPED,
+            [r.rankings, g.columns, c.conferences],
+            [rh.RANKING_COLUMNS, grh.RESULT_COLUMNS, cmh.CONFERENCE_COLUMNS]):
+        load_records(conn, table, records, columns)
+
+
+def create_indexes(conn):
+    """ an index for every entry of INDEXES on every table with its columns """
+    tables = [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name != 'sources'"
+    )]
+    with conn:
+        for table in tables:
+            have = table_columns(conn, table)
+            for cols in INDEXES:
+                if all(c in have for c in cols):
+                    conn.execute('CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                        quote('ix_{}_{}'.format(table, table_name('_'.join(cols)))),
+                        quote(table),
+                        ', '.join(quote(c) for c in cols)
+                    ))
+    conn.execute('ANALYZE')
+
+
+def build(years=None, scraped=True, forceReload=False, fname=F_DB):
+    """ load (whatever isn't loaded yet of) years and the scraped history
+        into the database fname, and index it
+
+    """
+    years = sc.available_years() if years is None else years
+    conn = connect(fname)
+    try:
+        conn.execute('PRAGMA synchronous = OFF')
+        ensure_sources(conn)
+        with metrics.span('sql_store'):
+            load_csvs(conn, years, forceReload)
+            load_plays(conn, years, forceReload)
+            if scraped:
+                load_scraped(conn)
+            create_indexes(conn)
+    finally:
+        conn.close()
+    return fname
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def main(years=None, scraped=True, force=False):
+    build(years, scraped=scraped, forceReload=force)
+
+
+# ----------------------------- #
+#   Command line                #
+# ----------------------------- #
+
+def parse_args():
+    """ Take a log file from the commmand line """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", help="seasons to load", type=int, nargs='*')
+    parser.add_argument(
+        "--no-scraped", help="don't load the scraped history", dest='scraped',
+        action='store_false'
+    )
+    parser.add_argument("-f", "--force", help="reload even if loaded", action='store_true')
+
+    args = parser.parse_args()
+
+    logger.debug("arguments set to {}".format(vars(args)))
+
+    return args
+
+
+if __name__ == '__main__':
+
+    logconfig.configure()
+
+    args = parse_args()
+
+    main(years=args.years, scraped=args.scraped, force=args.force)
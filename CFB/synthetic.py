@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: synthetic.py
+Author: zlamberty
+Created: 2016-01-16
+
+Description:
+    synthetic data shaped like the scraped espn history, for benchmarking the
+    win bump pipeline at scales we don't have real data for (e.g. 50 seasons
+    or 300 teams)
+
+    every team has a latent strength that drifts over the season; each week
+    the teams are paired up at random, the stronger team (plus noise) wins,
+    and the polls are orderings of strength (plus noise) truncated to the
+    poll length.
+
+    the *_page functions render rankings / results / conference membership as
+    pages shaped like the espn pages the scrapers parse; together with
+    replay_server.py they stand in for espn.
+
+    cfbstats_season writes the cfbstats files of a made up season (teams,
+    games, drives and the per-event play files play_table.py reads), with
+    drives played out a play at a time: rushes and passes until a touchdown
+    or a 4th down punt, kickoffs after scores.
+
+Usage:
+    import synthetic
+    rankings, results = synthetic.rankings_and_results(nseasons=50)
+    synthetic.cfbstats_season('/tmp/data', 2005, nteams=120)
+
+"""
+
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+RANK_TYPES = {
+    'ap_top_25': 25,
+    'usa_today_coaches_poll': 25,
+    'ncaa_college_football_power_rankings': None,
+}
+CONFERENCES = [
+    'Southeastern Conference', 'Pac-12 Conference', 'Big Ten Conference',
+    'Big 12 Conference', 'Atlantic Coast Conference', 'Mountain West Conference',
+    'Mid-American Conference', 'Sun Belt Conference', 'Conference USA',
+    'FBS Independents',
+]
+
+
+# ----------------------------- #
+#   generators                  #
+# ----------------------------- #
+
+def team_names(nteams):
+    return ['T{:04d}'.format(i) for i in range(nteams)]
+
+
+def rankings_and_results(nseasons=14, nteams=120, nweeks=15, ystart=2002,
+                         rankTypes=RANK_TYPES, seed=1337):
+    """ (rankings, results) dataframes with the columns of win_bump_value's
+        get_rankings and get_game_results
+
+    """
+    rng = np.random.RandomState(seed)
+    teams = np.array(team_names(nteams))
+    confs = np.array([CONFERENCES[i % len(CONFERENCES)] for i in range(nteams)])
+
+    rankings = []
+    results = []
+    for y in range(ystart, ystart + nseasons):
+        strength = rng.normal(size=nteams)
+        for w in range(1, nweeks + 1):
+            # polls
+            for (rt, n) in sorted(rankTypes.items()):
+                n = nteams if n is None else min(n, nteams)
+                order = np.argsort(-(strength + 0.3 * rng.normal(size=nteams)))[:n]
+                rankings.append(pd.DataFrame({
+                    'rank_type': rt,
+                    'rank': np.arange(1, n + 1),
+                    'codename': teams[order],
+                    'fullname': teams[order],
+                    'conf': confs[order],
+                    'year': y,
+                    'week': w,
+                }))
+
+            # games
+            perm = rng.permutation(nteams)
+            t0, t1 = perm[0:nteams - 1:2], perm[1:nteams:2]
+            zeroWins = (strength[t0] + rng.normal(size=t0.size)) > strength[t1]
+            pts0 = rng.randint(0, 50, size=t0.size)
+            pts1 = rng.randint(0, 50, size=t0.size)
+            pts0, pts1 = (
+                np.where(zeroWins, np.maximum(pts0, pts1) + 1, np.minimum(pts0, pts1)),
+                np.where(zeroWins, np.minimum(pts0, pts1), np.maximum(pts0, pts1) + 1),
+            )
+            winners = np.where(zeroWins, t0, t1)
+            losers = np.where(zeroWins, t1, t0)
+            results.append(pd.DataFrame({
+                'year': y,
+                'week': w,
+                'is_neutral_site': rng.rand(t0.size) < 0.05,
+                'team_0': teams[t0],
+                'team_0_full': teams[t0],
+                'team_0_pts': pts0,
+                'team_1': teams[t1],
+                'team_1_full': teams[t1],
+                'team_1_pts': pts1,
+                'winning_team': teams[winners],
+                'losing_team': teams[losers],
+                'home_team': np.where(rng.rand(t0.size) < 0.5, teams[t0], teams[t1]),
+            }))
+
+            # winning is good for you
+            strength[winners] += 0.1
+            strength[losers] -= 0.1
+
+    rankings = pd.concat(rankings, ignore_index=True)
+    results = pd.concat(results, ignore_index=True)
+    results.loc[:, 'total_pts'] = results.team_0_pts + results.team_1_pts
+    results.loc[:, 'pt_differential'] = (results.team_1_pts - results.team_0_pts).abs()
+
+    return rankings, results
+
+
+def scraped_records(rankings, results):
+    """ (ranking, conference, result) lists of dicts, the way the scrapers
+        cache them, from rankings_and_results frames
+
+    """
+    rankingRecords = rankings.drop('conf', axis=1).to_dict('records')
+    conferenceRecords = rankings[
+        ['fullname', 'codename', 'year', 'conf']
+    ].drop_duplicates(['codename', 'year']).to_dict('records')
+    resultRecords = results.drop(['total_pts', 'pt_differential'], axis=1).to_dict('records')
+    return rankingRecords, conferenceRecords, resultRecords
+
+
+# ----------------------------- #
+#   cfbstats-like seasons       #
+# ----------------------------- #
+
+CFBSTATS_COLUMNS = {
+    'team': ['Team Code', 'Name', 'Conference Code'],
+    'game': ['Game Code', 'Date', 'Visit Team Code', 'Home Team Code', 'Stadium Code', 'Site'],
+    'drive': [
+        'Game Code', 'Drive Number', 'Team Code', 'Start Period', 'Start Spot',
+        'End Period', 'End Spot', 'End Reason', 'Plays', 'Yards',
+    ],
+    'rush': ['Game Code', 'Play Number', 'Team Code', 'Attempt', 'Yards', 'Touchdown', '1st Down'],
+    'pass': [
+        'Game Code', 'Play Number', 'Team Code', 'Attempt', 'Completion', 'Yards',
+        'Touchdown', '1st Down',
+    ],
+    'reception': ['Game Code', 'Play Number', 'Team Code', 'Reception', 'Yards', 'Touchdown', '1st Down'],
+    'punt': ['Game Code', 'Play Number', 'Team Code', 'Attempt', 'Yards'],
+    'punt-return': ['Game Code', 'Play Number', 'Team Code', 'Attempt', 'Yards'],
+    'kickoff': ['Game Code', 'Play Number', 'Team Code', 'Attempt', 'Yards'],
+    'kickoff-return': ['Game Code', 'Play Number', 'Team Code', 'Attempt', 'Yards'],
+}
+
+
+def _play_game(rows, gc, visit, home, rng, ndrives=24):
+    """ append the drive and event rows of one game to the lists in rows
+
+        the home team kicks off; offenses alternate every drive. Spots are
+        yards to the opponent's goal line, like cfbstats.
+
+    """
+    # random numbers for the whole game at once (plenty for any game)
+    u = rng.rand(4 * 60 * ndrives)
+    g = rng.normal(size=u.size)
+    k = [0]
+
+    def draw():
+        k[0] += 1
+        return u[k[0]], g[k[0]]
+
+    play = 0
+    offense, defense = visit, home
+    kickoff = True
+    spot = 75
+    for d in range(ndrives):
+        period = 1 + 4 * d // ndrives
+        if kickoff:
+            play += 1
+            ret = int(40 * draw()[0])
+            rows['kickoff'].append((gc, play, defense, 1, 65))
+            rows['kickoff-return'].append((gc, play, offense, 1, ret))
+            spot = min(75, 100 - ret)
+
+        start = spot
+        nplays = 0
+        down, toGo = 1, min(10, spot)
+        while True:
+            # penalties and field goals leave gaps in the play numbers
+            play += 2 if draw()[0] < 0.05 else 1
+            nplays += 1
+            if down == 4:
+                x, z = draw()
+                yards = min(30 + int(20 * x), spot - 1)
+                ret = max(0, int(8 + 6 * z))
+                rows['punt'].append((gc, play, offense, 1, yards))
+                rows['punt-return'].append((gc, play, defense, 1, ret))
+                end, reason = spot, 'PUNT'
+                spot = min(max(100 - (spot - yards) - ret, 1), 99)
+                kickoff = False
+                break
+
+            x, z = draw()
+            if x < 0.55:
+                yards = int(round(4.5 + 5 * z))
+            elif x < 0.55 + 0.45 * 0.6:
+                yards = int(round(11 + 8 * z))
+            else:
+                yards = 0
+            yards = max(min(yards, spot), spot - 99)
+            td = int(yards == spot)
+            first = int(yards >= toGo and not td)
+            if x < 0.55:
+                rows['rush'].append((gc, play, offense, 1, yards, td, first))
+            else:
+                complete = int(x < 0.55 + 0.45 * 0.6)
+                rows['pass'].append((gc, play, offense, 1, complete, yards, td, first))
+                if complete:
+                    rows['reception'].append((gc, play, offense, 1, yards, td, first))
+            spot -= yards
+            if td:
+                end, reason = 0, 'TOUCHDOWN'
+                kickoff = True
+                break
+            if first:
+                down, toGo = 1, min(10, spot)
+            else:
+                down, toGo = down + 1, toGo - yards
+
+        rows['drive'].append((
+            gc, d + 1, offense, period, start, period, end, reason, nplays, start - end
+        ))
+        offense, defense = defense, offense
+
+
+def cfbstats_season(datadir, year, nteams=120, ngames=12, seed=1337):
+    """ write the csv files of a synthetic cfbstats season to
+        datadir/<year>/ (see CFBSTATS_COLUMNS); returns the number of
+        scrimmage plays and kickoffs written
+
+    """
+    rng = np.random.RandomState(seed + int(year))
+    codes = np.arange(1, nteams + 1)
+    rows = dict((name, []) for name in CFBSTATS_COLUMNS)
+
+    for (code, name) in zip(codes, team_names(nteams)):
+        rows['team'].append((code, name, 1 + code % len(CONFERENCES)))
+
+    opener = datetime.date(int(year), 9, 1)
+    for week in range(ngames):
+        date = opener + datetime.timedelta(days=7 * week)
+        perm = rng.permutation(codes)
+        for (visit, home) in zip(perm[0:nteams - 1:2], perm[1:nteams:2]):
+            gc = '{:04d}{:04d}{:%Y%m%d}'.format(visit, home, date)
+            rows['game'].append((gc, date.strftime('%m/%d/%Y'), visit, home, home, 'TEAM'))
+            _play_game(rows, gc, visit, home, rng)
+
+    ydir = os.path.join(datadir, str(year))
+    if not os.path.isdir(ydir):
+        os.makedirs(ydir)
+    for (name, columns) in CFBSTATS_COLUMNS.items():
+        pd.DataFrame(rows[name], columns=columns).to_csv(
+            os.path.join(ydir, '{}.csv'.format(name)), index=False
+        )
+
+    return sum(len(rows[name]) for name in ['rush', 'pass', 'punt', 'kickoff'])
+
+
+# ----------------------------- #
+#   espn-like pages             #
+# ----------------------------- #
+
+def rankings_page(rankings):
+    """ espn rankings page for the rankings of a single (year, week)
+
+        tied ranks after the first are left blank and every 7th team has no
+        link, as on the real pages
+
+    """
+    tables = []
+    for (rt, r) in rankings.groupby('rank_type', sort=False):
+        rows = []
+        lastrank = None
+        for (i, row) in enumerate(r.sort_values('rank').itertuples()):
+            rank = '' if row.rank == lastrank else '<span class="number">{}</span>'.format(row.rank)
+            abbr = '<abbr title="{}">{}</abbr>'.format(row.fullname, row.codename)
+            team = '<span>{}</span>'.format(abbr) if i % 7 == 6 else '<a href="#">{}</a>'.format(abbr)
+            rows.append('<tr><td>{}</td><td>{}</td><td>{}-0</td></tr>'.format(rank, team, i))
+            lastrank = row.rank
+        tables.append(
+            '<table class="rankings has-team-logos"><caption>{}</caption>'
+            '<thead><tr><th>RK</th><th>TEAM</th><th>REC</th></tr></thead>'
+            '<tbody>{}</tbody></table>'.format(rt.replace('_', ' ').title(), ''.join(rows))
+        )
+    return '<html><head><title>rankings</title></head><body>{}</body></html>'.format(
+        ''.join(tables)
+    )
+
+
+def scoreboard_page(results):
+    """ espn scoreboard page for the results of a single (year, week)
+
+        like the real page, the body has a score card for every game on top
+        of the scoreboardData blob in the head
+
+    """
+    events = []
+    cards = []
+    for row in results.itertuples():
+        competitors = []
+        for i in range(2):
+            abbr = getattr(row, 'team_{}'.format(i))
+            competitors.append({
+                'homeAway': 'home' if abbr == row.home_team else 'away',
+                'winner': abbr == row.winning_team,
+                'score': str(getattr(row, 'team_{}_pts'.format(i))),
+                'team': {
+                    'abbreviation': abbr,
+                    'displayName': getattr(row, 'team_{}_full'.format(i)),
+                },
+            })
+        events.append({'competitions': [{
+            'neutralSite': bool(row.is_neutral_site),
+            'competitors': competitors,
+        }]})
+        cards.append(
+            '<article class="scoreboard football"><section class="sb-score">'
+            '<table class="sb-table"><tbody>{}</tbody></table></section>'
+            '<section class="sb-actions"><a href="#">Box Score</a>'
+            '<a href="#">Play-by-Play</a></section></article>'.format(''.join(
+                '<tr class="{homeAway}"><td class="team"><div class="sb-meta">'
+                '<span class="sb-team-short">{team[displayName]}</span>'
+                '<span class="sb-team-abbrev">{team[abbreviation]}</span></div></td>'
+                '<td class="total"><span>{score}</span></td></tr>'.format(**c)
+                for c in competitors
+            ))
+        )
+    return (
+        '<html><head><script>window.espn.scoreboardData \t= {};'
+        'window.espn.scoreboardSettings \t= {{}};</script></head>'
+        '<body><div id="scoreboard">{}</div></body></html>'
+    ).format(json.dumps({'events': events}), ''.join(cards))
+
+
+def standings_page(conferences):
+    """ espn standings page for (fullname, codename, conf) rows of one year """
+    tables = []
+    for (conf, c) in conferences.groupby('conf', sort=False):
+        rows = []
+        for (i, row) in enumerate(c.itertuples()):
+            team = '<span><span>{}</span><abbr>{}</abbr></span>'.format(
+                row.fullname, row.codename
+            )
+            if i % 11 != 10:
+                team = '<a href="#">{}</a>'.format(team)
+            rows.append('<tr><td>{}</td><td>0-0</td></tr>'.format(team))
+        tables.append(
+            '<table class="standings has-team-logos"><caption><span>{}</span>'
+            '</caption>{}</table>'.format(conf, ''.join(rows))
+        )
+    return '<html><head></head><body>{}</body></html>'.format(''.join(tables))
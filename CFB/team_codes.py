@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: team_codes.py
+Author: zlamberty
+Created: 2016-04-16
+
+Description:
+    resolve the espn team names of the scraped histories (codename and
+    fullname, e.g. "ALA" / "Alabama Crimson Tide") to the ncaa Team Code of
+    the cfbstats csvs, per season
+
+    every distinct (codename, fullname, year) is resolved once, in order:
+        1. the overrides in team_overrides.csv (fullname, start, end, cfbstats
+           name; for the names espn shortens, like "Ole Miss Rebels")
+        2. the longest leading run of words of the fullname that is a
+           cfbstats team name ("Arizona State Sun Devils" --> "Arizona
+           State", never "Arizona")
+        3. the codename itself ("LSU", "UCF", ...)
+    names are compared lowercase, without accents or punctuation and with
+    "St." spelled out. Team codes don't change between seasons, so names
+    come from every season's team.csv; resolutions to a team that isn't in
+    that season's team.csv are kept but marked as such.
+
+    the resolved names are saved (with the fingerprints of every team.csv and
+    of the overrides) and only new names are resolved after that. Whole
+    columns are mapped at once through an IntervalTable (see
+    conference_membership_history.py) of (codename, fullname) --> code by
+    season -- espn reuses codenames ("MIA" is Miami and Miami (OH)), so the
+    codename alone doesn't name a team; codenames that stand for more than
+    one team in a season are logged. Names that could not be resolved are
+    logged and kept in the index with code -1.
+
+Usage:
+    index = team_codes.load(team_codes.names(rankingRecords, resultRecords))
+    rankings = index.assign(rankings, 'codename', 'fullname', out='team_code')
+    print(index.unresolved())
+
+    python team_codes.py [--force]
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import unicodedata
+
+import numpy as np
+
+import lazyimport
+import logconfig
+import season_cache as sc
+
+pd = lazyimport.lazy_import('pandas')
+cmh = lazyimport.lazy_import('conference_membership_history')
+rh = lazyimport.lazy_import('ranking_history')
+grh = lazyimport.lazy_import('game_results_history')
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+F_OVERRIDES = os.path.join(HERE, 'team_overrides.csv')
+CACHE_DIR = os.path.join(sc.DATA_DIR, '.npcache', 'team_codes')
+F_INDEX = 'index.csv'
+NAME_FIELDS = ['codename', 'fullname', 'year']
+UNRESOLVED = -1
+# joins codename and fullname into one IntervalTable key
+KEY_SEP = u'\x1f'
+ABBREVIATIONS = {'st': 'state'}
+logger = logging.getLogger("team_codes")
+
+
+# ----------------------------- #
+#   names                       #
+# ----------------------------- #
+
+def normalize(name):
+    """ lowercase words of a team name, without accents and punctuation """
+    if isinstance(name, bytes):
+        name = name.decode('utf-8')
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    name = re.sub(r"['.]", '', name.lower())
+    words = re.sub(r'[^a-z0-9&]+', ' ', name).split()
+    return ' '.join(ABBREVIATIONS.get(w, w) for w in words)
+
+
+def names(rankingRecords=(), resultRecords=(), conferenceRecords=()):
+    """ dataframe of the distinct (codename, fullname, year) of scraped
+        ranking, result and conference dicts (or the frames / columns made
+        of them)
+
+    """
+    frames = [pd.DataFrame(columns=NAME_FIELDS)]
+    for records in [rankingRecords, conferenceRecords]:
+        df = pd.DataFrame(records)
+        if len(df):
+            frames.append(df[NAME_FIELDS])
+    results = pd.DataFrame(resultRecords)
+    for side in ['team_0', 'team_1'] if len(results) else []:
+        frames.append(results[[side, '{}_full'.format(side), 'year']].rename(columns={
+            side: 'codename', '{}_full'.format(side): 'fullname'
+        }))
+    df = pd.concat(frames, ignore_index=True).drop_duplicates()
+    df = df[df.codename.notnull() & df.year.notnull()].fillna({'fullname': ''})
+    df.loc[:, 'year'] = df.year.astype(int)
+    return df.drop_duplicates().reset_index(drop=True)
+
+
+def team_years():
+    return [
+        y for y in sc.available_years()
+        if os.path.isfile(sc.F_CSV.format(year=y, name='team'))
+    ]
+
+
+def read_teams(years):
+    """ (dict of normalized name --> team code over all of years (the later
+        season wins), dict of year --> set of that season's team codes)
+
+    """
+    codes = {}
+    seasons = {}
+    for y in years:
+        teams = pd.read_csv(sc.F_CSV.format(year=y, name='team'), usecols=['Team Code', 'Name'])
+        codes.update((normalize(n), int(c)) for (n, c) in zip(teams.Name, teams['Team Code']))
+        seasons[y] = set(teams['Team Code'].astype(int))
+    return codes, seasons
+
+
+def resolve(names, fOverrides=F_OVERRIDES):
+    """ names (a names() frame) with their Team Code (UNRESOLVED if none) and
+        how it was found: override, fullname, codename, '' -- with ' (other
+        season)' if the team isn't in that season's team.csv
+
+    """
+    codes, seasons = read_teams(team_years())
+    overrides = cmh.read_overrides(fOverrides, column='name').lookup(
+        names.fullname.values, names.year.values
+    )
+
+    found = []
+    for (codename, fullname, year, override) in zip(
+            names.codename, names.fullname, names.year, overrides):
+        code, how = UNRESOLVED, ''
+        if override is not None and normalize(override) in codes:
+            code, how = codes[normalize(override)], 'override'
+        else:
+            words = normalize(fullname).split()
+            for k in range(len(words), 0, -1):
+                if ' '.join(words[:k]) in codes:
+                    code, how = codes[' '.join(words[:k])], 'fullname'
+                    break
+            else:
+                if normalize(codename) in codes:
+                    code, how = codes[normalize(codename)], 'codename'
+        if code != UNRESOLVED and code not in seasons.get(year, ()):
+            how += ' (other season)'
+        found.append((code, how))
+
+    resolved = names.copy()
+    resolved.loc[:, 'Team Code'] = np.array([c for (c, how) in found], dtype=np.int64)
+    resolved.loc[:, 'method'] = [how for (c, how) in found]
+    return resolved
+
+
+# ----------------------------- #
+#   index                       #
+# ----------------------------- #
+
+def _text(name):
+    return name.decode('utf-8') if isinstance(name, bytes) else name
+
+
+def keys(codenames, fullnames):
+    """ object array of the IntervalTable key of every (codename, fullname);
+        each distinct pair is only joined once
+
+    """
+    pairs = pd.DataFrame({'codename': codenames, 'fullname': fullnames}).fillna('')
+    gid = pairs.groupby(['codename', 'fullname'], sort=False).ngroup().values
+    distinct = pairs.drop_duplicates()
+    joined = np.array([
+        _text(c) + KEY_SEP + _text(f) for (c, f) in zip(distinct.codename, distinct.fullname)
+    ], dtype=object)
+    return joined[gid]
+
+
+def conflicts(resolved):
+    """ dataframe of the (codename, year)s that resolve to more than one
+        Team Code, with the codes (and fullnames) they stand for
+
+    """
+    ok = resolved[resolved['Team Code'] != UNRESOLVED]
+    n = ok.groupby(['codename', 'year'])['Team Code'].transform('nunique')
+    return ok[n > 1][NAME_FIELDS + ['Team Code']].sort_values(NAME_FIELDS)
+
+
+class TeamCodeIndex(object):
+    """ the resolved names, and an IntervalTable of (codename, fullname)
+        --> Team Code by season
+
+    """
+    def __init__(self, resolved):
+        self.resolved = resolved.reset_index(drop=True)
+        ok = self.resolved[self.resolved['Team Code'] != UNRESOLVED]
+        self.table = cmh.IntervalTable.from_years(
+            keys(ok.codename.values, ok.fullname.values), ok.year.values,
+            ok['Team Code'].values
+        )
+        shared = conflicts(self.resolved)
+        if len(shared):
+            logger.warning(u'{} codenames stand for more than one team in a season, e.g. {}'.format(
+                shared[['codename', 'year']].drop_duplicates().shape[0],
+                u', '.join(u'{} {} / {} = {}'.format(
+                    _text(c), y, _text(f), code
+                ) for (c, f, y, code) in shared.head(4).values)
+            ).encode('utf-8'))
+
+    def __len__(self):
+        return len(self.resolved)
+
+    def lookup(self, codenames, fullnames, years):
+        """ int array of the Team Code of every (codename, fullname, year),
+            UNRESOLVED where there is none
+
+        """
+        codes = self.table.lookup(keys(codenames, fullnames), years)
+        return np.where(np.equal(codes, None), UNRESOLVED, codes).astype(np.int64)
+
+    def assign(self, df, codename='codename', fullname='fullname', year='year',
+               out='Team Code'):
+        """ df with the Team Code of its codename and fullname columns as
+            column out (see lookup); the number of rows left unresolved is
+            logged
+
+        """
+        codes = self.lookup(df[codename].values, df[fullname].values, df[year].values)
+        missed = codes == UNRESOLVED
+        if missed.any():
+            logger.warning('{}: {} of {} rows ({} names) have no team code'.format(
+                codename, missed.sum(), len(codes), df[codename][missed].nunique()
+            ))
+        return df.assign(**{out: codes})
+
+    def unresolved(self):
+        """ dataframe of the names without a team code """
+        return self.resolved[self.resolved['Team Code'] == UNRESOLVED][NAME_FIELDS]
+
+
+# ----------------------------- #
+#   persistence                 #
+# ----------------------------- #
+
+def index_manifest(years, fOverrides=F_OVERRIDES):
+    """ what the resolutions depend on: every season's team.csv (by season,
+        since the file names repeat) and the overrides
+
+    """
+    return {
+        'seasons': dict(
+            (str(y), sc.fingerprint([sc.F_CSV.format(year=y, name='team')])) for y in years
+        ),
+        'overrides': sc.fingerprint([fOverrides]) if os.path.isfile(fOverrides) else {},
+    }
+
+
+def read_index(cachedir):
+    return pd.read_csv(
+        os.path.join(cachedir, F_INDEX), encoding='utf-8', keep_default_na=False,
+        dtype={'codename': object, 'fullname': object, 'method': object}
+    )
+
+
+def save_index(resolved, cachedir, manifest):
+    if os.path.isdir(cachedir):
+        shutil.rmtree(cachedir)
+    os.makedirs(cachedir)
+    resolved.to_csv(os.path.join(cachedir, F_INDEX), index=False, encoding='utf-8')
+    with open(os.path.join(cachedir, sc.F_MANIFEST), 'wb') as f:
+        f.write(json.dumps(manifest, indent=2).encode('utf-8'))
+
+
+def load(names, forceRebuild=False, cachedir=CACHE_DIR, fOverrides=F_OVERRIDES):
+    """ TeamCodeIndex of names (a names() frame)
+
+        the saved resolutions are reused while no team.csv and not the
+        overrides changed, and only names that aren't in them yet are
+        resolved (and saved); unresolved names are logged
+
+    """
+    manifest = index_manifest(team_years(), fOverrides)
+    known = None
+    if not forceRebuild and sc.read_manifest(cachedir) == manifest:
+        known = read_index(cachedir)
+
+    if known is None:
+        new = names[NAME_FIELDS]
+    else:
+        new = names[NAME_FIELDS].merge(known[NAME_FIELDS], how='left', indicator=True)
+        new = new[new._merge == 'left_only'][NAME_FIELDS]
+
+    if len(new) or known is None:
+        logger.info('resolving {} team names'.format(len(new)))
+        found = resolve(new, fOverrides)
+        for row in found[found['Team Code'] == UNRESOLVED].itertuples():
+            logger.debug(u'no team code for {} / {} ({})'.format(
+                row.codename, row.fullname, row.year
+            ))
+        if (found['Team Code'] == UNRESOLVED).any():
+            logger.warning('{} of {} new team names are unresolved'.format(
+                (found['Team Code'] == UNRESOLVED).sum(), len(found)
+            ))
+        known = found if known is None else pd.concat([known, found], ignore_index=True)
+        save_index(known, cachedir, manifest)
+
+    return TeamCodeIndex(known)
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def main(force=False):
+    """ resolve the names of the (cached) scraped histories and print the
+        ones that could not be
+
+    """
+    r = rh.EspnRankingHistory()
+    r.load_rankings()
+    g = grh.EspnResultHistory()
+    g.load_results()
+    c = cmh.EspnConferenceHistory()
+    c.load_conferences()
+
+    index = load(names(r.rankings, g.columns, c.conferences), forceRebuild=force)
+    unresolved = index.unresolved()
+    print('{} names, {} unresolved'.format(len(index), len(unresolved)))
+    for row in unresolved.sort_values(['fullname', 'year']).itertuples():
+        print(u'{:>8} {:>10} {}'.format(row.year, row.codename, row.fullname).encode('utf-8'))
+
+
+# ----------------------------- #
+#   Command line                #
+# ----------------------------- #
+
+def parse_args():
+    """ Take a log file from the commmand line """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--force", help="resolve every name again", action='store_true')
+
+    args = parser.parse_args()
+
+    logger.debug("arguments set to {}".format(vars(args)))
+
+    return args
+
+
+if __name__ == '__main__':
+
+    logconfig.configure()
+
+    args = parse_args()
+
+    main(force=args.force)
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Module: team_game_stats.py
+Author: zlamberty
+Created: 2016-04-09
+
+Description:
+    typed, memory-mapped store of team-game-statistics.csv for every season,
+    with rolling / expanding aggregates for all teams at once
+
+    every season's team-game-statistics.csv is joined to its game.csv (date,
+    opponent, home / neutral site) and team.csv (conference), and the lot is
+    written as one numpy structured array: the csv's ~65 stat columns keep
+    their names, as int32 (float32 for the ones with fractions, like Sack),
+    after year, Team Code, Game Code, Date, Opponent Code, Home, Neutral and
+    Conference Code. Rows are sorted by team, then date, so each team's games
+    are contiguous and in order. The array is saved as a single .npy with a
+    manifest of the source fingerprints (see season_cache.py), rebuilt when
+    any season changes, and loaded memory-mapped.
+
+    rolling and expanding aggregates are differences of one cumulative sum
+    over the whole array: the window of each row is clipped to the start of
+    its team's games (or its team-season's, with perSeason=True), so there
+    is no per-team loop.
+
+Usage:
+    import team_game_stats as tgs
+    store = tgs.load()
+    sec = store.select(confs=['Southeastern Conference'], years=[2012, 2013])
+    rate = sec.rolling_rate('Third Down Conv', 'Third Down Att', window=4)
+
+    python team_game_stats.py [--force]
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+import lazyimport
+import logconfig
+import season_cache as sc
+
+pd = lazyimport.lazy_import('pandas')
+
+
+# ----------------------------- #
+#   Module Constants            #
+# ----------------------------- #
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+CACHE_DIR = os.path.join(sc.DATA_DIR, '.npcache', 'team_game_stats')
+F_STORE = 'store.npy'
+SOURCES = ['team-game-statistics', 'game', 'team', 'conference']
+KEY_FIELDS = [
+    ('year', np.int16),
+    ('Team Code', np.int32),
+    ('Game Code', np.int64),
+    ('Date', 'M8[D]'),
+    ('Opponent Code', np.int32),
+    ('Home', np.int8),
+    ('Neutral', np.int8),
+    ('Conference Code', np.int32),
+]
+logger = logging.getLogger("team_game_stats")
+
+
+# ----------------------------- #
+#   building                    #
+# ----------------------------- #
+
+def source_fnames(years):
+    return [
+        sc.F_CSV.format(year=y, name=name) for y in years for name in SOURCES
+    ]
+
+
+def season_years():
+    """ the seasons that have every source file """
+    return [
+        y for y in sc.available_years()
+        if all(os.path.isfile(f) for f in source_fnames([y]))
+    ]
+
+
+def read_season(year):
+    """ dataframe of one season's team games, with the key fields """
+    stats = pd.read_csv(sc.F_CSV.format(year=year, name='team-game-statistics'))
+    games = pd.read_csv(
+        sc.F_CSV.format(year=year, name='game'),
+        usecols=['Game Code', 'Date', 'Visit Team Code', 'Home Team Code', 'Site']
+    )
+    teams = pd.read_csv(
+        sc.F_CSV.format(year=year, name='team'), usecols=['Team Code', 'Conference Code']
+    )
+
+    df = stats.merge(games, on='Game Code', how='left').merge(teams, on='Team Code', how='left')
+    isHome = df['Team Code'] == df['Home Team Code']
+    df.loc[:, 'year'] = int(year)
+    df.loc[:, 'Date'] = pd.to_datetime(df.Date, format='%m/%d/%Y')
+    df.loc[:, 'Opponent Code'] = np.where(isHome, df['Visit Team Code'], df['Home Team Code'])
+    df.loc[:, 'Home'] = isHome.astype(int)
+    df.loc[:, 'Neutral'] = (df.Site == 'NEUTRAL').astype(int)
+    df.loc[:, 'Conference Code'] = df['Conference Code'].fillna(-1)
+    return df.drop(['Visit Team Code', 'Home Team Code', 'Site'], axis=1)
+
+
+def conference_names(years):
+    """ dict of conference code --> name (the latest season's name wins) """
+    names = {}
+    for y in years:
+        conf = pd.read_csv(sc.F_CSV.format(year=y, name='conference'))
+        names.update(zip(conf['Conference Code'], conf['Name']))
+    return dict((int(k), v) for (k, v) in names.items())
+
+
+def to_records(df):
+    """ structured array of a read_season frame: key fields, then the stats
+        in csv order as int32 (float32 if any value has a fraction)
+
+    """
+    keys = [name for (name, dtype) in KEY_FIELDS]
+    statCols = [c for c in df.columns if c not in keys]
+    fields = list(KEY_FIELDS)
+    for c in statCols:
+        x = df[c].values.astype(float)
+        isInt = not np.isnan(x).any() and (x == np.round(x)).all()
+        fields.append((c, np.int32 if isInt else np.float32))
+
+    order = np.lexsort((df['Game Code'].values, df.Date.values, df['Team Code'].values))
+    arr = np.empty(len(df), dtype=fields)
+    for (name, dtype) in fields:
+        vals = df[name].values[order]
+        arr[name] = vals.astype('M8[D]') if name == 'Date' else vals
+    return arr
+
+
+def season_fingerprints(years):
+    """ fingerprints of the source files by season (the file names repeat
+        from season to season, so one fingerprint of all of them would only
+        see the last)
+
+    """
+    return dict((str(y), sc.fingerprint(source_fnames([y]))) for y in years)
+
+
+def is_fresh(cachedir, years):
+    manifest = sc.read_manifest(cachedir)
+    try:
+        return manifest is not None and manifest['seasons'] == season_fingerprints(years)
+    except (KeyError, OSError):
+        return False
+
+
+def build(forceRebuild=False, cachedir=CACHE_DIR):
+    """ build (if stale) the store of every season with the source files """
+    years = season_years()
+    if not forceRebuild and is_fresh(cachedir, years):
+        return cachedir
+
+    logger.info('building team game stats store for {}'.format(years))
+    df = pd.concat([read_season(y) for y in years], ignore_index=True, sort=False)
+    arr = to_records(df)
+
+    if os.path.isdir(cachedir):
+        shutil.rmtree(cachedir)
+    os.makedirs(cachedir)
+    np.save(os.path.join(cachedir, F_STORE), arr)
+    manifest = {
+        'seasons': season_fingerprints(years),
+        'years': years,
+        'nrows': len(arr),
+        'conferences': conference_names(years),
+    }
+    with open(os.path.join(cachedir, sc.F_MANIFEST), 'wb') as f:
+        f.write(json.dumps(manifest, indent=2).encode('utf-8'))
+    return cachedir
+
+
+def load(forceRebuild=False, mmap=True, cachedir=CACHE_DIR):
+    """ TeamGameStore of every season (built first if stale) """
+    build(forceRebuild=forceRebuild, cachedir=cachedir)
+    manifest = sc.read_manifest(cachedir)
+    arr = np.load(os.path.join(cachedir, F_STORE), mmap_mode='r' if mmap else None)
+    confs = dict((int(k), v) for (k, v) in manifest['conferences'].items())
+    return TeamGameStore(arr, confs)
+
+
+# ----------------------------- #
+#   queries                     #
+# ----------------------------- #
+
+class TeamGameStore(object):
+    """ team games sorted by (team, date), as a structured array """
+    def __init__(self, arr, conferences=None):
+        self.arr = arr
+        self.conferences = conferences or {}
+
+    def __len__(self):
+        return len(self.arr)
+
+    def __getitem__(self, field):
+        return self.arr[field]
+
+    @property
+    def fields(self):
+        return list(self.arr.dtype.names)
+
+    def conference_codes(self, confs):
+        """ conference codes of a list of codes and / or names """
+        byName = dict((v, k) for (k, v) in self.conferences.items())
+        return [byName[c] if c in byName else int(c) for c in confs]
+
+    def select(self, teams=None, confs=None, years=None):
+        """ the store of the games of some teams (codes), conferences (codes
+            or names) and / or seasons; order is kept
+
+        """
+        keep = np.ones(len(self.arr), dtype=bool)
+        if teams is not None:
+            keep &= np.in1d(self.arr['Team Code'], teams)
+        if confs is not None:
+            keep &= np.in1d(self.arr['Conference Code'], self.conference_codes(confs))
+        if years is not None:
+            keep &= np.in1d(self.arr['year'], years)
+        return TeamGameStore(self.arr[keep], self.conferences)
+
+    def frame(self, fields=None):
+        """ dataframe of some (all) fields, with conference names """
+        fields = fields or self.fields
+        df = pd.DataFrame(dict((f, self.arr[f]) for f in fields), columns=fields)
+        if 'Conference Code' in df:
+            df.loc[:, 'Conference'] = df['Conference Code'].map(self.conferences)
+        return df
+
+    # windows ----------------------------------------------------------------
+    def group_starts(self, perSeason=False):
+        """ index of the first game of each row's team (team-season) """
+        team = self.arr['Team Code']
+        new = np.ones(len(team), dtype=bool)
+        new[1:] = team[1:] != team[:-1]
+        if perSeason:
+            year = self.arr['year']
+            new[1:] |= year[1:] != year[:-1]
+        return np.maximum.accumulate(np.where(new, np.arange(len(team)), 0))
+
+    def window_bounds(self, window=None, lag=0, perSeason=False):
+        """ [lo, hi) row bounds of every row's window: the `window` games
+            (all of them if None) of its team up to and including it, or up to
+            `lag` games before it
+
+        """
+        start = self.group_starts(perSeason)
+        hi = np.maximum(np.arange(len(self.arr)) + 1 - lag, start)
+        lo = start if window is None else np.maximum(start, hi - window)
+        return lo, hi
+
+    def rolling_sum(self, field, window=None, lag=0, perSeason=False):
+        """ (sum, number of games) of field over every row's window (see
+            window_bounds); window=None is the expanding sum
+
+        """
+        x = np.nan_to_num(self.arr[field].astype(np.float64))
+        cs = np.concatenate([[0.], np.cumsum(x)])
+        lo, hi = self.window_bounds(window, lag, perSeason)
+        return cs[hi] - cs[lo], hi - lo
+
+    def rolling_mean(self, field, window=None, lag=0, perSeason=False):
+        s, n = self.rolling_sum(field, window, lag, perSeason)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return s / n
+
+    def rolling_rate(self, numerator, denominator, window=None, lag=0, perSeason=False):
+        """ sum of numerator / sum of denominator over every row's window,
+            e.g. ('Third Down Conv', 'Third Down Att') for the conversion rate
+
+        """
+        num, n = self.rolling_sum(numerator, window, lag, perSeason)
+        den, n = self.rolling_sum(denominator, window, lag, perSeason)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return num / den
+
+    def expanding_mean(self, field, lag=0, perSeason=True):
+        return self.rolling_mean(field, None, lag, perSeason)
+
+
+# ----------------------------- #
+#   Main routine                #
+# ----------------------------- #
+
+def main(force=False):
+    """ pre-build the store """
+    build(forceRebuild=force)
+
+
+# ----------------------------- #
+#   Command line                #
+# ----------------------------- #
+
+def parse_args():
+    """ Take a log file from the commmand line """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--force", help="rebuild even if fresh", action='store_true')
+
+    args = parser.parse_args()
+
+    logger.debug("arguments set to {}".format(vars(args)))
+
+    return args
+
+
+if __name__ == '__main__':
+
+    logconfig.configure()
+
+    args = parse_args()
+
+    main(force=args.force)
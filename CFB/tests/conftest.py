@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+
+"""
+the modules of CFB import each other by their plain names (they are run as
+scripts from this directory), so the tests put it on the path the same way
+
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""
+bootstrap replicates of buoyancy_bootstrap on a small synthetic delta
+
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import buoyancy_bootstrap as bb
+import win_bump_value as wbv
+
+
+@pytest.fixture(scope='module')
+def delta():
+    rng = np.random.RandomState(0)
+    n = 600
+    df = pd.DataFrame({
+        'conf': rng.choice(['ACC', 'SEC', 'Pac-12'], n),
+        'rank_type': rng.choice(['ap', 'coaches'], n),
+        'venue': rng.choice(['home', 'away', 'neutral', 'none'], n),
+    })
+    for (j, stat) in enumerate(bb.STATS):
+        df.loc[:, stat] = rng.randint(-5, 6, n).astype(float) * (j + 1)
+    df.loc[::17, 'rank_delta'] = np.nan
+    return df
+
+
+def test_observed_is_the_group_mean(delta):
+    boot = bb.bootstrap(delta, nreps=10)
+    means = delta.dropna(subset=bb.GROUPS + bb.STATS).groupby(bb.GROUPS)[bb.STATS].mean()
+    expected = means.loc[[tuple(k) for k in boot.keys.values]].values
+
+    np.testing.assert_allclose(boot.observed, expected)
+    assert boot.sizes.sum() == delta.rank_delta.notnull().sum()
+
+
+def test_pool_matches_serial(delta):
+    serial = bb.bootstrap(delta, nreps=250, processes=1)
+    pooled = bb.bootstrap(delta, nreps=250, processes=2)
+
+    assert serial.replicates.shape == (250, len(serial.keys), len(bb.STATS))
+    np.testing.assert_array_equal(serial.replicates, pooled.replicates)
+    np.testing.assert_array_equal(serial.observed, pooled.observed)
+
+
+def test_empty(delta):
+    with pytest.raises(ValueError):
+        bb.bootstrap(delta.iloc[:0])
+    with pytest.raises(ValueError):
+        bb.bootstrap(delta.assign(rank_delta=np.nan))
+
+
+def test_newly_ranked_team_is_counted():
+    # D is unranked in week 1, wins and is #2 in week 2
+    rankings = pd.DataFrame([
+        (2013, w, 'ap', rank, team, team + ' Fullname', conf)
+        for (w, poll) in [
+            (1, [(1, 'A', 'SEC'), (2, 'B', 'SEC'), (3, 'C', 'ACC')]),
+            (2, [(1, 'A', 'SEC'), (2, 'D', 'ACC'), (3, 'B', 'SEC')]),
+        ]
+        for (rank, team, conf) in poll
+    ], columns=['year', 'week', 'rank_type', 'rank', 'codename', 'fullname', 'conf'])
+    results = pd.DataFrame([{
+        'year': 2013, 'week': 1, 'team_0': 'D', 'team_1': 'C', 'home_team': 'D',
+        'is_neutral_site': False, 'winning_team': 'D', 'losing_team': 'C',
+    }])
+
+    delta = bb.venue(wbv.get_rankings_delta(rankings, results), results)
+    d = delta[delta.codename == 'D'].iloc[0]
+    assert (d.conf, d.fullname, d.won, d.venue) == ('ACC', 'D Fullname', True, 'home')
+    assert d.rank_delta == 2
+
+    keys, values, starts, sizes = bb.grouped(delta)
+    assert sizes.sum() == len(delta) == 4
+    acc = keys[(keys.conf == 'ACC') & (keys.venue == 'home')].index
+    assert sizes[acc].tolist() == [1]
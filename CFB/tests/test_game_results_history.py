@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+"""
+columnar game results: parsing, caching and loading through a ReplayServer
+
+"""
+
+import fetch
+import game_results_history as grh
+import replay_server
+import synthetic
+
+
+SCORE_PATH = '/scoreboard/{year:}/{week:}'
+
+
+def test_parse_results_matches_dom():
+    rankings, results = synthetic.rankings_and_results(nseasons=1, nweeks=2)
+    for (w, r) in results.groupby('week'):
+        page = synthetic.scoreboard_page(r)
+        cols = grh.parse_results(page, 2002, w)
+        assert sorted(cols) == sorted(grh.RESULT_COLUMNS)
+        assert grh.nrows(cols) == len(r)
+        assert grh.records(cols) == grh.parse_results_dom(page, 2002, w)
+
+
+def test_load_results(tmpdir):
+    rankings, results = synthetic.rankings_and_results(nseasons=1, nweeks=3)
+    pages = dict(
+        (SCORE_PATH.format(year=y, week=w), synthetic.scoreboard_page(r))
+        for ((y, w), r) in results.groupby(['year', 'week'])
+    )
+    cachedir = str(tmpdir)
+    with replay_server.ReplayServer(pages) as server:
+        g = grh.EspnResultHistory(
+            url=server.url + SCORE_PATH, ystart=2002, yend=2002, wstart=1, wend=3,
+            cachedir=cachedir, fetcher=fetch.Fetcher(concurrency=2, rate=None)
+        )
+        g.load_results()
+
+    df = g.frame()
+    assert list(df.columns) == grh.RESULT_COLUMNS
+    assert len(df) == len(results)
+    assert df.week.tolist() == sorted(results.week.tolist())
+    assert g.results == grh.records(g.columns)
+
+    # units cached as lists of dicts (before results were columnar) still load
+    g.cache.put(2002, 1, grh.records(g.cache.get(2002, 1)))
+    g.load_results()
+    assert g.frame().equals(df)
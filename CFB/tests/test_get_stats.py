@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+get_stats against a ReplayServer serving small season archives
+
+"""
+
+import hashlib
+import io
+import os
+import zipfile
+
+import fetch
+import get_stats
+import replay_server
+
+
+ARCHIVE_PATH = '/cfbstats-{year:}.zip'
+RELEASE = u"""cfbstats release notes
+
+team.csv
+- Team Code
+- Name
+- Conference Code
+
+game.csv
+- Game Code
+- Date
+- Visit Team Code
+- Home Team Code
+"""
+COLUMNS = {
+    'team.csv': ['Team Code', 'Name', 'Conference Code'],
+    'game.csv': ['Game Code', 'Date', 'Visit Team Code', 'Home Team Code'],
+}
+
+
+def archive(columns=COLUMNS, files=get_stats.REQUIRED_FILES):
+    """ bytes of a season zip of files and RELEASE (under a folder, like the
+        real archives)
+
+    """
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        for fname in files:
+            header = columns.get(fname, ['Code'])
+            zf.writestr('season/' + fname, ','.join(header) + '\n' + ','.join('1' * len(header)) + '\n')
+        zf.writestr('season/' + get_stats.F_RELEASE, RELEASE.encode('utf-8'))
+    return buf.getvalue()
+
+
+def fetch_seasons(tmpdir, pages, ystart, yend, **kwargs):
+    datadir = str(tmpdir)
+    with replay_server.ReplayServer(pages) as server:
+        statuses = get_stats.cfbstats(
+            ystart, yend, url=server.url + ARCHIVE_PATH, datadir=datadir,
+            concurrency=2, fetcher=fetch.Fetcher(concurrency=2, rate=None, retries=0),
+            **kwargs
+        )
+        hits = sum(server.hits.values())
+    return statuses, hits
+
+
+def test_download(tmpdir):
+    body = archive()
+    statuses, hits = fetch_seasons(tmpdir, {ARCHIVE_PATH.format(year=2010): body}, 2010, 2010)
+
+    assert [s['status'] for s in statuses] == ['downloaded']
+    assert statuses[0]['bytes'] == len(body)
+    ydir = os.path.join(str(tmpdir), '2010')
+    assert sorted(get_stats.season_files(ydir)) == sorted(
+        get_stats.REQUIRED_FILES + [get_stats.F_RELEASE]
+    )
+    manifest = get_stats.read_manifest(ydir)
+    assert manifest['archive']['sha256'] == hashlib.sha256(body).hexdigest()
+    assert manifest['files']['team.csv']['columns'] == COLUMNS['team.csv']
+    # nothing is left behind in the staging area
+    assert os.listdir(str(tmpdir)) == ['2010']
+
+
+def test_checksum_mismatch(tmpdir):
+    pages = {ARCHIVE_PATH.format(year=2010): archive()}
+    statuses, hits = fetch_seasons(tmpdir, pages, 2010, 2010, checksums={'2010': '0' * 64})
+
+    assert statuses[0]['status'] == 'failed'
+    assert 'sha256' in statuses[0]['problems'][0]
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_matching_checksum(tmpdir):
+    body = archive()
+    statuses, hits = fetch_seasons(
+        tmpdir, {ARCHIVE_PATH.format(year=2010): body}, 2010, 2010,
+        checksums={2010: hashlib.sha256(body).hexdigest()}
+    )
+    assert statuses[0]['status'] == 'downloaded'
+
+
+def test_intact_season_is_skipped(tmpdir):
+    pages = dict((ARCHIVE_PATH.format(year=y), archive()) for y in [2010, 2011])
+    fetch_seasons(tmpdir, pages, 2010, 2011)
+
+    statuses, hits = fetch_seasons(tmpdir, pages, 2010, 2011)
+    assert [s['status'] for s in statuses] == ['intact', 'intact']
+    assert hits == 0
+
+    # a changed file makes the season not intact any more
+    with open(os.path.join(str(tmpdir), '2011', 'team.csv'), 'ab') as f:
+        f.write(b'2,Somewhere,1\n')
+    statuses, hits = fetch_seasons(tmpdir, pages, 2010, 2011)
+    assert [s['status'] for s in statuses] == ['intact', 'downloaded']
+    assert hits == 1
+
+
+def test_bad_archive(tmpdir):
+    pages = {ARCHIVE_PATH.format(year=2010): b'this is not a zip file'}
+    statuses, hits = fetch_seasons(tmpdir, pages, 2010, 2010)
+
+    assert statuses[0]['status'] == 'failed'
+    assert statuses[0]['problems'][0].startswith('bad archive')
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_missing_file(tmpdir):
+    files = [f for f in get_stats.REQUIRED_FILES if f != 'game.csv']
+    pages = {ARCHIVE_PATH.format(year=2010): archive(files=files)}
+    statuses, hits = fetch_seasons(tmpdir, pages, 2010, 2010)
+
+    assert statuses[0]['status'] == 'failed'
+    assert statuses[0]['problems'] == ['game.csv is missing']
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_missing_columns(tmpdir):
+    columns = dict(COLUMNS, **{'game.csv': COLUMNS['game.csv'][:-1]})
+    pages = {ARCHIVE_PATH.format(year=2010): archive(columns=columns)}
+    statuses, hits = fetch_seasons(tmpdir, pages, 2010, 2010)
+
+    assert statuses[0]['status'] == 'failed'
+    assert statuses[0]['problems'][0].startswith('game.csv lacks documented columns')
+    assert 'Home Team Code' in statuses[0]['problems'][0]
+
+
+def test_missing_archive(tmpdir):
+    statuses, hits = fetch_seasons(tmpdir, {}, 2010, 2010)
+    assert statuses[0]['status'] == 'failed'
+    assert hits == 1
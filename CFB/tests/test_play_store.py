@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+"""
+the playDic compatibility views of play_store
+
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import play_store
+
+
+@pytest.fixture(scope='module')
+def store():
+    n = 30000
+    rng = np.random.RandomState(0)
+    plays = pd.DataFrame({
+        'Game Code': rng.randint(0, 500, n),
+        'Play Number': np.arange(n) % 300,
+        'Down': rng.randint(1, 3, n),
+        'Distance': np.full(n, 10),
+        'Spot': rng.randint(1, 100, n),
+        'Offense Points': rng.randint(0, 40, n),
+        'Defense Points': rng.randint(0, 40, n),
+        'Result': rng.randint(-10, 10, n),
+        'Play Type': rng.choice(['RUSH', 'PASS'], n),
+    }).drop_duplicates(['Game Code', 'Play Number'])
+    return plays, play_store.PlayStore.from_frame(plays)
+
+
+def test_situation_view(store):
+    plays, s = store
+    view = play_store.PlayDicView(s)[1, 10]
+    expected = plays[plays.Down == 1].set_index(['Game Code', 'Play Number'])
+
+    items = view.items()
+    assert len(items) == len(view) == len(expected)
+    assert dict(items) == dict(view.iteritems())
+    assert view.values() == [rec for (key, rec) in items]
+
+    for (key, rec) in items[:100]:
+        assert view[key] == rec
+        assert key in view
+        row = expected.loc[key]
+        assert rec['Spot'] == row.Spot
+        assert rec['Offense Points'] == row['Offense Points']
+        assert rec['Defense Points'] == row['Defense Points']
+        assert rec['Play Type'] == row['Play Type']
+
+    assert (-1, -1) not in view
+    assert view.get((-1, -1)) is None
+    with pytest.raises(KeyError):
+        view[-1, -1]
+
+
+def test_unknown_situation(store):
+    plays, s = store
+    view = play_store.PlayDicView(s)[4, 1]
+    assert len(view) == 0
+    assert view.items() == []
+
+
+def test_missing_points(store):
+    plays, s = store
+    rec = play_store.PlayStore.from_frame(plays.drop(['Offense Points'], axis=1)).record(0)
+    assert rec['Offense Points'] == -1
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+sql_store tables and indexes, in an in-memory database
+
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import conference_membership_history as cmh
+import game_results_history as grh
+import ranking_history as rh
+import sql_queries
+import sql_store
+
+
+@pytest.fixture
+def conn():
+    conn = sql_store.connect(':memory:')
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('table, columns', [
+    ('rankings', rh.RANKING_COLUMNS),
+    ('results', grh.RESULT_COLUMNS),
+    ('conferences', cmh.CONFERENCE_COLUMNS),
+])
+def test_no_records(conn, table, columns):
+    sql_store.load_records(conn, table, [{'year': 2013}], columns)
+    sql_store.load_records(conn, table, [], columns)
+
+    assert sql_store.table_columns(conn, table) == columns
+    assert len(sql_queries.select(conn, table, year=2013)) == 0
+
+
+def test_records(conn):
+    records = [
+        {'rank_type': 'ap', 'rank': 1, 'codename': 'ALA', 'fullname': 'Alabama', 'year': 2013, 'week': 2},
+        {'rank_type': 'ap', 'rank': 2, 'codename': 'OSU', 'fullname': 'Ohio State', 'year': 2013, 'week': 2},
+    ]
+    sql_store.load_records(conn, 'rankings', records, rh.RANKING_COLUMNS)
+
+    df = sql_queries.rankings(conn, years=[2013], rankType='ap')
+    assert df.codename.tolist() == ['ALA', 'OSU']
+
+
+def test_situation_index(conn):
+    n = 1000
+    rng = np.random.RandomState(0)
+    plays = pd.DataFrame({
+        'Game Code': rng.randint(0, 50, n),
+        'Play Number': np.arange(n),
+        'Down': rng.randint(1, 5, n),
+        'Distance': rng.randint(1, 20, n),
+    })
+    sql_store.ensure_sources(conn)
+    sql_store.load_season_table(conn, 'play', 2013, [plays], {})
+    sql_store.create_indexes(conn)
+
+    clause, params = sql_queries.where(Down=3, Distance=7, year=[2013])
+    plan = ' '.join(str(row[-1]) for row in conn.execute(
+        'EXPLAIN QUERY PLAN SELECT * FROM play' + clause, params
+    ))
+    assert 'ix_play_year_down_distance' in plan
+    assert len(sql_queries.plays(conn, down=3, distance=7, years=[2013])) == (
+        (plays.Down == 3) & (plays.Distance == 7)
+    ).sum()
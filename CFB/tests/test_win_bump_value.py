@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+"""
+get_rankings_delta against the week-at-a-time get_rankings_delta_by_week it
+replaced, on synthetic rankings and results
+
+"""
+
+import pandas.util.testing as pdt
+import pytest
+
+import synthetic
+import win_bump_value as wbv
+
+
+KEYS = ['year', 'week', 'rank_type', 'codename']
+
+
+def ordered(delta):
+    return delta.sort_values(KEYS).reset_index(drop=True)
+
+
+@pytest.fixture(scope='module')
+def history():
+    return synthetic.rankings_and_results(nseasons=2, nweeks=4)
+
+
+def test_matches_by_week(history):
+    rankings, results = history
+    delta = wbv.get_rankings_delta(rankings, results)
+    oracle = wbv.get_rankings_delta_by_week(rankings, results)
+
+    assert len(delta) == len(oracle) > 0
+    pdt.assert_frame_equal(ordered(delta), ordered(oracle[delta.columns]))
+
+
+def test_matches_row_by_row(history):
+    rankings, results = history
+    rankings = rankings[(rankings.year == rankings.year.min()) & (rankings.week <= 2)]
+    delta = wbv.get_rankings_delta(rankings, results)
+    oracle = wbv.get_rankings_delta_by_week(rankings, results, vectorized=False)
+
+    pdt.assert_frame_equal(
+        ordered(delta), ordered(oracle[delta.columns]), check_dtype=False
+    )
+
@@ -27,14 +27,19 @@ Usage:
 
 import argparse
 import logging
-import logging.config
 import os
-import pandas as pd
-import yaml
 
-import conference_membership_history as cmh
-import ranking_history as rh
-import game_results_history as grh
+import lazyimport
+import logconfig
+import metrics
+
+np = lazyimport.lazy_import('numpy')
+pd = lazyimport.lazy_import('pandas')
+cmh = lazyimport.lazy_import('conference_membership_history')
+rh = lazyimport.lazy_import('ranking_history')
+grh = lazyimport.lazy_import('game_results_history')
+tc = lazyimport.lazy_import('team_codes')
+sqlq = lazyimport.lazy_import('sql_queries')
 
 
 # ----------------------------- #
@@ -42,45 +47,59 @@ import game_results_history as grh
 # ----------------------------- #
 
 HERE = os.path.dirname(os.path.realpath(__file__))
+# ranking columns a newly ranked team takes from next week's rankings
+CARRIED = ['conf', 'fullname']
 logger = logging.getLogger("win_bump_value.py")
-LOGCONF = os.path.join(HERE, 'logging.yaml')
-with open(LOGCONF, 'rb') as f:
-    logging.config.dictConfig(yaml.load(f))
 
 
 # ----------------------------- #
 #   data acquisition            #
 # ----------------------------- #
 
-def get_rankings(reloadRankings=False, reloadConferences=False):
-    r = rh.EspnRankingHistory()
-    r.load_rankings(forceReload=reloadRankings)
-    rankings = pd.DataFrame(r.rankings)
+def get_rankings(reloadRankings=False, reloadConferences=False, conn=None):
+    """ the rankings df, from the scrapers or (given a connection, see
+        sql_queries.py) from the sqlite store
 
-    # drop the 0-rank teams
-    rankings = rankings[rankings['rank'] != 0]
+    """
+    with metrics.span('get_rankings'):
+        if conn is not None:
+            return rankings_frame(
+                sqlq.rankings(conn).to_dict('records'),
+                sqlq.conferences(conn).to_dict('records')
+            )
+        r = rh.EspnRankingHistory()
+        r.load_rankings(forceReload=reloadRankings)
 
-    c = cmh.EspnConferenceHistory()
-    c.load_conferences(forceReload=reloadConferences)
-    conferences = pd.DataFrame(c.conferences)
+        c = cmh.EspnConferenceHistory()
+        c.load_conferences(forceReload=reloadConferences)
 
-    # add in conference affiliation
-    rankings = rankings.merge(
-        conferences[['codename', 'year', 'conf']],
-        how='left',
-        on=['codename', 'year']
-    )
+        return rankings_frame(r.rankings, c.conferences)
+
+
+def rankings_frame(rankingRecords, conferenceRecords):
+    """ the rankings df from lists of scraped ranking and conference
+        membership dicts
+
+    """
+    with metrics.span('rankings_frame') as s:
+        s.add('rows_in', len(rankingRecords))
+        rankings = _rankings_frame(rankingRecords, conferenceRecords)
+        s.add('rows_out', len(rankings))
+    return rankings
+
+
+def _rankings_frame(rankingRecords, conferenceRecords):
+    rankings = pd.DataFrame(rankingRecords)
+
+    # drop the 0-rank teams
+    rankings = rankings[rankings['rank'] != 0]
 
-    # UC Davis and North Dakota State conf affiliation aren't available :(
-    rankings.loc[
-        (rankings.fullname == 'UC Davis') & (rankings.year == 2003), 'conf'
-    ] = 'D2 Independent'
-    rankings.loc[
-        (rankings.fullname == 'UC Davis') & (rankings.year == 2004), 'conf'
-    ] = 'Great West Conference'
-    rankings.loc[
-        rankings.fullname == 'North Dakota State', 'conf'
-    ] = 'Great West Conference'
+    # add in conference affiliation. UC Davis and North Dakota State conf
+    # affiliation aren't available :( -- see conference_overrides.csv
+    memberships = cmh.MembershipIndex.from_records(conferenceRecords)
+    rankings = rankings.assign(conf=memberships.lookup(
+        rankings.codename.values, rankings.year.values, rankings.fullname.values
+    ))
 
     # ncaa_college_football_power_rankings in 2005 and prior are impossible
     # bullshit to parse
@@ -99,10 +118,33 @@ def validate_rankings_data(rankings):
     assert all(rankings.conf.notnull())
 
 
-def get_game_results(reloadResults=False):
-    r = grh.EspnResultHistory()
-    r.load_results(forceReload=reloadResults)
-    results = pd.DataFrame(r.results)
+def get_game_results(reloadResults=False, conn=None):
+    """ the game results df, from the scraper or (given a connection, see
+        sql_queries.py) from the sqlite store
+
+    """
+    with metrics.span('get_game_results'):
+        if conn is not None:
+            return results_frame(sqlq.results(conn))
+        r = grh.EspnResultHistory()
+        r.load_results(forceReload=reloadResults)
+        return results_frame(r.frame())
+
+
+def results_frame(resultRecords):
+    """ the game results df from scraped results: a dataframe, a dict of
+        column --> list or a list of result dicts
+
+    """
+    with metrics.span('results_frame') as s:
+        results = pd.DataFrame(resultRecords)
+        s.add('rows_in', len(results))
+        results = _results_frame(results)
+        s.add('rows_out', len(results))
+    return results
+
+
+def _results_frame(results):
 
     # limit only to games that *have* been played and had a winner (ignore ties)
     results = results[results.winning_team.notnull()]
@@ -121,6 +163,20 @@ def validate_results_data(results):
     assert all(results.losing_team != results.winning_team)
 
 
+def add_team_codes(rankings, results):
+    """ (rankings, results) with the cfbstats Team Code of every espn team
+        (team_code, team_0_code and team_1_code; -1 if unresolved), to join
+        them with the csv data (see team_codes.py)
+
+    """
+    with metrics.span('add_team_codes'):
+        index = tc.load(tc.names(rankings, results))
+        rankings = index.assign(rankings, 'codename', 'fullname', out='team_code')
+        results = index.assign(results, 'team_0', 'team_0_full', out='team_0_code')
+        results = index.assign(results, 'team_1', 'team_1_full', out='team_1_code')
+    return rankings, results
+
+
 def get_rankings_delta(rankings, results):
     """ re-form the rankings df into a df of rankings week-to-week changes.
 
@@ -144,11 +200,100 @@ def get_rankings_delta(rankings, results):
             2. Failure to find rankings (i.e. bad data) is equivalent to being
                unranked. So you best get clean data ;)
 
-        Finally, only rely on the codename factor. Others can be null
-        (e.g. unranked teams becoming ranked)
+        Finally, only rely on the codename factor. Teams that only show up in
+        next week's rankings (unranked teams becoming ranked) get their
+        conference and fullname from there, and 'won' from the results; other
+        columns of theirs can be null
+
+        All (year, week) --> (year, week + 1) deltas are computed at once: the
+        rankings are joined to themselves shifted by one week and the unranked
+        fill and jump statistics are done per (year, week, rank_type) group.
+        get_rankings_delta_by_week is the original week-at-a-time loop, kept as
+        a reference implementation.
 
     """
-    # rankings with wins
+    with metrics.span('get_rankings_delta') as s:
+        s.add('rows_in', len(rankings))
+        rww = rankings_with_wins(rankings, results)
+        keys = ['year', 'week', 'codename', 'rank_type']
+
+        # next week's rankings, labelled with the week they follow
+        rNext = rww[keys + ['rank'] + CARRIED].copy()
+        rNext.loc[:, 'week'] = rNext.week - 1
+
+        # only weeks that have a following week (i.e. skip the last week of
+        # the year) and following weeks that have a preceding one
+        weekPairs = rww[['year', 'week']].drop_duplicates().merge(
+            right=rNext[['year', 'week']].drop_duplicates(),
+            how='inner',
+            on=['year', 'week']
+        )
+
+        rankingsDelta = rww.merge(right=weekPairs, how='inner', on=['year', 'week']).merge(
+            right=rNext.merge(right=weekPairs, how='inner', on=['year', 'week']),
+            how='outer',
+            on=keys,
+            suffixes=('_now', '_next')
+        )
+        rankingsDelta = rankingsDelta.sort_values(
+            ['year', 'week'], kind='mergesort'
+        ).reset_index(drop=True)
+        rankingsDelta = carry_next(rankingsDelta)
+
+        # replace all NaN rankings in any ranking type with the maximum values
+        # plus 1 (e.g. ap top 25, unranked == 26)
+        rt = rankingsDelta.groupby(['year', 'week', 'rank_type'])
+        for col in ['rank_now', 'rank_next']:
+            rankingsDelta.loc[:, col] = rankingsDelta[col].fillna(
+                rt[col].transform('max') + 1
+            )
+
+        # regular numeric delta
+        rankingsDelta.loc[:, 'rank_delta'] = rankingsDelta.rank_now - rankingsDelta.rank_next
+
+        # we rely on the 'won' factor, but the outer merge introduced NaNs
+        rankingsDelta.loc[:, 'won'] = won_flags(rankingsDelta, results)
+
+        # jumping for joy shit
+        with metrics.span('jump_counts'):
+            jumps = jump_counts(rankingsDelta, by=['year', 'week', 'rank_type'])
+        rankingsDelta = rankingsDelta.merge(
+            right=jumps, how='left', left_index=True, right_index=True
+        )
+        s.add('rows_out', len(rankingsDelta))
+
+    return rankingsDelta
+
+
+def carry_next(delta):
+    """ delta (merged with next week's rankings, columns of CARRIED with
+        the suffixes _now and _next) with one column of each CARRIED, from
+        next week for the teams that weren't ranked this week
+
+    """
+    for col in CARRIED:
+        now, nxt = '{}_now'.format(col), '{}_next'.format(col)
+        delta = delta.rename(columns={now: col})
+        delta.loc[:, col] = delta[col].combine_first(delta.pop(nxt))
+    return delta
+
+
+def won_flags(df, results):
+    """ bool array: whether the team (codename) of each row of df won a
+        game that year and week
+
+    """
+    winners = results[['year', 'week', 'winning_team']].drop_duplicates()
+    return df[['year', 'week', 'codename']].merge(
+        right=winners,
+        how='left',
+        left_on=['year', 'week', 'codename'],
+        right_on=['year', 'week', 'winning_team']
+    ).winning_team.notnull().values
+
+
+def rankings_with_wins(rankings, results):
+    """ rankings with a 'won' column (see get_rankings_delta) """
     rww = rankings.merge(
         right=results[['year', 'week', 'winning_team']],
         how='left',
@@ -156,6 +301,20 @@ def get_rankings_delta(rankings, results):
         right_on=['year', 'week', 'winning_team']
     )
     rww.loc[:, 'won'] = rww.winning_team.notnull()
+    return rww
+
+
+def get_rankings_delta_by_week(rankings, results, vectorized=True):
+    """ week-at-a-time version of get_rankings_delta (see that docstring)
+
+        this was the original implementation; it is quadratic in the total
+        number of rows (every week is appended to the growing result) and is
+        kept as a reference for get_rankings_delta. The jump statistics are
+        calculated with jump_counts; vectorized=False falls back to the (much
+        slower) row-by-row jump_stats.
+
+    """
+    rww = rankings_with_wins(rankings, results)
 
     rankingsDelta = None
     for (y, r) in rww.groupby('year'):
@@ -163,18 +322,22 @@ def get_rankings_delta(rankings, results):
         weeks = r.week.unique()
         for w in weeks:
             wNow = r[r.week == w]
-            wNext = r[r.week == (w + 1)][['codename', 'rank', 'rank_type']]
+            wNext = r[r.week == (w + 1)][['codename', 'rank', 'rank_type'] + CARRIED]
 
             # skip the last week of the year
             if wNext.empty:
                 continue
 
-            wDelta = wNow.merge(
+            wDelta = carry_next(wNow.merge(
                 right=wNext,
                 how='outer',
                 on=['codename', 'rank_type'],
                 suffixes=('_now', '_next')
-            )
+            ))
+
+            # merged items could have NaN years or weeks -- fix that easy
+            wDelta.loc[:, 'week'] = w
+            wDelta.loc[:, 'year'] = y
 
             # replace all NaN rankings in any ranking type with the maximum
             # values plus 1 (e.g. ap top 25, unranked == 26)
@@ -187,18 +350,17 @@ def get_rankings_delta(rankings, results):
             wDelta.loc[:, 'rank_delta'] = wDelta.rank_now - wDelta.rank_next
 
             # we rely on the 'won' factor, but the outer merge introduced NaNs
-            wDelta.loc[:, 'won'] = wDelta.won.fillna(False)
+            wDelta.loc[:, 'won'] = won_flags(wDelta, results)
 
             # jumping for joy shit
-            jumps = wDelta.apply(jump_stats, axis=1, args=(wDelta,))
+            if vectorized:
+                jumps = jump_counts(wDelta)
+            else:
+                jumps = wDelta.apply(jump_stats, axis=1, args=(wDelta,))
             wDelta = wDelta.merge(
                 right=jumps, how='left', left_index=True, right_index=True
             )
 
-            # merged items could have NaN years or weeks -- fix that easy
-            wDelta.loc[:, 'week'] = w
-            wDelta.loc[:, 'year'] = y
-
             if rankingsDelta is None:
                 rankingsDelta = wDelta.copy()
             else:
@@ -233,6 +395,57 @@ def jumped_by(row, wDelta):
     ]
 
 
+def jump_counts(wDelta, by=None):
+    """ vectorized jump_stats for every row of wDelta at once
+
+        For a row i, the teams it jumped are the rows j (of the same rank type)
+        with rank_now_j < rank_now_i and rank_next_j > rank_next_i; the teams
+        it was jumped by have both inequalities flipped. Both are counted per
+        group of `by` (default: rank type) with dominance_counts instead of
+        building three boolean masks over the whole frame for every row.
+
+    """
+    by = ['rank_type'] if by is None else by
+    now = wDelta.rank_now.values.astype(float)
+    nxt = wDelta.rank_next.values.astype(float)
+    won = wDelta.won.values.astype(bool).astype(int)
+
+    jumps = dict(
+        (k, np.zeros(len(wDelta), dtype=np.int64))
+        for k in [
+            'teams_jumped', 'teams_jumped_by',
+            'winning_teams_jumped', 'winning_teams_jumped_by'
+        ]
+    )
+    for (k, ix) in wDelta.groupby(by).indices.items():
+        j, wj = dominance_counts(now[ix], nxt[ix], won[ix])
+        jb, wjb = dominance_counts(-now[ix], -nxt[ix], won[ix])
+        jumps['teams_jumped'][ix] = j
+        jumps['winning_teams_jumped'][ix] = wj
+        jumps['teams_jumped_by'][ix] = jb
+        jumps['winning_teams_jumped_by'][ix] = wjb
+
+    jumps = pd.DataFrame(jumps, index=wDelta.index)
+
+    return jumps
+
+
+def dominance_counts(first, second, weights):
+    """ for every i, count (and sum the weights of) the j with
+        first[j] < first[i] and second[j] > second[i]
+
+        one broadcast comparison of every pair of rows -- a group is a single
+        poll of one week, a couple hundred rows at most. NaN rows never match
+        anything (same as the comparisons in jumped / jumped_by).
+
+    """
+    with np.errstate(invalid='ignore'):
+        dominated = (
+            (first[np.newaxis, :] < first[:, np.newaxis])
+            & (second[np.newaxis, :] > second[:, np.newaxis])
+        )
+    return dominated.sum(axis=1), dominated.dot(np.asarray(weights, dtype=np.int64))
+
 
 def week_results(row, results):
     return results[
@@ -252,12 +465,15 @@ def better_teams(row, wDelta, rankkey, nonwinners=True):
 
 
 def make_buoyancy_df():
-    rankings = get_rankings()
-    results = get_game_results()
+    """ every stage is timed as a metrics span (see metrics.py) """
+    with metrics.span('make_buoyancy_df'):
+        rankings = get_rankings()
+        results = get_game_results()
+        rankings, results = add_team_codes(rankings, results)
 
-    # add week-to-week changes in rankings information (when available) to the
-    # results df
-    rww = get_rankings_delta(rankings, results)
+        # add week-to-week changes in rankings information (when available) to
+        # the results df
+        rww = get_rankings_delta(rankings, results)
 
 
 
@@ -288,6 +504,8 @@ def parse_args():
 
 if __name__ == '__main__':
 
+    logconfig.configure()
+
     args = parse_args()
 
     main()